@@ -1,6 +1,6 @@
 import copy
+import pickle
 import random
-from collections import defaultdict
 from math import sqrt, pow
 
 import gym
@@ -12,8 +12,9 @@ from typing import List, Tuple, Dict
 
 from ped_env.classes import ACTION_DIM, PedsRLHandler, PedsRLHandlerWithPlanner
 from ped_env.pathfinder import AStar
-from ped_env.listener import MyContactListener
-from ped_env.objects import BoxWall, Person, Exit, Group
+from ped_env.listener import MyContactListener, OverlapContactDetector
+from ped_env.spawner import CrowdSpawner
+from ped_env.objects import BoxWall, Person, Exit, Group, PersonState
 from ped_env.utils.colors import (ColorBlue, ColorWall, ColorRed)
 from ped_env.utils.misc import ObjectType
 from ped_env.utils.maps import Map
@@ -25,10 +26,12 @@ vel_iters, pos_iters = 6, 2
 
 class PedsMoveEnvFactory():
     GROUP_SIZE = 0.5
-    def __init__(self, world: b2World, l1, l2):
+    def __init__(self, world: b2World, l1, l2, use_sensor=True, spawner: CrowdSpawner = None):
         self.world = world
         self.l1 = l1
         self.l2 = l2
+        self.use_sensor = use_sensor
+        self.spawner = spawner
 
     def create_walls(self, start_nodes, width_height, object_type, color=ColorWall, CreateClass=BoxWall):
         if CreateClass is Exit:
@@ -47,10 +50,18 @@ class PedsMoveEnvFactory():
         :param exit_type:
         :return:
         '''
+        if isinstance(start_nodes, np.ndarray):
+            start_nodes = start_nodes.tolist()
         return [Person(self.world, start_nodes[i][0],
-                       start_nodes[i][1], exit_type, self.l1, self.l2) for i in range(len(start_nodes))]
-
-    def inner_create_persons_in_radius(self, start_node, radius, person_num, exit_type, test_mode=False):
+                       start_nodes[i][1], exit_type, self.l1, self.l2, use_sensor=self.use_sensor)
+                for i in range(len(start_nodes))]
+
+    def inner_create_persons_in_radius(self, start_node, radius, person_num, exit_type, test_mode=False, spawn_type=None):
+        if self.spawner is not None:
+            # 一次性为整组行人选出互不重叠的位置
+            center = (start_node[0] + radius / 2, start_node[1] + radius / 2)
+            start_pos = self.spawner.sample_group(center, person_num, spawn_type)
+            return self.create_people(start_pos, exit_type, test_mode)
         start_pos = []
         for i in range(person_num):
             new_x, new_y = start_node[0] + radius * random.random(), start_node[1] + radius * random.random()
@@ -95,8 +106,12 @@ class PedsMoveEnvFactory():
             #         new_y = int(new_y) + 0.5 #设置随机点为方格的正中心
             #         break
             exit_type = terrain.get_random_exit(idx)
-            new_x, new_y = random.sample(start_point_dic[exit_type], 1)[0]
-            group = self.inner_create_persons_in_radius((new_x, new_y), self.GROUP_SIZE, num, exit_type, test_mode)
+            if self.spawner is not None:
+                new_x, new_y = self.spawner.random_center(exit_type) - self.GROUP_SIZE / 2
+            else:
+                new_x, new_y = random.sample(start_point_dic[exit_type], 1)[0]
+            group = self.inner_create_persons_in_radius((new_x, new_y), self.GROUP_SIZE, num, exit_type, test_mode,
+                                                        spawn_type=exit_type)
             self.set_group_process(group, groups, group_dic, persons)
         return persons
 
@@ -117,7 +132,9 @@ class PedsMoveEnv(gym.Env):
                  use_planner = False,
                  random_init_mode:bool = False,
                  train_mode:bool = True,
-                 debug_mode:bool = False):
+                 debug_mode:bool = False,
+                 use_contact_listener:bool = True,
+                 overlap_free_spawn:bool = False):
         '''
         一个基于Box2D和pyglet的多行人强化学习仿真环境
         对于一个有N个人的环境，其状态空间为：[o1,o2,...,oN]，每一个o都是一个长度为14的list，其代表的意义为：
@@ -135,6 +152,11 @@ class PedsMoveEnv(gym.Env):
         :param train_mode: 当为False时，直到所有行人到达出口才会重置环境，当为True时，一旦所有leader到达出口才会重置环境
         :param debug_mode: 是否debug
         :param group_size:一个团体的人数，其中至少包含1个leader和多个follower
+        :param use_contact_listener: 为False时不再使用传感器夹具与Box2D接触回调，而是在每次world.Step前后
+            通过OverlapContactDetector向量化地计算碰撞与探测信息，适用于行人数量较多的场景
+        :param overlap_free_spawn: 为True时使用CrowdSpawner在空地格子中为整组行人选择互不重叠的生成位置，
+            为False时保持原先在半径内随机生成(可能互相重叠)的方式。两者的初始位置与随机数序列不同，
+            默认为False以保持与已有实验结果一致
         '''
         super(PedsMoveEnv, self).__init__()
 
@@ -168,43 +190,44 @@ class PedsMoveEnv(gym.Env):
         #for raycast and aabb_query debug
         self.train_mode = train_mode
         self.debug_mode = debug_mode
+        self.use_contact_listener = use_contact_listener
+        self.contact_detector = None
+        self.overlap_free_spawn = overlap_free_spawn
+        self.spawner = None
         self.vec = [0.0 for _ in range(self.agent_count)]
 
         self.path_finder = AStar(self.terrain)
         #assert group_size[1] <= 6_map11_use
+        self.recorder = None
 
-    def start(self, maps: np.ndarray, spawn_maps: np.ndarray, person_num_sum: int = 60):
+    def _create_world(self):
         self.world = b2World(gravity=(0, 0), doSleep=True)
-        self.listener = MyContactListener(self)  # 现在使用aabb_query的方式来判定
-        self.world.contactListener = self.listener
+        if self.use_contact_listener:
+            self.listener = MyContactListener(self)  # 现在使用aabb_query的方式来判定
+            self.world.contactListener = self.listener
+        else:
+            self.listener = None
+
+    def start(self, maps: np.ndarray, spawn_maps: np.ndarray, person_num_sum: int = 60):
+        self._create_world()
 
         self.batch = pyglet.graphics.Batch()
         self.display_level = pyglet.graphics.OrderedGroup(0)
         self.debug_level = pyglet.graphics.OrderedGroup(1)
-        self.factory = PedsMoveEnvFactory(self.world, self.display_level, self.debug_level)
-
         if not self.init_map_points:
-            # 根据shape为50*50的map来构建1*1的墙，当该处值为1代表是墙
-            self.start_nodes_obs = []
-            self.start_nodes_wall = []
-            self.start_nodes_exit = []
-
-            #按照从左往右，从上到下的遍历顺序
-            for j in range(maps.shape[1]):
-                for i in range(maps.shape[0]):
-                    if maps[i, j] == 1:
-                        self.start_nodes_obs.append((i + 0.5, j + 0.5))
-                    elif maps[i, j] == 2:
-                        self.start_nodes_wall.append((i + 0.5, j + 0.5))
-                    elif 9 >= maps[i, j] >= 3:
-                        self.start_nodes_exit.append((i + 0.5, j + 0.5, maps[i, j]))
-
-            self.start_point_dic = defaultdict(list)
-            for j in range(spawn_maps.shape[1]):
-                for i in range(spawn_maps.shape[0]):
-                    if 9 >= spawn_maps[i, j] >= 3:
-                        self.start_point_dic[spawn_maps[i, j]].append((i + 0.5, j + 0.5))
+            # 墙体、出口与生成点的格子列表由地图计算一次后缓存，这里不再逐格扫描
+            derived = self.terrain.derived
+            self.start_nodes_obs = derived.obstacle_nodes
+            self.start_nodes_wall = derived.wall_nodes
+            self.start_nodes_exit = derived.exit_nodes
+            self.start_point_dic = derived.start_point_dic
+            if self.overlap_free_spawn:
+                self.spawner = CrowdSpawner(self.terrain, Person.radius)
             self.init_map_points = True
+        if self.spawner is not None:
+            self.spawner.reset()
+        self.factory = PedsMoveEnvFactory(self.world, self.display_level, self.debug_level,
+                                          use_sensor=self.use_contact_listener, spawner=self.spawner)
 
         self.obstacles = self.factory.create_walls(self.start_nodes_obs, (1, 1),  ObjectType.Obstacle, color=ColorBlue)
         self.exits = self.factory.create_walls(self.start_nodes_exit, (1, 1),  ObjectType.Exit, color=ColorRed, CreateClass=Exit)  # 创建出口
@@ -242,14 +265,36 @@ class PedsMoveEnv(gym.Env):
         for ped in self.peds:
             if ped.is_leader:
                 self.leaders.append(ped)
+        if not self.use_contact_listener:
+            self.contact_detector = OverlapContactDetector(self)
+
+    def set_recorder(self, recorder):
+        '''
+        设置用于记录行人轨迹的TrajectoryRecorder，在下一次reset时开始记录，传入None则停止记录
+        :param recorder:
+        :return:
+        '''
+        self.recorder = recorder
 
     def setup_graphics(self):
         for ele in self.elements:
             ele.setup(self.batch, self.terrain.get_render_scale())
 
+    def update_graphics(self):
+        '''
+        墙体与出口的图形在setup_graphics中只创建一次，之后每帧只更新行人图形的位置
+        :return:
+        '''
+        render_scale = self.terrain.get_render_scale()
+        for ped in self.peds:
+            if not ped.has_removed:
+                ped.update_graphics(self.batch, render_scale)
+
     def delete_person(self, per: Person):
         self.pop_from_render_list(per.id)
         self.left_person_num -= 1
+        if self.contact_detector is not None:
+            self.contact_detector.remove(per)
         per.delete(self.world)
         if per.is_leader: self.left_leader_num -= 1
 
@@ -305,6 +350,8 @@ class PedsMoveEnv(gym.Env):
         self.start(self.terrain.map, self.terrain.map_spawn, person_num_sum=self.person_num)
         if self.person_handler.use_planner:
             self.person_handler.init_exit_kd_trees() #初始化KDTree以供后续使用
+        if self.recorder is not None:
+            self.recorder.begin_episode(self)
         # 添加初始观察状态
         init_obs = []
         for ped in self.peds:
@@ -339,14 +386,21 @@ class PedsMoveEnv(gym.Env):
                 #施加合力给行人
                 ped.body.ApplyForceToCenter(b2Vec2(ped.total_force), wake=True)
                 ped.total_force = np.zeros([2])
+            if self.contact_detector is not None: #与Box2D一样在求解之前根据当前位置更新接触
+                self.contact_detector.update()
             self.world.Step(1 / TICKS_PER_SEC, vel_iters, pos_iters)
             self.world.ClearForces()
+            if self.contact_detector is not None:
+                self.contact_detector.sync()
             for ped in self.peds:
                 ped.update(self.exits, self.step_in_env, self.terrain.map)
 
             for group in self.groups:
                 group.update()
 
+            if self.recorder is not None:
+                self.recorder.record(self, self.step_in_env + i + 1)
+
         # 该环境中智能体是合作关系，因此使用统一奖励为好
         obs, rewards = self.person_handler.step(self.peds, self.group_dic, int(self.step_in_env / self.frame_skipping))
 
@@ -370,14 +424,173 @@ class PedsMoveEnv(gym.Env):
         for group in self.groups:
             leader_pos.append(group.leader.pos.tolist()) #添加leader在最后一帧的位置
             leader_step.append(group.leader.exit_in_step)
+        # 所有仍在场景中的行人位置，用于统计整个人群的热力图
+        crowd_pos = np.array([(ped.x, ped.y) for ped in self.peds if not ped.has_removed], dtype=np.float32).reshape([-1, 2])
         info = [
             leader_step,
             self.col_with_wall,
             self.col_with_agent,
-            leader_pos
+            leader_pos,
+            crowd_pos
         ]
         return obs, rewards, is_done, info
 
+    def get_state(self) -> bytes:
+        '''
+        将当前时刻的环境状态(所有行人的刚体状态、团体分配、到达标记、计数器以及随机数状态)
+        序列化为一段二进制数据，之后可通过set_state恢复到该时刻，用于规划或者从某一中间状态开始的多分支推演，
+        该方法不会修改环境
+        :return: 二进制的状态快照
+        '''
+        body_state = np.zeros([len(self.peds), 8], dtype=np.float64)
+        ped_flags = np.zeros([len(self.peds), 6], dtype=np.int32)
+        for idx, ped in enumerate(self.peds):
+            if not ped.has_removed:
+                body = ped.body
+                body_state[idx, :6] = [body.position.x, body.position.y, body.angle,
+                                       body.linearVelocity.x, body.linearVelocity.y, body.angularVelocity]
+            body_state[idx, 6:8] = [ped.fij_force_last_eps[0], ped.fij_force_last_eps[1]]
+            ped_flags[idx] = [ped.id, ped.exit_type, ped.is_done, ped.has_removed,
+                              ped.exit_in_step, ped.person_state.value]
+        state = {
+            "body_state": body_state,
+            "ped_flags": ped_flags,
+            # 每个团体保存为[leader_id, follower_id, ...]，leader可能在episode中发生变化
+            "groups": [[group.leader.id] + [f.id for f in group.followers] for group in self.groups],
+            "collisions": [(list(ped.collide_agents.keys()), list(ped.collide_obstacles.keys()),
+                            list(ped.detected_agents.keys()), list(ped.detected_obstacles.keys()))
+                           for ped in self.peds],
+            "a_star_paths": {ped.id: ped.a_star_path for ped in self.peds if ped.a_star_path is not None},
+            "counters": np.array([self.step_in_env, self.left_person_num, self.left_leader_num,
+                                  self.col_with_agent, self.col_with_wall], dtype=np.int64),
+            "distance_to_exit": np.array(self.distance_to_exit, dtype=np.float64),
+            "points_in_last_step": np.array(self.points_in_last_step, dtype=np.float64).reshape([-1, 2]),
+            "last_observation": copy.deepcopy(self.person_handler.last_observation),
+            "rng_state": (random.getstate(), np.random.get_state()),
+        }
+        return pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+
+    def set_state(self, state: bytes, restore_rng: bool = True, rebuild: bool = False):
+        '''
+        将get_state得到的快照恢复到当前环境中，要求当前环境与快照来自同一个episode(行人数量与编号一致)，
+        已经被移除的行人会被重新加入物理世界，快照中已到达的行人会被移除
+        :param state: get_state返回的二进制数据
+        :param restore_rng: 是否同时恢复python与numpy的随机数状态
+        :param rebuild: 为False时直接将位置与速度写入现有的刚体，Box2D的warm-start冲量会沿用当前时刻的值；
+                        为True时按照快照重建整个物理世界，之后的运行结果只取决于快照本身，
+                        从同一快照重建后的多个分支逐步完全一致，但代价与地图和行人数量成正比
+        :return: 恢复后leader的观察状态
+        '''
+        self._load_state(pickle.loads(state), restore_rng, rebuild)
+        obs = []
+        for ped in self.peds:
+            if ped.is_leader:
+                obs.append(self.person_handler.get_observation(ped, self.group_dic[ped], 0))
+        return obs
+
+    def _restore_bodies(self, body_state, removed):
+        '''
+        将快照中的位置与速度写入现有物理世界中的刚体
+        '''
+        for idx, ped in enumerate(self.peds):
+            if removed[idx]:
+                if not ped.has_removed:
+                    ped.delete(self.world)
+                continue
+            x, y, angle, vx, vy, w = body_state[idx, :6].tolist()
+            if ped.has_removed:
+                ped.create_body(self.world, x, y)
+            ped.body.transform = ((x, y), angle)
+            ped.body.linearVelocity = (vx, vy)
+            ped.body.angularVelocity = w
+            ped.body.awake = True
+        # 按新的位置更新接触，回调中对计数器与碰撞字典的修改会在_load_state中被快照覆盖
+        self.world.Step(0, vel_iters, pos_iters)
+
+    def _rebuild_world(self, body_state, removed):
+        '''
+        在新的物理世界中按照与start相同的顺序重建墙体、出口与未被移除的行人，
+        使接触列表、warm-start冲量以及broad-phase的状态只取决于快照本身
+        '''
+        old_world = self.world
+        self._create_world()
+        self.factory.world = self.world
+        for obj in self.obstacles + self.exits + self.walls:
+            obj.create_body(self.world, obj.x, obj.y)
+        for idx, ped in enumerate(self.peds):
+            if removed[idx]:
+                if not ped.has_removed:
+                    ped.delete(old_world)
+                continue
+            x, y, angle, vx, vy, w = body_state[idx, :6].tolist()
+            ped.create_body(self.world, x, y)
+            ped.body.transform = ((x, y), angle)
+            ped.body.linearVelocity = (vx, vy)
+            ped.body.angularVelocity = w
+            ped.body.awake = True
+        # 步长为0的Step只建立接触而不移动刚体，快照时已经接触的行人之后不会再次触发BeginContact，
+        # 回调中对计数器与碰撞字典的修改会在_load_state中被快照覆盖
+        self.world.Step(0, vel_iters, pos_iters)
+
+    def _load_state(self, state, restore_rng, rebuild):
+        body_state, ped_flags = state["body_state"], state["ped_flags"]
+        if len(self.peds) != body_state.shape[0] or any(ped.id != ped_flags[idx, 0] for idx, ped in enumerate(self.peds)):
+            raise Exception("快照与当前环境的行人不匹配!")
+        ped_dic = {ped.id: ped for ped in self.peds}
+        obj_dic = {obj.id: obj for obj in self.exits + self.obstacles + self.walls}
+        if rebuild:
+            self._rebuild_world(body_state, ped_flags[:, 3])
+        else:
+            self._restore_bodies(body_state, ped_flags[:, 3])
+
+        for idx, ped in enumerate(self.peds):
+            _, exit_type, is_done, has_removed, exit_in_step, person_state = ped_flags[idx].tolist()
+            if not has_removed:
+                x, y, _, vx, vy, _ = body_state[idx, :6].tolist()
+                ped.x, ped.y = x, y
+                ped.pos = np.array([x, y])
+                ped.vec = np.array([vx, vy])
+            else:
+                ped.x, ped.y = 0, 0
+                ped.pos = np.array([0, 0])
+                ped.vec = np.array([0, 0])
+            ped.exit_type = exit_type
+            ped.is_done = bool(is_done)
+            ped.exit_in_step = exit_in_step
+            ped.person_state = PersonState(person_state)
+            ped.fij_force_last_eps = body_state[idx, 6:8].copy()
+            ped.total_force = np.zeros([2])
+            ped.a_star_path = state["a_star_paths"].get(ped.id, None)
+            c_agents, c_obstacles, d_agents, d_obstacles = state["collisions"][idx]
+            ped.collide_agents = {i: ped_dic[i] for i in c_agents}
+            ped.collide_obstacles = {i: obj_dic[i] for i in c_obstacles}
+            ped.detected_agents = {i: ped_dic[i] for i in d_agents}
+            ped.detected_obstacles = {i: obj_dic[i] for i in d_obstacles}
+
+        for group, members in zip(self.groups, state["groups"]):
+            group.leader = ped_dic[members[0]]
+            group.followers = [ped_dic[i] for i in members[1:]]
+            group.followers_set = set(group.followers)
+            group.leader.is_leader = True
+            for follower in group.followers:
+                follower.is_leader = False
+            group.update()
+        self.leaders = [ped for ped in self.peds if ped.is_leader]
+        if self.contact_detector is not None:
+            self.contact_detector.reset_contacts()
+
+        self.step_in_env, self.left_person_num, self.left_leader_num, \
+            self.col_with_agent, self.col_with_wall = state["counters"].tolist()
+        self.distance_to_exit = state["distance_to_exit"].tolist()
+        self.points_in_last_step = [tuple(p) for p in state["points_in_last_step"].tolist()]
+        self.person_handler.last_observation = copy.deepcopy(state["last_observation"])
+        self.elements = self.exits + self.obstacles + self.walls + \
+                        [ped for ped in self.not_arrived_peds if not ped.has_removed]
+        if restore_rng:
+            py_state, np_state = state["rng_state"]
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+
     def debug_step(self):
         if not self.once:
             for i,ped in enumerate(self.peds):
@@ -388,11 +601,17 @@ class PedsMoveEnv(gym.Env):
             self.once = True
 
     def render(self, mode="human"):
+        '''
+        :param mode: human为按照真实时间渲染到窗口，rgb_array为不等待地渲染到不可见窗口并返回[H,W,3]的图像
+        :return:
+        '''
         if self.viewer is None:  # 如果调用了 render, 而且没有 viewer, 就生成一个
-            self.viewer = PedsMoveEnvViewer(self)
-        self.viewer.render()  # 使用 Viewer 中的 render 功能
+            self.viewer = PedsMoveEnvViewer(self, visible=(mode == "human"))
+        return self.viewer.render(mode)  # 使用 Viewer 中的 render 功能
 
     def close(self):
+        if self.recorder is not None:
+            self.recorder.close()
         if self.viewer is not None:
             self.viewer.close()
             self.viewer = None
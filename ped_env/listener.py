@@ -1,4 +1,6 @@
-from Box2D import b2ContactListener, b2Contact
+import numpy as np
+
+from Box2D import b2ContactListener, b2Contact, b2_polygonRadius
 from ped_env.utils.misc import ObjectType
 
 class MyContactListener(b2ContactListener):
@@ -72,3 +74,191 @@ class MyContactListener(b2ContactListener):
         else:
             pass
             #print("出现未知类型的碰撞!{}-{}".format(infoA.type, infoB.type))
+
+
+class OverlapContactDetector():
+    '''
+    不使用Box2D的接触回调与传感器夹具，而是在每次world.Step之前对行人位置与墙体网格做向量化的重叠检测，
+    得到与MyContactListener相同的collide_agents、collide_obstacles、detected_agents、detected_obstacles
+    以及col_with_agent、col_with_wall计数，用于大规模人群时降低Python回调的开销。
+    Box2D在Step开始时(求解之前)根据当前位置更新接触并触发回调，因此检测也需要在Step之前进行，
+    判定距离与Box2D相同：多边形带有b2_polygonRadius的外壳，传感器只要重叠(距离小于OVERLAP_EPS)即算接触
+    '''
+    SENSOR_RANGE = 1.0 # 与Person中传感器的探测范围一致
+    OVERLAP_EPS = 10 * 1.192092896e-07 # b2TestOverlap判定传感器重叠时允许的距离误差(10 * FLT_EPSILON)
+
+    def __init__(self, env):
+        self.env = env
+        self.peds = list(env.peds)
+        self.radius = self.peds[0].radius if len(self.peds) > 0 else 0.2
+        self.ped_idx = {ped.id: i for i, ped in enumerate(self.peds)}
+        # 与MyContactListener中各类接触开始时的距离一致
+        self.collide_agent_dis = 2 * self.radius
+        self.detect_agent_dis = 2 * self.radius + self.SENSOR_RANGE + self.OVERLAP_EPS
+        self.collide_wall_dis = self.radius + b2_polygonRadius
+        self.detect_wall_dis = self.radius + self.SENSOR_RANGE + b2_polygonRadius + self.OVERLAP_EPS
+        self.exit_dis = self.radius + b2_polygonRadius + self.OVERLAP_EPS
+        self.ped_ids = np.array([ped.id for ped in self.peds], dtype=np.int64)
+        self.group_ids = np.array([env.group_dic[ped].id for ped in self.peds], dtype=np.int64)
+
+        terrain = env.terrain.map
+        self.map_shape = terrain.shape
+        self.map = np.asarray(terrain, dtype=np.int64)
+        self.cell_objects = {}
+        for obj in env.obstacles + env.walls:
+            self.cell_objects[int(obj.getX) * self.map_shape[1] + int(obj.getY)] = obj
+        # 传感器半径为radius+1，因此只需检查行人所在格子周围5*5的范围
+        offset = np.arange(-2, 3)
+        self.offsets = np.stack(np.meshgrid(offset, offset, indexing="ij"), axis=-1).reshape([-1, 2])
+        self.reset_contacts()
+
+    def reset_contacts(self):
+        '''
+        根据行人当前的碰撞字典重建上一帧的接触状态，在恢复环境状态后调用
+        :return:
+        '''
+        n = len(self.peds)
+        idx_dic = {pid: i for i, pid in enumerate(self.ped_ids.tolist())}
+        self.last_collide = np.zeros([n, n], dtype=np.bool_)
+        self.last_detect = np.zeros([n, n], dtype=np.bool_)
+        last_wall_keys, last_sensor_keys = [], []
+        n_cells = self.map_shape[0] * self.map_shape[1]
+        for i, ped in enumerate(self.peds):
+            for pid in ped.collide_agents.keys():
+                self.last_collide[i, idx_dic[pid]] = True
+            for pid in ped.detected_agents.keys():
+                self.last_detect[i, idx_dic[pid]] = True
+            for obj in ped.collide_obstacles.values():
+                last_wall_keys.append(i * n_cells + int(obj.getX) * self.map_shape[1] + int(obj.getY))
+            for obj in ped.detected_obstacles.values():
+                last_sensor_keys.append(i * n_cells + int(obj.getX) * self.map_shape[1] + int(obj.getY))
+        self.last_wall_keys = np.unique(np.array(last_wall_keys, dtype=np.int64))
+        self.last_sensor_keys = np.unique(np.array(last_sensor_keys, dtype=np.int64))
+        self.pending = None
+
+    def remove(self, ped):
+        '''
+        行人的刚体被删除时Box2D会立即对其所有接触调用EndContact，这里同样立即清除与该行人有关的接触
+        '''
+        i = self.ped_idx[ped.id]
+        for j in np.nonzero(self.last_collide[i])[0]:
+            self.peds[j].collide_agents.pop(ped.id, None)
+        for j in np.nonzero(self.last_detect[i])[0]:
+            self.peds[j].detected_agents.pop(ped.id, None)
+        ped.collide_agents, ped.detected_agents = {}, {}
+        ped.collide_obstacles, ped.detected_obstacles = {}, {}
+        self.last_collide[i, :] = self.last_collide[:, i] = False
+        self.last_detect[i, :] = self.last_detect[:, i] = False
+        n_cells = self.map_shape[0] * self.map_shape[1]
+        self.last_wall_keys = self.last_wall_keys[self.last_wall_keys // n_cells != i]
+        self.last_sensor_keys = self.last_sensor_keys[self.last_sensor_keys // n_cells != i]
+        self.pending = None
+
+    def update(self):
+        '''
+        在world.Step之前调用，对应Box2D在求解之前根据当前位置开始或结束接触
+        '''
+        if len(self.peds) == 0:
+            return
+        detected = self.pending if self.pending is not None else self._detect()
+        self.pending = None
+        collide, detect, wall_keys, sensor_keys, arrived = detected
+        for i in arrived:
+            self.peds[i].is_done = True
+        self._commit_agents(collide, detect)
+        self._commit_obstacles(wall_keys, sensor_keys)
+
+    def sync(self):
+        '''
+        在world.Step之后调用。Box2D的连续碰撞(TOI)求解会在Step中途开始或结束行人与静态刚体的接触，
+        因此对几何判定与已记录状态不一致的行人-墙体对读取Box2D的接触状态进行修正；
+        本次的检测结果会在下一帧Step之前直接使用(期间行人的位置不会改变)
+        '''
+        if len(self.peds) == 0:
+            return
+        self.pending = self._detect()
+        candidates = np.setxor1d(self.pending[2], self.last_wall_keys, assume_unique=True)
+        if candidates.size == 0:
+            return
+        n_cells = self.map_shape[0] * self.map_shape[1]
+        wall_keys = set(self.last_wall_keys.tolist())
+        for i in np.unique(candidates // n_cells):
+            touching = set()
+            for edge in self.peds[i].body.contacts:
+                if not edge.contact.touching:
+                    continue
+                infoA, infoB = edge.contact.fixtureA.userData, edge.contact.fixtureB.userData
+                for info in (infoA, infoB):
+                    if info.type in (ObjectType.Wall, ObjectType.Obstacle):
+                        touching.add(id(info.model))
+            for key in candidates[candidates // n_cells == i].tolist():
+                if id(self.cell_objects[key % n_cells]) in touching:
+                    wall_keys.add(key)
+                else:
+                    wall_keys.discard(key)
+        self._commit_obstacles(np.array(sorted(wall_keys), dtype=np.int64), self.last_sensor_keys)
+
+    def _detect(self):
+        n = len(self.peds)
+        active = np.array([not ped.has_removed for ped in self.peds], dtype=np.bool_)
+        pos = np.zeros([n, 2])
+        for i, ped in enumerate(self.peds):
+            if active[i]:
+                p = ped.body.position
+                pos[i, 0], pos[i, 1] = p.x, p.y
+        collide, detect = self._detect_agents(pos, active)
+        wall_keys, sensor_keys, arrived = self._detect_obstacles(pos, active)
+        return collide, detect, wall_keys, sensor_keys, arrived
+
+    def _detect_agents(self, pos, active):
+        diff = pos[:, None, :] - pos[None, :, :]
+        dis = np.sqrt(np.sum(diff ** 2, axis=-1))
+        pair_mask = active[:, None] & active[None, :]
+        np.fill_diagonal(pair_mask, False)
+        # 同一团体内的行人之间不计入碰撞，但仍可被传感器探测到
+        collide = pair_mask & (dis <= self.collide_agent_dis) & (self.group_ids[:, None] != self.group_ids[None, :])
+        detect = pair_mask & (dis < self.detect_agent_dis)
+        return collide, detect
+
+    def _detect_obstacles(self, pos, active):
+        ped_idx = np.nonzero(active)[0]
+        cells = np.floor(pos[ped_idx])[:, None, :].astype(np.int64) + self.offsets[None, :, :]  # [n, 25, 2]
+        valid = (cells[..., 0] >= 0) & (cells[..., 0] < self.map_shape[0]) & \
+                (cells[..., 1] >= 0) & (cells[..., 1] < self.map_shape[1])
+        cells = np.clip(cells, 0, np.array(self.map_shape) - 1)
+        value = np.where(valid, self.map[cells[..., 0], cells[..., 1]], 0)
+        # 圆与1*1方格的最近距离
+        gap = np.maximum(np.abs(pos[ped_idx][:, None, :] - (cells + 0.5)) - 0.5, 0.0)
+        dis = np.sqrt(np.sum(gap ** 2, axis=-1))
+
+        # 与自己出口的方格重叠时即到达出口
+        exit_types = np.array([self.peds[i].exit_type for i in ped_idx], dtype=np.int64)
+        arrived = ped_idx[np.any((dis < self.exit_dis) & (value == exit_types[:, None]), axis=1)]
+
+        solid = (value == 1) | (value == 2)
+        n_cells = self.map_shape[0] * self.map_shape[1]
+        keys = ped_idx[:, None] * n_cells + cells[..., 0] * self.map_shape[1] + cells[..., 1]
+        wall_keys = np.unique(keys[solid & (dis <= self.collide_wall_dis)])
+        sensor_keys = np.unique(keys[solid & (dis < self.detect_wall_dis)])
+        return wall_keys, sensor_keys, arrived
+
+    def _commit_agents(self, collide, detect):
+        self.env.col_with_agent += int(np.sum(collide & ~self.last_collide)) // 2
+        for i in np.nonzero(np.any(collide != self.last_collide, axis=1))[0]:
+            self.peds[i].collide_agents = {int(self.ped_ids[j]): self.peds[j] for j in np.nonzero(collide[i])[0]}
+        for i in np.nonzero(np.any(detect != self.last_detect, axis=1))[0]:
+            self.peds[i].detected_agents = {int(self.ped_ids[j]): self.peds[j] for j in np.nonzero(detect[i])[0]}
+        self.last_collide, self.last_detect = collide, detect
+
+    def _commit_obstacles(self, wall_keys, sensor_keys):
+        n_cells = self.map_shape[0] * self.map_shape[1]
+        self.env.col_with_wall += int(np.setdiff1d(wall_keys, self.last_wall_keys, assume_unique=True).size)
+        changed = np.setxor1d(wall_keys, self.last_wall_keys, assume_unique=True) // n_cells
+        for i in np.unique(changed):
+            ped_keys = wall_keys[wall_keys // n_cells == i] % n_cells
+            self.peds[i].collide_obstacles = {self.cell_objects[k].id: self.cell_objects[k] for k in ped_keys.tolist()}
+        changed = np.setxor1d(sensor_keys, self.last_sensor_keys, assume_unique=True) // n_cells
+        for i in np.unique(changed):
+            ped_keys = sensor_keys[sensor_keys // n_cells == i] % n_cells
+            self.peds[i].detected_obstacles = {self.cell_objects[k].id: self.cell_objects[k] for k in ped_keys.tolist()}
+        self.last_wall_keys, self.last_sensor_keys = wall_keys, sensor_keys
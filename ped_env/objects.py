@@ -63,6 +63,7 @@ class Person(Agent):
 
     counter = 0  # 用于记录智能体编号
     body_pic = None
+    leader_pic = None
 
     a_star_path = None # 用于follow在找不到路时的A*策略使用
 
@@ -74,7 +75,8 @@ class Person(Agent):
                  display_level,
                  debug_level,
                  desired_velocity = 2.4,
-                 view_length = 5.0):
+                 view_length = 5.0,
+                 use_sensor = True):
         '''
 
         暂定观察空间为8个方向的射线传感器（只探测墙壁）与8个方向的射线传感器（只探测其他行人）与导航力的方向以及与终点的距离，类型为Box(-inf,inf,(18,))，
@@ -91,30 +93,19 @@ class Person(Agent):
         :param max_velocity:
         :param view_length: 智能体最远能观察到的距离
         :param tau: 社会力模型中关于地面摩擦和自驱动力的参数
+        :param use_sensor: 是否添加用于接触回调的传感器夹具，使用OverlapContactDetector时不需要
         '''
         super(Person, self).__init__()
-        self.body = env.CreateDynamicBody(position=(new_x, new_y))
         self.exit_type = exit_type
         self.reward_in_episode = 0.0
         self.is_done = False
         self.has_removed = False
 
-        # Add a fixture to it
         self.color = exit_type_to_color(self.exit_type)
-        fixtureDef = b2FixtureDef()
-        fixtureDef.shape = b2CircleShape(radius=self.radius)
-        fixtureDef.density = self.mass / (math.pi * self.radius ** 2)
-        fixtureDef.friction = 0.1 #指的是行人与墙以及其他行人间的摩擦
-        fixtureDef.userData = FixtureInfo(Person.counter, self, ObjectType.Agent)
         self.id = Person.counter
         Person.counter += 1
-        self.box = self.body.CreateFixture(fixtureDef)
-        #添加传感器用于社会力控制
-        sensorDef = b2FixtureDef()
-        sensorDef.shape = b2CircleShape(radius=self.radius+1) #探测范围为1m
-        sensorDef.isSensor = True
-        sensorDef.userData = FixtureInfo(self.id, self, ObjectType.Sensor)
-        self.sensor = self.body.CreateFixture(sensorDef)
+        self.use_sensor = use_sensor
+        self.create_body(env, new_x, new_y)
         self.type = ObjectType.Agent
         self.view_length = view_length
         self.desired_velocity = desired_velocity
@@ -151,6 +142,31 @@ class Person(Agent):
 
         self.exit_in_step = -1
 
+    def create_body(self, env: b2World, new_x, new_y):
+        '''
+        在物理世界中为该行人创建刚体与夹具，也用于恢复已被移除的行人
+        :param env:
+        :param new_x:
+        :param new_y:
+        :return:
+        '''
+        self.body = env.CreateDynamicBody(position=(new_x, new_y))
+        # Add a fixture to it
+        fixtureDef = b2FixtureDef()
+        fixtureDef.shape = b2CircleShape(radius=self.radius)
+        fixtureDef.density = self.mass / (math.pi * self.radius ** 2)
+        fixtureDef.friction = 0.1 #指的是行人与墙以及其他行人间的摩擦
+        fixtureDef.userData = FixtureInfo(self.id, self, ObjectType.Agent)
+        self.box = self.body.CreateFixture(fixtureDef)
+        #添加传感器用于社会力控制
+        if self.use_sensor:
+            sensorDef = b2FixtureDef()
+            sensorDef.shape = b2CircleShape(radius=self.radius+1) #探测范围为1m
+            sensorDef.isSensor = True
+            sensorDef.userData = FixtureInfo(self.id, self, ObjectType.Sensor)
+            self.sensor = self.body.CreateFixture(sensorDef)
+        self.has_removed = False
+
     def update(self, exits, step_in_env, map:ndarray):
         if self.is_done and self.has_removed:
             self.x, self.y = 0, 0
@@ -194,6 +210,28 @@ class Person(Agent):
                                         color=ColorYellow if self.color != ColorYellow else ColorRed,
                                         batch=batch, group=self.debug_level)
 
+    def update_graphics(self, batch, render_scale):
+        '''
+        只更新已创建图形的位置，避免每帧重新创建pyglet图形
+        :param batch:
+        :param render_scale:
+        :return:
+        '''
+        if self.body_pic is None:
+            self.setup(batch, render_scale)
+            return
+        x, y = self.getX * render_scale, self.getY * render_scale
+        self.body_pic.position = (x, y)
+        if self.is_leader and self.leader_pic is None:
+            self.leader_pic = pyglet.shapes.Circle(x, y, self.radius * 0.3 * render_scale,
+                                                   color=ColorYellow if self.color != ColorYellow else ColorRed,
+                                                   batch=batch, group=self.debug_level)
+        elif not self.is_leader and self.leader_pic is not None: # leader发生了变化
+            self.leader_pic.delete()
+            self.leader_pic = None
+        elif self.leader_pic is not None:
+            self.leader_pic.position = (x, y)
+
     def self_driven_force(self, direction):
         #给行人施加自驱动力，力的大小为force * self.desired_velocity * self.mass / self.tau
         d_v = direction * self.desired_velocity
@@ -202,7 +240,8 @@ class Person(Agent):
 
     #社会力模型添加
     def fij_force(self, peds, group):
-        detect_persons = list(self.detected_agents.values())
+        #按id顺序累加，使合力与接触被发现的先后顺序无关(两种接触检测方式的结果一致)
+        detect_persons = [self.detected_agents[i] for i in sorted(self.detected_agents.keys())]
         total_force = b2Vec2(0, 0)
         for ped in detect_persons:
             if self.is_leader and ped in group:
@@ -217,7 +256,7 @@ class Person(Agent):
         self.total_force += total_force
 
     def fiw_force(self, obj):
-        detect_things = list(self.detected_obstacles.values())
+        detect_things = [self.detected_obstacles[i] for i in sorted(self.detected_obstacles.keys())]
         total_force = b2Vec2(0, 0)
         for obs in detect_things:
             pos, next_pos = (self.getX, self.getY), (obs.getX, obs.getY)
@@ -277,10 +316,10 @@ class Person(Agent):
     def delete(self, env:b2World):
         if self.body_pic != None:
             self.body_pic.delete()
-            del (self.body_pic)
-            if self.is_leader:
-                self.leader_pic.delete()
-                del (self.leader_pic)
+            self.body_pic = None
+        if self.leader_pic != None:
+            self.leader_pic.delete()
+            self.leader_pic = None
         env.DestroyBody(self.body)
         self.has_removed = True
 
@@ -346,21 +385,26 @@ class BoxWall():
     def __init__(self, env: b2World, new_x, new_y, new_width, new_height, display_level, object_type,
                  color=ColorRed):
         # new_x,new_y代表的是矩形墙的中心坐标
-        self.body = env.CreateStaticBody(position=(new_x, new_y))
-        self.x = self.body.position.x
-        self.y = self.body.position.y
         self.width = new_width
         self.height = new_height
         self.color = color
-
-        # And add a box fixture onto it
-        self.box = self.body.CreatePolygonFixture(box=(new_width / 2, new_height / 2), density=0)
-        self.box.userData = FixtureInfo(BoxWall.counter, self, object_type)
         self.id = BoxWall.counter
         BoxWall.counter += 1
 
         self.type = object_type
         self.display_level = display_level
+        self.create_body(env, new_x, new_y)
+        self.x = self.body.position.x
+        self.y = self.body.position.y
+
+    def create_body(self, env: b2World, new_x, new_y):
+        '''
+        在物理世界中创建墙体的刚体与夹具，也用于在新的物理世界中重建墙体
+        '''
+        self.body = env.CreateStaticBody(position=(new_x, new_y))
+        # And add a box fixture onto it
+        self.box = self.body.CreatePolygonFixture(box=(self.width / 2, self.height / 2), density=0)
+        self.box.userData = FixtureInfo(self.id, self, self.type)
 
     def setup(self, batch, render_scale):
         # pyglet以左下角那个点作为原点
@@ -387,18 +431,22 @@ class Exit(BoxWall):
 
     def __init__(self, env: b2World, new_x, new_y, exit_type, width, height, display_level):
         color = exit_type_to_color(exit_type)
+        self.exit_id = Exit.counter
+        Exit.counter += 1
         super(Exit, self).__init__(env, new_x, new_y, width, height, display_level, ObjectType.Exit, color)
+
+        self.exit_type = exit_type
+
+    def create_body(self, env: b2World, new_x, new_y):
+        super(Exit, self).create_body(env, new_x, new_y)
         # And add a box fixture onto it
         fixtrueDef = b2FixtureDef()
-        fixtrueDef.shape = b2PolygonShape(box=(width / 2, height / 2))
+        fixtrueDef.shape = b2PolygonShape(box=(self.width / 2, self.height / 2))
         fixtrueDef.density = 0
         fixtrueDef.isSensor = True
-        fixtrueDef.userData = FixtureInfo(Exit.counter, self, ObjectType.Exit)
-        Exit.counter += 1
+        fixtrueDef.userData = FixtureInfo(self.exit_id, self, ObjectType.Exit)
         self.box = self.body.CreateFixture(fixtrueDef)
 
-        self.exit_type = exit_type
-
 class Group():
     counter = 0
     group_force_magnitude_dic = defaultdict(float)
@@ -43,17 +43,14 @@ class Path:
 class AStar:
     def __init__(self, map:Map):
         self.map = map
-        self.barrier_list = []
+        self.barrier_list = set()
         self.init_barrier_list()
         self.dir_vector_matrix_dic = dict() #值是出口坐标(x,y)，键是ndarray
         self.path_matrix_dic = defaultdict(dict) #键是出口坐标(x,y),值是一个字典(键是起始坐标(sx,sy),值是路径Path)
 
     def init_barrier_list(self):
-        terrain = self.map.map
-        for j in range(terrain.shape[1]):
-            for i in range(terrain.shape[0]):
-                if terrain[i, j] in (1, 2):
-                    self.barrier_list.append((i, j))
+        # 使用地图缓存的障碍物格子集合，查询为O(1)
+        self.barrier_list = self.map.derived.barrier_set
 
     def next_loc(self, x, y, dest_x, dest_y)->Tuple[Tuple, Path]:
         # 初始化各种状态
@@ -0,0 +1,117 @@
+from collections import deque
+
+import numpy as np
+
+from ped_env.utils.maps import Map
+
+
+class CrowdSpawner:
+    '''
+    将地图中的每个空地格子划分为n*n个互不重叠的行人槽位，以向量化的方式为整组行人选择离组中心最近的空闲槽位，
+    槽位在格子内带有抖动，保证生成的行人之间以及行人与墙体之间都不会重叠，避免物理引擎在第一步中处理大量穿插
+    '''
+    def __init__(self, terrain: Map, radius, gap=0.05):
+        '''
+        :param terrain: 地图
+        :param radius: 行人半径
+        :param gap: 相邻槽位中行人之间的最小间隙
+        '''
+        self.radius = radius
+        self.per_axis = int(1.0 / (2 * radius + gap))
+        if self.per_axis < 1:
+            raise Exception("行人直径大于地图格子大小，无法生成行人!")
+        free = terrain.map == 0
+        cells = np.argwhere(free)  # [C,2]
+        sub = (np.arange(self.per_axis) + 0.5) / self.per_axis
+        offsets = np.stack(np.meshgrid(sub, sub, indexing="ij"), axis=-1).reshape([-1, 2])
+        slot_num = offsets.shape[0]
+        self.slots = (cells[:, None, :] + offsets[None, :, :]).reshape([-1, 2])  # [S,2]
+        # 抖动幅度保证槽位之间的距离不小于行人直径，且行人不会越出所在的格子
+        self.jitter = max((1.0 / self.per_axis - 2 * radius) / 2 - 1e-3, 0.0)
+
+        labels = self._label_regions(free)
+        self.slot_num = slot_num
+        self.slot_region = np.repeat(labels[cells[:, 0], cells[:, 1]], slot_num)
+        self.slot_spawn = np.repeat(terrain.map_spawn[cells[:, 0], cells[:, 1]], slot_num)
+        self.spawn_slots = {int(t): np.nonzero(self.slot_spawn == t)[0] for t in np.unique(self.slot_spawn) if t != 0}
+        # 每个格子在cells中的下标，用于只在组中心附近的窗口内查找空闲槽位
+        self.cell_index = np.full(terrain.map.shape, -1, dtype=np.int64)
+        self.cell_index[cells[:, 0], cells[:, 1]] = np.arange(cells.shape[0])
+        self.map_shape = terrain.map.shape
+        self.region_labels = labels
+        self.occupied = np.zeros([self.slots.shape[0]], dtype=bool)
+
+    @staticmethod
+    def _label_regions(free: np.ndarray):
+        '''
+        对空地格子按四邻域进行连通区域标记，使一组行人不会被生成在墙的另一侧
+        '''
+        labels = np.full(free.shape, -1, dtype=np.int32)
+        label = 0
+        for i, j in np.argwhere(free).tolist():
+            if labels[i, j] >= 0:
+                continue
+            labels[i, j] = label
+            queue = deque([(i, j)])
+            while len(queue) > 0:
+                x, y = queue.popleft()
+                for nx, ny in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+                    if 0 <= nx < free.shape[0] and 0 <= ny < free.shape[1] and free[nx, ny] and labels[nx, ny] < 0:
+                        labels[nx, ny] = label
+                        queue.append((nx, ny))
+            label += 1
+        return labels
+
+    def reset(self):
+        self.occupied[:] = False
+
+    def capacity(self, spawn_type=None):
+        if spawn_type is None:
+            return int(np.sum(~self.occupied))
+        idx = self.spawn_slots.get(spawn_type, np.zeros([0], dtype=np.int64))
+        return int(np.sum(~self.occupied[idx]))
+
+    def sample_group(self, center, num, spawn_type=None):
+        '''
+        为一组行人选择离center最近的num个空闲槽位，优先选择生成点地图中值为spawn_type的格子
+        :param center: 组中心坐标
+        :param num: 组内人数
+        :param spawn_type: 生成区域对应的出口编号，为None时不限制
+        :return: shape为[num,2]的行人坐标
+        '''
+        i = min(max(int(center[0]), 0), self.map_shape[0] - 1)
+        j = min(max(int(center[1]), 0), self.map_shape[1] - 1)
+        region = self.region_labels[i, j]
+        # 从能容纳该组的最小窗口开始查找，窗口内空位不足时再成倍扩大
+        half = int(np.ceil(np.sqrt(num / self.slot_num))) + 1
+        while True:
+            window = self.cell_index[max(i - half, 0):i + half + 1, max(j - half, 0):j + half + 1].ravel()
+            window = window[window >= 0]
+            idx = (window[:, None] * self.slot_num + np.arange(self.slot_num)).ravel()
+            idx = idx[~self.occupied[idx]]
+            if region >= 0:
+                idx = idx[self.slot_region[idx] == region]
+            if len(idx) >= num * 2 or half >= max(self.map_shape):
+                break
+            half *= 2
+        if len(idx) < num:
+            raise Exception("生成区域中剩余的空位不足以生成{}个行人!".format(num))
+        dist = np.sum(np.square(self.slots[idx] - np.asarray(center)), axis=1)
+        if spawn_type is not None:
+            dist += (self.slot_spawn[idx] != spawn_type) * 1e6  # 生成区域不足时才溢出到附近的空地
+        if num < len(idx):
+            idx = idx[np.argpartition(dist, num - 1)[:num]]
+        self.occupied[idx] = True
+        return self.slots[idx] + np.random.uniform(-self.jitter, self.jitter, [num, 2])
+
+    def random_center(self, spawn_type):
+        '''
+        在生成点地图中值为spawn_type的空闲槽位中随机选择一个作为组中心
+        '''
+        if spawn_type not in self.spawn_slots:
+            raise Exception("地图中不存在出口{}对应的生成区域!".format(spawn_type))
+        idx = self.spawn_slots[spawn_type]
+        free = idx[~self.occupied[idx]]
+        if len(free) > 0:  # 生成区域已满时以其中任意位置为中心，由sample_group溢出到附近的空地
+            idx = free
+        return self.slots[np.random.choice(idx)]
@@ -1,10 +1,29 @@
+import glob
+import hashlib
+import heapq
+import json
+import os
+
 import numpy as np
 from numpy import flipud
 from random import sample
+from collections import defaultdict
+
+# 地图文件目录，每张地图由一个描述文件<name>.json与一个网格文件<name>.npz(或<name>.png)组成
+MAP_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "map_data")
+DERIVED_SUFFIX = ".derived.npz"
+DERIVED_VERSION = 1
+
+# 八邻域的偏移与代价
+NEIGHBOURS = [(1, 0, 1.0), (-1, 0, 1.0), (0, 1, 1.0), (0, -1, 1.0),
+              (1, 1, 2 ** 0.5), (1, -1, 2 ** 0.5), (-1, 1, 2 ** 0.5), (-1, -1, 2 ** 0.5)]
 
 class Map():
-    def __init__(self, map: np.ndarray, exits: list, start_points: list, random_exits:list, name, radius, map_spawn: np.ndarray):
+    def __init__(self, map: np.ndarray, exits: list, start_points: list, random_exits:list, name, radius, map_spawn: np.ndarray = None,
+                 cache_path: str = None):
         # 对地图进行翻转操作
+        if map_spawn is None:
+            map_spawn = np.zeros_like(map)
         map = flipud(map)
         self.map = map.T
         map_spawn = flipud(map_spawn)
@@ -14,6 +33,54 @@ class Map():
         self.create_radius = radius
         self.name = name
         self.random_exits = random_exits
+        self.cache_path = cache_path
+        self._derived = None
+
+    @classmethod
+    def from_file(cls, path):
+        '''
+        从描述文件中读取地图，描述文件的格式为：
+        {"exits": [...], "start_points": [...], "random_exits": [...], "radius": 1, "grid": "xxx.npz"}
+        grid为可选项，默认为同名的npz文件，不存在时使用同名的png文件；
+        npz中包含map与可选的map_spawn，png时可以用spawn_grid指定生成点掩码图片
+        :param path: json描述文件的路径
+        :return:
+        '''
+        with open(path, "r") as file:
+            meta = json.load(file)
+        root, name = os.path.dirname(path), os.path.splitext(os.path.basename(path))[0]
+        grid = meta.get("grid", None)
+        if grid is None:
+            grid = name + ".npz" if os.path.exists(os.path.join(root, name + ".npz")) else name + ".png"
+        grid = os.path.join(root, grid)
+        if grid.endswith(".npz"):
+            with np.load(grid) as arrs:
+                terrain = arrs["map"]
+                spawn = arrs["map_spawn"] if "map_spawn" in arrs.files else None
+        elif grid.endswith(".png"):
+            terrain = load_png_grid(grid)
+            spawn = load_png_grid(os.path.join(root, meta["spawn_grid"])) if "spawn_grid" in meta else None
+        else:
+            raise Exception("不支持的地图文件格式{}!".format(grid))
+        return cls(terrain,
+                   [tuple(e) for e in meta["exits"]],
+                   [tuple(p) for p in meta["start_points"]],
+                   meta["random_exits"],
+                   name,
+                   meta["radius"],
+                   spawn,
+                   cache_path=os.path.join(root, name + DERIVED_SUFFIX))
+
+    @property
+    def derived(self):
+        '''
+        地图的派生数据(墙体、出口与生成点格子列表，合并后的几何体，到各出口的距离场)，
+        第一次使用时计算，并缓存在地图文件旁边，之后的进程直接读取
+        :return: MapDerivedData
+        '''
+        if self._derived is None:
+            self._derived = MapDerivedData.load_or_build(self.map, self.map_spawn, self.cache_path)
+        return self._derived
 
     def get_render_scale(self, window_size: int = 500):
         '''
@@ -29,408 +96,210 @@ class Map():
     def __str__(self):
         return self.name
 
-start_points_map1 = [(12.5, 7.5), (10.5, 5.5), (7.5, 7.5), (12.5, 12.5), (10.5, 14.5), (7.5, 12.5)]
-exit_map1 = [(19.5, 7), (9, 0.5), (0.5, 7), (19.5, 12), (9, 19.5), (0.5, 12)]
-radius_map1 = 1
-random_exits1 = [[3], [4], [5], [6], [7], [8]]
-
-#20*20
-map1 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 7, 7, 7, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [8, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 6],
-    [8, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 6],
-    [8, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 6],
-    [2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2],
-    [2, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 2, 2, 2, 2, 2, 2, 2, 2, 2]
-])
-
-start_points_map2 = [(1.5, 3), (1.5, 8)]
-exit_map2 = [(11.5, 2), (11.5, 9)]
-radius_map2 = 1
-random_exits2 = [[3], [4]]
-
-#10*10
-map2 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-#map_2对应的生成点地图
-map2_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 4, 4, 4, 4, 4, 4, 0, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 0, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 0, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 0, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map5 = [(1.5, 3), (1.5, 8)]
-exit_map5 = [(11.5, 2), (11.5, 9)]
-radius_map5 = 1
-random_exits5 = [[3], [4]]
-
-#不进行交叉
-map5 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-map5_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 4, 4, 4, 4, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 1, 1, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 1, 1, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 1, 1, 4, 4, 4, 0, 0, 0, 2],
-    [2, 3, 3, 1, 1, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 1, 1, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 1, 1, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 3, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map6 = [(1.5, 3), (1.5, 8)]
-exit_map6 = [(11.5, 2), (11.5, 9)]
-radius_map6 = 1
-random_exits6 = [[3], [4]]
-
-map6 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 4],
-    [2, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-map6_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 4, 4, 4, 4, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 4, 0, 0, 0, 2],
-    [2, 4, 4, 1, 1, 4, 4, 1, 1, 0, 0, 2],
-    [2, 4, 4, 1, 1, 4, 4, 1, 1, 0, 0, 2],
-    [2, 4, 4, 4, 4, 4, 4, 4, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 1, 1, 3, 3, 1, 1, 0, 0, 2],
-    [2, 3, 3, 1, 1, 3, 3, 1, 1, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 3, 0, 0, 0, 2],
-    [2, 3, 3, 3, 3, 3, 3, 3, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map7 = [(7.5, 11.5), (11.5, 11.5), (7.5, 8.5), (11.5, 8.5)]
-exit_map7 = [(4.5, 19.5), (16.5, 19.5), (4.5, 0.5), (16.5, 0.5)]
-radius_map7 = 1
-random_exits7 = [[3], [4], [5], [6]]
-
-#20*20
-map7 = np.array([
-    [2, 2, 2, 3, 3, 3, 2, 2, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 5, 5, 5, 2, 2, 2, 2, 2, 2, 2, 2, 2, 6, 6, 6, 2, 2]
-])
-
-start_points_map8 = [(2, 5)]
-exit_map8 = [(2, 11.5),(9, 11.5)]
-radius_map8 = 1.5
-random_exits8 = [[3, 4]]
-
-map8 = np.array([
-    [2, 3, 3, 3, 2, 2, 2, 2, 4, 4, 4, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 2],
-    [2, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 2],
-    [2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 2],
-    [2, 0, 0, 0, 1, 0, 0, 0, 1, 1, 1, 2],
-    [2, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map9 = [(3.5, 10.5), (17.5, 9.5)]
-exit_map9 = [(8.5, 19.5), (8.5, 0.5)]
-radius_map9 = 1.5
-random_exits9 = [[3], [4]]
-
-#20*20
-map9 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 3, 3, 3, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 1, 1, 1, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1, 1, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 1, 1, 1, 1, 1, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2]
-])
-
-start_points_map10 = [(8.5, 6.5),(8.5, 8.5),(6.5, 6.5),(6.5, 8.5)]
-exit_map10 = [(14.5, 5.5),(14.5, 10.5),(0.5, 5.5),(0.5, 10.5)]
-radius_map10 = 1.5
-random_exits10 = [[3], [4], [5], [6]]
-
-map10 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-map10_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 6, 6, 6, 6, 4, 4, 4, 4, 4, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 0, 0, 5, 5, 5, 5, 3, 3, 3, 3, 3, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map11 = [(5.5, 5.5),(9.5, 5.5),(5.5, 8.5),(9.5, 8.5)]
-exit_map11 = [(2.5, 0.5),(12.5, 0.5),(2.5, 14.5),(12.5, 14.5)]
-radius_map11 = 1
-random_exits11 = [[3], [4], [5], [6]]
-
-map11 = np.array([
-    [2, 5, 5, 5, 2, 2, 2, 2, 2, 2, 2, 6, 6, 6, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 3, 3, 3, 2, 2, 2, 2, 2, 2, 2, 4, 4, 4, 2],
-])
-
-map11_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 5, 5, 5, 1, 1, 1, 1, 1, 1, 1, 6, 6, 6, 2],
-    [2, 5, 5, 5, 1, 1, 1, 1, 1, 1, 1, 6, 6, 6, 2],
-    [2, 5, 5, 5, 5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 2],
-    [2, 5, 5, 5, 5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 2],
-    [2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 2],
-    [2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 2],
-    [2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 2],
-    [2, 3, 3, 3, 1, 1, 1, 1, 1, 1, 1, 4, 4, 4, 2],
-    [2, 3, 3, 3, 1, 1, 1, 1, 1, 1, 1, 4, 4, 4, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-start_points_map12 = [(8.5, 6.5),(8.5, 8.5),(6.5, 6.5),(6.5, 8.5)]
-exit_map12 = [(14.5, 5.5),(14.5, 10.5),(0.5, 5.5),(0.5, 10.5)]
-radius_map12 = 1.5
-random_exits12 = [[3], [4], [5], [6]]
-
-map12 = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [6, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 4],
-    [6, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 4],
-    [6, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 4],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 2],
-    [5, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [5, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-map12_spawn = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 6, 6, 6, 4, 4, 4, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 6, 6, 6, 4, 4, 4, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 6, 6, 6, 4, 4, 4, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 6, 6, 6, 4, 4, 4, 1, 1, 0, 2],
-    [2, 0, 0, 0, 0, 6, 6, 6, 4, 4, 4, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 6, 6, 6, 4, 4, 4, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 0, 0, 0, 0, 0, 0, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 5, 5, 5, 3, 3, 3, 1, 1, 0, 2],
-    [2, 0, 0, 0, 0, 5, 5, 5, 3, 3, 3, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 5, 5, 5, 3, 3, 3, 0, 0, 0, 2],
-    [2, 0, 0, 1, 1, 5, 5, 5, 3, 3, 3, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 5, 5, 5, 3, 3, 3, 1, 1, 0, 2],
-    [2, 0, 0, 1, 1, 5, 5, 5, 3, 3, 3, 1, 1, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-# start_points_map12 = [(2.5, 7.5),(12.5, 2.5)]
-# exit_map12 = [(2.5, 0.5),(7.5, 14.5)]
-# radius_map12 = 1
-# random_exits12 = [[3], [4]]
-#
-# map12 = np.array([
-#     [2, 2, 2, 2, 2, 2, 4, 4, 4, 2, 2, 2, 2, 2, 2],
-#     [2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 2],
-#     [2, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 1, 0, 0, 0, 1, 1, 1, 0, 0, 2],
-#     [2, 0, 0, 1, 1, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 3, 3, 3, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-# ])
-#
-# map12_spawn = np.array([
-#     [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-#     [2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 1, 1, 1, 0, 0, 0, 1, 1, 1, 1, 1, 2],
-#     [2, 3, 3, 3, 3, 1, 0, 0, 0, 0, 4, 4, 4, 4, 2],
-#     [2, 3, 3, 3, 3, 1, 0, 0, 0, 0, 4, 4, 4, 4, 2],
-#     [2, 3, 3, 3, 3, 1, 0, 0, 0, 0, 4, 4, 4, 4, 2],
-#     [2, 3, 3, 3, 3, 1, 0, 0, 0, 1, 4, 4, 4, 4, 2],
-#     [2, 3, 3, 3, 3, 1, 0, 0, 0, 1, 1, 1, 0, 0, 2],
-#     [2, 0, 0, 1, 1, 1, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 2],
-#     [2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-# ])
-
-exit_test_map = [(10, 3), (10, 7)]
-start_points_test_map = [(4, 7),(4.5, 1),(2.125, 7),(4.5, 7),(6.0125, 7)]
-radius_test_map = 0
-test_map = np.array([
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 1, 1, 1, 1, 0, 0, 3],
-    [2, 0, 0, 0, 0, 1, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 3],
-    [2, 0, 0, 0, 0, 0, 0, 0, 0, 2],
-    [2, 2, 2, 2, 2, 2, 2, 2, 2, 2],
-])
-
-#map_01 =  Map(map1, exit_map1, start_points_map1, random_exits1, "map_01", radius_map1)
-map_02 = Map(map2, exit_map2, start_points_map2, random_exits2, "map_02", radius_map2, map2_spawn)
-map_05 = Map(map5, exit_map5, start_points_map5, random_exits5, "map_05", radius_map5, map5_spawn) #simple 1600 16 51.01min TD3
-map_06 = Map(map6, exit_map6, start_points_map6, random_exits6, "map_06", radius_map6, map6_spawn) #hard 1600 16 6_map11_use hour TD3
-#map_07 =  Map(map7, exit_map7, start_points_map7, random_exits7, "map_07", radius_map7)
-#!map_08 = Map(map8, exit_map8, start_points_map8, random_exits8, "map_08", radius_map8) #
-#!map_09 =  Map(map9, exit_map9, start_points_map9, random_exits9, "map_09", radius_map9)
-map_10 =  Map(map10, exit_map10, start_points_map10, random_exits10, "map_10", radius_map10, map10_spawn)
-map_11 =  Map(map11, exit_map11, start_points_map11, random_exits11, "map_11", radius_map11, map11_spawn)
-map_12 =  Map(map12, exit_map12, start_points_map12, random_exits12, "map_12", radius_map12, map12_spawn)
-#map_test = Map(test_map, exit_test_map, start_points_test_map, "map_test", radius_test_map)
\ No newline at end of file
+class LazyMap(Map):
+    '''
+    只在第一次访问地图属性时才从注册表中读取的Map，使得导入该模块时不需要读取任何地图文件
+    '''
+    def __init__(self, registry, name):
+        self.name = name
+        self._registry = registry
+
+    def __getattr__(self, item):
+        # 只有在实例中找不到该属性时才会调用
+        if item.startswith("__") or "_registry" not in self.__dict__:
+            raise AttributeError(item)
+        registry = self.__dict__.pop("_registry")
+        self.__dict__.update(registry.load(self.name).__dict__)
+        if item not in self.__dict__:
+            raise AttributeError(item)
+        return self.__dict__[item]
+
+class MapDerivedData():
+    '''
+    由地图网格计算得到的派生数据，墙体、障碍物、出口的坐标与原先逐格扫描的顺序一致
+    '''
+    def __init__(self, arrays):
+        self.obstacle_nodes = [tuple(p) for p in arrays["obstacle_nodes"].tolist()]
+        self.wall_nodes = [tuple(p) for p in arrays["wall_nodes"].tolist()]
+        self.exit_nodes = [(x, y, int(t)) for x, y, t in arrays["exit_nodes"].tolist()]
+        self.start_point_dic = defaultdict(list)
+        for x, y, t in arrays["spawn_nodes"].tolist():
+            self.start_point_dic[int(t)].append((x, y))
+        self.barrier_set = set((int(x), int(y)) for x, y in self.obstacle_nodes + self.wall_nodes)
+        self.merged_geometry = arrays["merged_geometry"]
+        self.distance_fields = {int(t): arrays["distance_fields"][k]
+                                for k, t in enumerate(arrays["exit_types"].tolist())}
+
+    @staticmethod
+    def build_arrays(terrain: np.ndarray, spawn: np.ndarray):
+        exit_mask = (terrain >= 3) & (terrain <= 9)
+        spawn_mask = (spawn >= 3) & (spawn <= 9)
+        exit_types = np.unique(terrain[exit_mask]).astype(np.int32)
+        if len(exit_types) > 0:
+            distance_fields = np.stack([compute_distance_field(terrain, t) for t in exit_types])
+        else:
+            distance_fields = np.zeros([0, terrain.shape[0], terrain.shape[1]], dtype=np.float32)
+        exit_nodes = cell_nodes(exit_mask)
+        spawn_nodes = cell_nodes(spawn_mask)
+        return {
+            "obstacle_nodes": cell_nodes(terrain == 1),
+            "wall_nodes": cell_nodes(terrain == 2),
+            "exit_nodes": np.concatenate([exit_nodes, terrain[exit_nodes[:, 0].astype(int), exit_nodes[:, 1].astype(int)]
+                                         .reshape([-1, 1])], axis=1),
+            "spawn_nodes": np.concatenate([spawn_nodes, spawn[spawn_nodes[:, 0].astype(int), spawn_nodes[:, 1].astype(int)]
+                                          .reshape([-1, 1])], axis=1),
+            "merged_geometry": merge_cells(terrain),
+            "exit_types": exit_types,
+            "distance_fields": distance_fields,
+        }
+
+    @classmethod
+    def load_or_build(cls, terrain: np.ndarray, spawn: np.ndarray, cache_path: str = None):
+        '''
+        :param terrain: 已经翻转后的地图网格
+        :param spawn: 已经翻转后的生成点网格
+        :param cache_path: 缓存文件路径，为None时只在内存中计算
+        :return:
+        '''
+        source_hash = hashlib.md5(np.ascontiguousarray(terrain, dtype=np.int8).tobytes() +
+                                  np.ascontiguousarray(spawn, dtype=np.int8).tobytes()).hexdigest()
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as arrs:
+                if int(arrs["version"]) == DERIVED_VERSION and str(arrs["source_hash"]) == source_hash:
+                    return cls({key: arrs[key] for key in arrs.files})
+        arrays = cls.build_arrays(terrain, spawn)
+        if cache_path is not None:
+            # 先写入临时文件再替换，避免多个进程同时读写时读到不完整的缓存
+            tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+            try:
+                with open(tmp_path, "wb") as file:
+                    np.savez_compressed(file, version=np.array(DERIVED_VERSION),
+                                        source_hash=np.array(source_hash), **arrays)
+                os.replace(tmp_path, cache_path)
+            except OSError:  # 地图目录只读时只使用内存中的结果
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return cls(arrays)
+
+class MapRegistry():
+    '''
+    地图注册表，按名字查找地图目录中的描述文件，地图只在第一次使用时读取并在进程内共享
+    '''
+    def __init__(self, *dirs):
+        self.dirs = list(dirs)
+        self.maps = {}
+
+    def add_dir(self, path):
+        if path not in self.dirs:
+            self.dirs.insert(0, path)
+
+    def names(self):
+        names = set()
+        for path in self.dirs:
+            for file in glob.glob(os.path.join(path, "*.json")):
+                names.add(os.path.splitext(os.path.basename(file))[0])
+        return sorted(names)
+
+    def load(self, name) -> Map:
+        if name not in self.maps:
+            for path in self.dirs:
+                file = os.path.join(path, name + ".json")
+                if os.path.exists(file):
+                    self.maps[name] = Map.from_file(file)
+                    break
+            else:
+                raise Exception("找不到名为{}的地图!".format(name))
+        return self.maps[name]
+
+    def lazy(self, name) -> Map:
+        return LazyMap(self, name)
+
+def cell_nodes(mask: np.ndarray):
+    '''
+    得到掩码中为True的格子中心点坐标，按照从左往右，从上到下的遍历顺序
+    :param mask: shape为[W,H]的bool数组
+    :return: shape为[K,2]的数组
+    '''
+    js, is_ = np.nonzero(mask.T)
+    return np.stack([is_ + 0.5, js + 0.5], axis=1).astype(np.float64)
+
+def merge_cells(terrain: np.ndarray):
+    '''
+    将值相同的相邻非空格子贪心地合并为尽可能大的矩形，用于减少需要绘制的图形数量
+    :param terrain: 已经翻转后的地图网格
+    :return: shape为[K,5]的数组，每一行为[格子值,左下角x,左下角y,宽,高]
+    '''
+    used = terrain == 0
+    width, height = terrain.shape
+    rects = []
+    for j in range(height):
+        for i in range(width):
+            if used[i, j]:
+                continue
+            value = terrain[i, j]
+            w = 1
+            while i + w < width and not used[i + w, j] and terrain[i + w, j] == value:
+                w += 1
+            h = 1
+            while j + h < height and not used[i:i + w, j + h].any() and (terrain[i:i + w, j + h] == value).all():
+                h += 1
+            used[i:i + w, j:j + h] = True
+            rects.append((value, i, j, w, h))
+    return np.array(rects, dtype=np.float32).reshape([-1, 5])
+
+def compute_distance_field(terrain: np.ndarray, exit_type):
+    '''
+    以八邻域Dijkstra计算每个空地格子沿可通行区域到指定出口的距离
+    :param terrain: 已经翻转后的地图网格
+    :param exit_type: 出口编号(3~9)
+    :return: shape与terrain相同的float32数组，不可达处为inf
+    '''
+    width, height = terrain.shape
+    passable = terrain == 0
+    dist = np.full(terrain.shape, np.inf)
+    heap = []
+    for i, j in zip(*np.nonzero(terrain == exit_type)):
+        dist[i, j] = 0.0
+        heap.append((0.0, int(i), int(j)))
+    heapq.heapify(heap)
+    while len(heap) > 0:
+        d, i, j = heapq.heappop(heap)
+        if d > dist[i, j]:
+            continue
+        for di, dj, cost in NEIGHBOURS:
+            ni, nj = i + di, j + dj
+            if 0 <= ni < width and 0 <= nj < height and passable[ni, nj] and d + cost < dist[ni, nj]:
+                dist[ni, nj] = d + cost
+                heapq.heappush(heap, (d + cost, ni, nj))
+    return dist.astype(np.float32)
+
+def load_png_grid(path):
+    '''
+    读取png格式的地图掩码，像素的灰度值即为格子的值(0为空地,1为障碍物,2为墙,3~9为出口)，
+    图片的第一行对应地图最上方的一行，与npz中的数组方向一致
+    :param path:
+    :return:
+    '''
+    import matplotlib.image as mpimg
+    img = mpimg.imread(path)
+    if img.ndim == 3:
+        img = img[:, :, 0]
+    if img.dtype.kind == "f":
+        img = np.round(img * 255)
+    return img.astype(np.int8)
+
+registry = MapRegistry(MAP_DATA_DIR)
+
+def get_map(name) -> Map:
+    return registry.load(name)
+
+#map_01 = registry.lazy("map_01")
+map_02 = registry.lazy("map_02")
+map_05 = registry.lazy("map_05") #simple 1600 16 51.01min TD3
+map_06 = registry.lazy("map_06") #hard 1600 16 6_map11_use hour TD3
+#map_07 = registry.lazy("map_07")
+#!map_08 = registry.lazy("map_08") #
+#!map_09 = registry.lazy("map_09")
+map_10 = registry.lazy("map_10")
+map_11 = registry.lazy("map_11")
+map_12 = registry.lazy("map_12")
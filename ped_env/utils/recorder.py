@@ -0,0 +1,205 @@
+import io
+import pickle
+import queue
+import struct
+import threading
+
+import numpy as np
+
+# 文件格式: MAGIC + 若干数据块，每个数据块为[1字节类型][4字节长度][数据]
+# 'E'块为一个episode的元信息(pickle)，'C'块为该episode中若干帧轨迹(np.savez_compressed)
+MAGIC = b"PEDTRJ01"
+EPISODE_BLOCK = b"E"
+CHUNK_BLOCK = b"C"
+
+TICKS_PER_SEC = 50
+POS_QUANTUM = 0.005  # 位置以int16存储时的量化步长(米)，可表示±163米的范围
+
+# 行人状态按位编码在int16中
+STATE_DONE = 1
+STATE_REMOVED = 1 << 1
+STATE_LEADER = 1 << 2
+PERSON_STATE_SHIFT = 4
+
+
+class TrajectoryRecorder:
+    '''
+    将仿真过程中每一帧的行人位置、速度、状态与到达出口事件以量化后压缩的二进制形式流式写入文件，
+    压缩与写入均在后台线程中进行，仿真主循环只需拷贝一次数据而不会等待IO
+    '''
+    def __init__(self, path, tick_interval=1, chunk_size=256):
+        '''
+        :param path: 轨迹文件的保存路径
+        :param tick_interval: 每隔多少个物理帧记录一次
+        :param chunk_size: 每个压缩块包含的帧数
+        '''
+        self.path = path
+        self.tick_interval = tick_interval
+        self.chunk_size = chunk_size
+        self.episode = -1
+
+        self.file = open(path, "wb")
+        self.file.write(MAGIC)
+        self.queue = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def begin_episode(self, env):
+        '''
+        在环境reset后调用，记录该episode的地图与行人信息
+        :param env: PedsMoveEnv
+        :return:
+        '''
+        self.episode += 1
+        meta = {
+            "episode": self.episode,
+            "map_name": env.terrain.name,
+            "map": np.array(env.terrain.map, dtype=np.int8),
+            "exits": list(env.terrain.exits),
+            "ped_ids": np.array([ped.id for ped in env.peds], dtype=np.int32),
+            "exit_types": np.array([ped.exit_type for ped in env.peds], dtype=np.int16),
+            "radius": env.peds[0].radius if len(env.peds) > 0 else 0.2,
+            "tick_seconds": 1.0 / TICKS_PER_SEC,
+            "pos_quantum": POS_QUANTUM,
+        }
+        self.queue.put((EPISODE_BLOCK, meta))
+
+    def record(self, env, tick):
+        '''
+        记录当前物理帧所有行人的状态，只在主线程中做一次数据拷贝
+        :param env: PedsMoveEnv
+        :param tick: 当前episode中经过的物理帧数
+        :return:
+        '''
+        if tick % self.tick_interval != 0:
+            return
+        peds = env.peds
+        pos = np.array([(ped.x, ped.y) for ped in peds], dtype=np.float32)
+        vel = np.array([(ped.vec[0], ped.vec[1]) for ped in peds], dtype=np.float32)
+        state = np.array([(STATE_DONE if ped.is_done else 0) |
+                          (STATE_REMOVED if ped.has_removed else 0) |
+                          (STATE_LEADER if ped.is_leader else 0) |
+                          (ped.person_state.value << PERSON_STATE_SHIFT) for ped in peds], dtype=np.int16)
+        self.queue.put((CHUNK_BLOCK, (tick, pos, vel, state)))
+
+    def close(self):
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        self.closed = True
+
+    def _write_loop(self):
+        frames = []
+        last_done = None
+        while True:
+            item = self.queue.get()
+            if item is None or item[0] == EPISODE_BLOCK:
+                self._write_chunk(frames)
+                frames = []
+                last_done = None
+                if item is None:
+                    break
+                self._write_block(EPISODE_BLOCK, pickle.dumps(item[1], pickle.HIGHEST_PROTOCOL))
+                continue
+            tick, pos, vel, state = item[1]
+            done = (state & STATE_DONE) != 0
+            # 通过is_done的变化来得到到达出口事件
+            exited = np.nonzero(done & ~last_done)[0] if last_done is not None else np.nonzero(done)[0]
+            last_done = done
+            frames.append((tick, pos, vel, state, exited))
+            if len(frames) >= self.chunk_size:
+                self._write_chunk(frames)
+                frames = []
+
+    def _write_chunk(self, frames):
+        if len(frames) == 0:
+            return
+        ticks = np.array([f[0] for f in frames], dtype=np.int32)
+        pos = np.stack([f[1] for f in frames])
+        pos = np.clip(np.round(pos / POS_QUANTUM), -32768, 32767).astype(np.int16)
+        vel = np.stack([f[2] for f in frames]).astype(np.float16)
+        state = np.stack([f[3] for f in frames])
+        events = [(f[0], idx) for f in frames for idx in f[4]]
+        events = np.array(events, dtype=np.int32).reshape([-1, 2])  # [物理帧, 行人下标]
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, ticks=ticks, pos=pos, vel=vel, state=state, events=events)
+        self._write_block(CHUNK_BLOCK, buffer.getvalue())
+
+    def _write_block(self, block_type, data):
+        self.file.write(block_type)
+        self.file.write(struct.pack("<I", len(data)))
+        self.file.write(data)
+        self.file.flush()
+
+
+class TrajectoryEpisode:
+    '''
+    一个episode的轨迹数据，位置已经还原为以米为单位的float32
+    '''
+    def __init__(self, meta, chunks):
+        self.meta = meta
+        if len(chunks) > 0:
+            self.ticks = np.concatenate([c["ticks"] for c in chunks])
+            self.pos = np.concatenate([c["pos"] for c in chunks]).astype(np.float32) * meta["pos_quantum"]
+            self.vel = np.concatenate([c["vel"] for c in chunks]).astype(np.float32)
+            self.state = np.concatenate([c["state"] for c in chunks])
+            self.events = np.concatenate([c["events"] for c in chunks])
+        else:
+            ped_num = len(meta["ped_ids"])
+            self.ticks = np.zeros([0], dtype=np.int32)
+            self.pos = np.zeros([0, ped_num, 2], dtype=np.float32)
+            self.vel = np.zeros([0, ped_num, 2], dtype=np.float32)
+            self.state = np.zeros([0, ped_num], dtype=np.int16)
+            self.events = np.zeros([0, 2], dtype=np.int32)
+
+    @property
+    def removed(self):
+        return (self.state & STATE_REMOVED) != 0
+
+    @property
+    def is_leader(self):
+        return (self.state & STATE_LEADER) != 0
+
+    def __len__(self):
+        return self.ticks.shape[0]
+
+
+class TrajectoryReader:
+    '''
+    读取TrajectoryRecorder生成的轨迹文件，不依赖于仿真环境
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def _blocks(self):
+        with open(self.path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise Exception("不是有效的轨迹文件!")
+            while True:
+                head = file.read(5)
+                if len(head) < 5:
+                    break
+                block_type, length = head[:1], struct.unpack("<I", head[1:])[0]
+                data = file.read(length)
+                if len(data) < length:  # 记录过程中断时最后一个块可能不完整
+                    break
+                yield block_type, data
+
+    def episodes(self):
+        meta, chunks = None, []
+        for block_type, data in self._blocks():
+            if block_type == EPISODE_BLOCK:
+                if meta is not None:
+                    yield TrajectoryEpisode(meta, chunks)
+                meta, chunks = pickle.loads(data), []
+            elif block_type == CHUNK_BLOCK:
+                with np.load(io.BytesIO(data)) as arrs:
+                    chunks.append({key: arrs[key] for key in arrs.files})
+        if meta is not None:
+            yield TrajectoryEpisode(meta, chunks)
+
+    def load(self):
+        return list(self.episodes())
@@ -4,16 +4,22 @@ import time
 import Box2D as b2d
 
 import pyglet
+import numpy as np
+
+from ped_env.functions import transfer_to_render
+from ped_env.utils.colors import ColorBlue, ColorWall, ColorYellow, exit_type_to_color
+from ped_env.utils.maps import merge_cells
+from ped_env.utils.recorder import TrajectoryReader
 
 TICKS_PER_SEC = 50
 
 class PedsMoveEnvViewer(pyglet.window.Window):
-    def __init__(self, env):
+    def __init__(self, env, visible=True):
         super().__init__(width=500,
                          height=500,
                          caption="行人行走模拟环境",
                          config=pyglet.gl.Config(double_buffer=True),
-                         visible=True)
+                         visible=visible)
 
         # This call schedules the `update()` method to be called
         # TICKS_PER_SEC. This is the main game event loop.
@@ -21,18 +27,35 @@ class PedsMoveEnvViewer(pyglet.window.Window):
         # 窗口背景颜色
         pyglet.gl.glClearColor(1, 1, 1, 1)
         self.env = env
+        self.env_batch = None
         self.frame_time = time.time()
         self.cor_frame_time = self.env.frame_skipping * 1 / TICKS_PER_SEC
         self.pressed = False
+        self.paced = True
 
-    def render(self):
-        self.env.setup_graphics()
+    def render(self, mode="human"):
+        # 环境每次reset都会创建新的batch，此时才重新创建所有图形，否则只更新行人的位置
+        if self.env_batch is not self.env.batch:
+            self.env_batch = self.env.batch
+            self.env.setup_graphics()
+        else:
+            self.env.update_graphics()
+        self.paced = (mode == "human")
         self.switch_to()
         self.dispatch_events()
         self.dispatch_event('on_draw')
         #self.dispatch_event('on_key_press')
+        if mode == "rgb_array":
+            return self.get_rgb_array()
         self.flip()
 
+    def get_rgb_array(self):
+        buffer = pyglet.image.get_buffer_manager().get_color_buffer()
+        image_data = buffer.get_image_data()
+        arr = np.frombuffer(image_data.get_data("RGBA", buffer.width * 4), dtype=np.uint8)
+        arr = arr.reshape([buffer.height, buffer.width, 4])
+        return np.ascontiguousarray(arr[::-1, :, :3])  # OpenGL以左下角为原点
+
     def on_key_press(self, symbol, modifiers):
         if symbol == pyglet.window.key.SPACE and not self.pressed:
             self.pressed = True
@@ -43,6 +66,8 @@ class PedsMoveEnvViewer(pyglet.window.Window):
         dt = now_time - self.frame_time
         self.frame_time = now_time
         self.env.batch.draw()
+        if not self.paced:
+            return
         time_in_env = self.env.step_in_env * 1 / 50
         if self.cor_frame_time < dt:
             self.set_caption("行人行走模拟环境,当前时间:{}".format(time_in_env) + "@@以更慢的速度渲染!")
@@ -50,17 +75,106 @@ class PedsMoveEnvViewer(pyglet.window.Window):
             self.set_caption("行人行走模拟环境,当前时间:{}".format(time_in_env))
             time.sleep(self.cor_frame_time - dt)
 
-class PedsMoveEnvViewerWithBuffer(pyglet.window.Window):
-    def __init__(self, model):
-        super().__init__(width=500,
-                         height=500,
-                         caption="行人行走模拟环境",
+class PedsMoveReplayViewer(pyglet.window.Window):
+    '''
+    用于回放TrajectoryRecorder录制的轨迹文件，不需要运行仿真环境，可以任意倍速播放
+    '''
+    def __init__(self, path, speed=1.0, window_size=500):
+        super().__init__(width=window_size,
+                         height=window_size,
+                         caption="行人行走模拟环境回放",
                          config=pyglet.gl.Config(double_buffer=True),
                          visible=True)
         pyglet.gl.glClearColor(1, 1, 1, 1)
-        self.model = model
-        self.buffers = []
+        self.window_size = window_size
+        self.speed = speed
+        self.episodes = TrajectoryReader(path).episodes()
+        self.episode = None
+        self.frame = 0.0
+        self.pressed = False
+        self.finished = False
+        self.next_episode()
+
+    def next_episode(self):
+        self.episode = next(self.episodes, None)
+        if self.episode is None:
+            self.finished = True
+            return
+        meta = self.episode.meta
+        terrain = meta["map"]
+        self.render_scale = self.window_size / terrain.shape[0]
+        self.batch = pyglet.graphics.Batch()
+        self.display_level = pyglet.graphics.OrderedGroup(0)
+        self.debug_level = pyglet.graphics.OrderedGroup(1)
+        # 静态的墙体与出口只在每个episode开始时创建一次
+        self.static_shapes = []
+        # 相邻的同类格子合并为一个矩形绘制
+        for value, i, j, w, h in merge_cells(terrain).tolist():
+            if value == 1:
+                color = ColorBlue
+            elif value == 2:
+                color = ColorWall
+            else:
+                color = exit_type_to_color(int(value))
+            x, y, width, height = transfer_to_render(i + w / 2, j + h / 2, w, h, self.render_scale)
+            self.static_shapes.append(pyglet.shapes.Rectangle(x, y, width, height, color, self.batch,
+                                                              group=self.display_level))
+        radius = meta["radius"] * self.render_scale
+        self.ped_shapes = [pyglet.shapes.Circle(0, 0, radius, color=exit_type_to_color(exit_type),
+                                                batch=self.batch, group=self.display_level)
+                           for exit_type in meta["exit_types"].tolist()]
+        self.leader_shapes = [pyglet.shapes.Circle(0, 0, radius * 0.3, color=ColorYellow,
+                                                   batch=self.batch, group=self.debug_level)
+                              for _ in self.ped_shapes]
+        self.frame = 0.0
+
+    def update(self, dt):
+        if self.finished:
+            pyglet.app.exit()
+            return
+        # 按照录制时的物理帧间隔与播放倍速推进帧数
+        if len(self.episode) > 1:
+            tick_gap = (self.episode.ticks[-1] - self.episode.ticks[0]) / (len(self.episode) - 1)
+        else:
+            tick_gap = 1
+        self.frame += dt * self.speed / (self.episode.meta["tick_seconds"] * max(tick_gap, 1))
+        if int(self.frame) >= len(self.episode):
+            self.next_episode()
+            return
+        idx = int(self.frame)
+        pos = self.episode.pos[idx] * self.render_scale
+        removed = self.episode.removed[idx]
+        is_leader = self.episode.is_leader[idx]
+        for k, (body, head) in enumerate(zip(self.ped_shapes, self.leader_shapes)):
+            body.position = (pos[k, 0], pos[k, 1])
+            head.position = (pos[k, 0], pos[k, 1])
+            body.opacity = 0 if removed[k] else 255
+            head.opacity = 255 if is_leader[k] and not removed[k] else 0
+        self.set_caption("行人行走模拟环境回放,episode:{},当前时间:{:.2f}".format(
+            self.episode.meta["episode"], self.episode.ticks[idx] * self.episode.meta["tick_seconds"]))
+
+    def on_key_press(self, symbol, modifiers):
+        if symbol == pyglet.window.key.SPACE:
+            self.pressed = not self.pressed
+            if self.pressed:
+                pyglet.clock.unschedule(self.update)
+            else:
+                pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
+        elif symbol == pyglet.window.key.UP:
+            self.speed *= 2
+        elif symbol == pyglet.window.key.DOWN:
+            self.speed /= 2
+
+    def on_draw(self):
+        self.clear()
+        if self.episode is not None:
+            self.batch.draw()
+
+    def play(self):
+        pyglet.clock.schedule_interval(self.update, 1.0 / TICKS_PER_SEC)
+        pyglet.app.run()
+        self.close()
 
-    def render(self):
-        self.model.setup_graphics()
-        self.buffers.append(self.model.batch)
+if __name__ == '__main__':
+    #python viewer.py xxx.trj 2.0
+    PedsMoveReplayViewer(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 1.0).play()
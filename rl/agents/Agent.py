@@ -11,11 +11,11 @@ import numpy as np
 from gym import Env
 from random import random,choice
 from tqdm import tqdm
-from torch.utils.tensorboard import SummaryWriter
 
 from rl.utils.classes import Experience,Transition
 from rl.utils.classes import make_parallel_env
 from rl.utils.functions import early_stop_callback, load_experience
+from rl.utils.metrics import MetricsSink, LossHistory
 
 
 class Agent():
@@ -82,9 +82,11 @@ class Agent():
                 os.makedirs(self.model_dir)
             if not os.path.exists(self.summary_dir):
                 os.makedirs(self.summary_dir)
-            self.writer = SummaryWriter(log_dir=self.summary_dir)
+            self.writer = MetricsSink(self.summary_dir) #在后台线程中定期写入TensorBoard
 
         self.info_handler = None
+        self.checkpointer = None #不为None时在save_callback中保存完整的训练状态
+        self.loss_recoder = LossHistory() #只保留最近的损失记录
         self.info_callback_ = None
         self.loss_callback_ = None
         self.save_callback_ = None
@@ -211,11 +213,15 @@ class Agent():
         if display_in_episode > 0:
             display = False
             wait = False
-        total_time, episode_reward, num_episode = 0,0,0
-        total_times,self.episode_rewards,num_episodes = [],[],[]
+        if self.total_episodes_in_train == 0:
+            self.total_times, self.episode_rewards, self.num_episodes = [], [], []
+            self.init_train(init_exp_file, lock) #加载用于初始化的探索经验
+        #从检查点恢复时继续之前的训练历史
+        total_times, num_episodes = self.total_times, self.num_episodes
+        total_time = total_times[-1] if len(total_times) > 0 else 0
+        episode_reward, num_episode = 0, len(num_episodes)
         max_explore_num = int(max_episode_num * explore_episodes_percent)
-        self.init_train(init_exp_file, lock) #加载用于初始化的探索经验
-        for i in tqdm(range(0, max_episode_num, 1)):
+        for i in tqdm(range(num_episode, max_episode_num, 1)):
             #用于ε-贪心算法中ε随着经历的递增而逐级减少
             if decaying_epsilon:
                 #epsilon = epsilon_low + (epsilon_high - epsilon_low) * ((max_explore_num - i) / max_explore_num) if i < max_explore_num else 0
@@ -246,6 +252,8 @@ class Agent():
         #在训练完成后关闭训练环境
         self.env.close()
         self.writer.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
         return total_times,self.episode_rewards,num_episodes
 
     def init_random_step(self, state, step): #用于初始化探索更新使用
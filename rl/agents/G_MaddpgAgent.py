@@ -13,8 +13,8 @@ from rl.agents.Agent import Agent
 from rl.utils.model.predict_env import PredictEnv
 from rl.utils.networks.pd_network import MLPNetworkActor, MLPNetworkCritic
 from rl.utils.model.model import EnsembleDynamicsModel
-from rl.utils.updates import soft_update, hard_update
-from rl.utils.classes import SaveNetworkMixin, Noise, Experience, ModelBasedMAAgentMixin, \
+from rl.utils.updates import soft_update_all, hard_update, target_pairs
+from rl.utils.classes import SaveNetworkMixin, Noise, Experience, ArrayExperience, ModelBasedMAAgentMixin, \
     MAAgentMixin
 from rl.utils.functions import back_specified_dimension, onehot_from_logits, gumbel_softmax, flatten_data, \
     onehot_from_int, process_maddpg_experience_data, save_callback, model_based_loss_callback
@@ -76,7 +76,6 @@ class DDPGAgent:
 
 
 class G_MADDPGAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent):
-    loss_recoder = []
 
     def __init__(self, env: Env = None,
                  capacity=2e6,
@@ -167,7 +166,7 @@ class G_MADDPGAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agen
                                            sum(self.action_dims) if not self.discrete else self.env.agent_count,
                                            self.env.agent_count, model_hidden_dim, use_decay)
         self.predict_env = PredictEnv(self.model, self.env_name, 'pytorch')
-        self.model_experience = Experience(capacity)
+        self.model_experience = ArrayExperience(capacity)
 
         for i in range(self.env.agent_count):
             ag = DDPGAgent(self.state_dims[i], self.action_dims[i],
@@ -175,6 +174,7 @@ class G_MADDPGAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agen
                            self.action_dims, actor_network, critic_network, actor_hidden_dim,
                            critic_hidden_dim)
             self.agents.append(ag)
+        self._index_critics()
 
         self.loss_callback_ = model_based_loss_callback
         self.save_callback_ = save_callback
@@ -247,6 +247,6 @@ class G_MADDPGAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agen
             self.agents[i].actor_optimizer.step()
             total_actor_loss += actor_loss.item()
 
-            soft_update(self.agents[i].target_actor, self.agents[i].actor, self.tau)
-            soft_update(self.agents[i].target_critic, self.agents[i].critic, self.tau)
+        # 所有智能体更新完成后一起软更新目标网络
+        soft_update_all(target_pairs(self.agents), self.tau)
         return (total_critic_loss, total_actor_loss)
\ No newline at end of file
@@ -15,8 +15,9 @@ from rl.utils.miscellaneous import CUDA_DEVICE_ID
 from rl.utils.model.model import EnsembleDynamicsModel
 from rl.utils.model.predict_env import PredictEnv
 from rl.utils.networks.maddpg_network import MLPNetworkActor, DoubleQNetworkCritic
-from rl.utils.updates import soft_update, hard_update
-from rl.utils.classes import SaveNetworkMixin, Noise, Experience, MAAgentMixin, ModelBasedMAAgentMixin, \
+from rl.utils.updates import soft_update_all, hard_update, target_pairs
+from rl.utils.data_parallel import double_q_critic_loss
+from rl.utils.classes import SaveNetworkMixin, Noise, Experience, ArrayExperience, MAAgentMixin, ModelBasedMAAgentMixin, \
     PedsMoveInfoDataHandler
 from rl.utils.functions import back_specified_dimension, onehot_from_logits, gumbel_softmax, flatten_data, \
     onehot_from_int, save_callback, process_maddpg_experience_data, loss_callback, model_based_loss_callback, \
@@ -77,7 +78,7 @@ class DDPGAgent:
         return action
 
 class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent):
-    loss_recoder = []
+    critic_loss_fn = staticmethod(double_q_critic_loss)
 
     def __init__(self, env: Env = None,
                  capacity=2e6,
@@ -106,6 +107,8 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
                  model_batch_size=2048,
                  model_train_freq=1000,
                  n_steps_model=50,
+                 model_dataset_size=200000,
+                 model_inference="sparse",
                  rollout_length_range=(1, 1),
                  rollout_epoch_range=(60, 1500),
                  rollout_batch_size=256,
@@ -115,7 +118,12 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
                  batch_size_d = 128,
                  demo_experience:Experience=None,
                  lambda_1 = 0.001,
-                 lambda_2 = 0.0078
+                 lambda_2 = 0.0078,
+
+                 share_parameters=False,
+                 agent_embed_dim=8,
+                 reduced_precision=False,
+                 precision_check_interval=10
                  ):
         '''
         环境的输入有以下几点变化，设此时有N个智能体：
@@ -132,6 +140,11 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
         :param update_frequent:
         :param debug_log_frequent:
         :param gamma:
+        :param share_parameters: 所有智能体是否共用一个以智能体编号嵌入向量为条件的演员与评判家网络
+        :param agent_embed_dim: 参数共享时智能体编号嵌入向量的维数
+        :param reduced_precision: 是否使用低精度模式：动力学模型的训练、预测与rollout使用bfloat16自动混合精度，
+            经验池中的状态以float16保存，网络参数仍为float32
+        :param precision_check_interval: 低精度模式下第一次以及之后每隔多少次动力学模型训练与float32比较验证集的mse，为0时不比较
         '''
         if env is None:
             raise Exception("agent should have an environment!")
@@ -163,15 +176,17 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
         self.K = K
         self.device = torch.device('cuda:'+str(CUDA_DEVICE_ID)) if torch.cuda.is_available() else torch.device('cpu')
         self.agents = []
-        self.experience = Experience(capacity)
-        for i in range(self.env.agent_count):
-            ag = DDPGAgent(self.state_dims[i], self.action_dims[i],
-                           self.learning_rate, self.discrete, self.device, self.state_dims,
-                           self.action_dims, actor_network, critic_network, self.actor_hidden_dim, self.critic_hidden_dim)
-            self.agents.append(ag)
+        obs_dtype = np.float16 if reduced_precision else None
+        self.experience = Experience(capacity, obs_dtype)
+        self._init_shared_agents(lambda state_dim, action_dim, state_dims:
+                                 DDPGAgent(state_dim, action_dim, self.learning_rate, self.discrete, self.device,
+                                           state_dims, self.action_dims, actor_network, critic_network,
+                                           self.actor_hidden_dim, self.critic_hidden_dim),
+                                 share_parameters, agent_embed_dim)
 
         # model-based parameters
         self.model_batch_size = model_batch_size
+        self.precision_check_interval = precision_check_interval
         self.model_retain_epochs = model_retain_epochs
         self.n_steps_train = n_steps_train
         self.model_train_freq = int(model_train_freq / n_rol_threads) #为了消除多线程带来的影响，rollout的更新频率需要增加
@@ -183,14 +198,18 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
         self.real_ratio = real_ratio
         self.model = EnsembleDynamicsModel(network_size, elite_size, sum(self.state_dims),
                                            sum(self.action_dims) if not self.discrete else 2 * self.env.agent_count,#当为离散动作时，依然采用连续动作空间(x,y)
-                                           self.env.agent_count, model_hidden_dim, use_decay)
-        self.predict_env = PredictEnv(self.model, self.env_name, 'pytorch')
-        self.model_experience = Experience(capacity)
+                                           self.env.agent_count, model_hidden_dim, use_decay,
+                                           dataset_size=model_dataset_size,
+                                           precision="bfloat16" if reduced_precision else "float32")
+        self.predict_env = PredictEnv(self.model, self.env_name, 'pytorch', model_inference)
+        self.model_experience = ArrayExperience(capacity, np.float32 if obs_dtype is None else obs_dtype)
 
         self.episode_length = env.maxStep
 
         self.batch_size_d = batch_size_d
         if demo_experience:
+            if self.shared_agent is not None:
+                raise Exception("参数共享模式暂不支持使用演示经验!")
             if self.batch_size_d > self.batch_size:
                 raise Exception("演示经验批次数大于环境经验批次数!")
             #self.batch_size -= self.batch_size_d #减去演示经验批次数
@@ -215,6 +234,8 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
         :return:
         '''
         # 随机获取记忆里的Transmition
+        if self.shared_agent is not None:
+            return self._learn_shared_from_memory(trans_pieces)
         total_critic_loss = 0.0
         total_loss_actor = 0.0
 
@@ -239,13 +260,7 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
                 target_V = torch.min(target_Q1, target_Q2)
             # 优化两个评判家网络参数，优化的目标是使评判值与r + gamma * Q'(s1,a1)尽量接近
             target_Q = r1[:,i] + self.gamma * target_V * torch.tensor(1 - is_done[:,i]).to(self.device)
-            current_Q1, current_Q2 = self.agents[i].critic.forward(s0_critic_in, a0)  # 此时没有使用detach！
-            critic_loss = MSELoss(current_Q1, target_Q) + MSELoss(current_Q2, target_Q)
-            self.agents[i].critic_optimizer.zero_grad()
-            critic_loss.backward()
-            torch.nn.utils.clip_grad_norm_(self.agents[i].critic.parameters(), 0.5)
-            self.agents[i].critic_optimizer.step()
-            total_critic_loss += critic_loss.item()
+            total_critic_loss += self.update_critic(i, s0_critic_in, a0, target_Q)
 
             # 每隔K轮才对策略网络和目标网络进行一次更新
             if self.train_update_count % self.K == 0:
@@ -293,10 +308,9 @@ class MAMBPOAgent(ModelBasedMAAgentMixin, MAAgentMixin, SaveNetworkMixin, Agent)
                 self.agents[i].actor_optimizer.step()
                 total_loss_actor += actor_loss.item()
 
-                if not BC:
-                    # 软更新参数
-                    soft_update(self.agents[i].target_actor, self.agents[i].actor, self.tau)
-                    soft_update(self.agents[i].target_critic, self.agents[i].critic, self.tau)
+        if not BC and self.train_update_count % self.K == 0:
+            # 所有智能体更新完成后一起软更新目标网络
+            soft_update_all(target_pairs(self.agents), self.tau)
         # 为了更新bc,将该过程移到外部执行
         return (total_critic_loss, total_loss_actor)
 
@@ -12,7 +12,8 @@ from torch import nn
 
 from rl.agents.Agent import Agent
 from rl.utils.networks.pd_network import MLPNetworkActor, MLPNetworkCritic
-from rl.utils.updates import soft_update, hard_update
+from rl.utils.updates import soft_update_all, hard_update, target_pairs
+from rl.utils.data_parallel import critic_loss
 from rl.utils.classes import SaveNetworkMixin, Noise, Experience, MAAgentMixin
 from rl.utils.functions import back_specified_dimension, onehot_from_logits, gumbel_softmax, flatten_data, \
     onehot_from_int, save_callback, process_maddpg_experience_data, loss_callback
@@ -72,7 +73,7 @@ class DDPGAgent:
         return action
 
 class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
-    loss_recoder = []
+    critic_loss_fn = staticmethod(critic_loss)
 
     def __init__(self, env: Env = None,
                  capacity=2e6,
@@ -88,7 +89,9 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
                  actor_hidden_dim=64,
                  critic_hidden_dim=64,
                  env_name="training_env",
-                 n_steps_train = 3
+                 n_steps_train = 3,
+                 share_parameters=False,
+                 agent_embed_dim=8
                  ):
         '''
         环境的输入有以下几点变化，设此时有N个智能体：
@@ -105,6 +108,8 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
         :param update_frequent:
         :param debug_log_frequent:
         :param gamma:
+        :param share_parameters: 所有智能体是否共用一个以智能体编号嵌入向量为条件的演员与评判家网络
+        :param agent_embed_dim: 参数共享时智能体编号嵌入向量的维数
         '''
         if env is None:
             raise Exception("agent should have an environment!")
@@ -136,11 +141,11 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
 
         self.n_steps_train = n_steps_train
 
-        for i in range(self.env.agent_count):
-            ag = DDPGAgent(self.state_dims[i], self.action_dims[i],
-                           self.learning_rate, self.discrete, self.device, self.state_dims,
-                           self.action_dims, actor_network, critic_network, actor_hidden_dim, critic_hidden_dim)
-            self.agents.append(ag)
+        self._init_shared_agents(lambda state_dim, action_dim, state_dims:
+                                 DDPGAgent(state_dim, action_dim, self.learning_rate, self.discrete, self.device,
+                                           state_dims, self.action_dims, actor_network, critic_network,
+                                           actor_hidden_dim, critic_hidden_dim),
+                                 share_parameters, agent_embed_dim)
 
         self.loss_callback_ = loss_callback
         self.save_callback_ = save_callback
@@ -155,6 +160,8 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
         :return:
         '''
         # 随机获取记忆里的Transmition
+        if self.shared_agent is not None:
+            return self._learn_shared_from_memory(trans_pieces)
         total_critic_loss = 0.0
         total_actor_loss = 0.0
 
@@ -175,13 +182,7 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
                 target_V = self.agents[i].target_critic.forward(s1_critic_in, a1)
             # 优化评判家网络参数，优化的目标是使评判值与r + gamma * Q'(s1,a1)尽量接近
             target_Q = r1[:, i] + self.gamma * target_V * torch.tensor(1 - is_done[:, i]).to(self.device)
-            current_Q = self.agents[i].critic.forward(s0_critic_in, a0) # 此时没有使用detach！
-            critic_loss = MSELoss(current_Q, target_Q).to(self.device)
-            self.agents[i].critic_optimizer.zero_grad()
-            critic_loss.backward()
-            torch.nn.utils.clip_grad_norm_(self.agents[i].critic.parameters(), 0.5)
-            self.agents[i].critic_optimizer.step()
-            total_critic_loss += critic_loss.item()
+            total_critic_loss += self.update_critic(i, s0_critic_in, a0, target_Q)
 
             # 优化演员网络参数，优化的目标是使得Q增大
             curr_pol_out = self.agents[i].actor.forward(s0[i])
@@ -219,9 +220,9 @@ class MADDPGAgent(MAAgentMixin, SaveNetworkMixin, Agent):
             #                         'pol_loss': actor_loss},
             #                        self.total_steps_in_train)
 
-            soft_update(self.agents[i].target_actor, self.agents[i].actor, self.tau)
-            soft_update(self.agents[i].target_critic, self.agents[i].critic, self.tau)
 
+        # 所有智能体更新完成后一起软更新目标网络
+        soft_update_all(target_pairs(self.agents), self.tau)
         return (total_critic_loss, total_actor_loss)
 
 
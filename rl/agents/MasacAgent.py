@@ -77,7 +77,6 @@ class DDPGAgent:
         return action
 
 class MASACAgent(MAAgentMixin, SaveNetworkMixin, Agent):
-    loss_recoder = []
 
     def __init__(self, env: Env = None,
                  capacity=2e6,
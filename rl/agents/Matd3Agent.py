@@ -11,7 +11,8 @@ from gym.spaces import Discrete
 from rl.agents.Agent import Agent
 from rl.utils.miscellaneous import CUDA_DEVICE_ID
 from rl.utils.networks.maddpg_network import MLPNetworkActor, DoubleQNetworkCritic
-from rl.utils.updates import soft_update, hard_update
+from rl.utils.updates import soft_update_all, hard_update, target_pairs
+from rl.utils.data_parallel import double_q_critic_loss
 from rl.utils.classes import SaveNetworkMixin, Noise, Experience, MAAgentMixin, PedsMoveInfoDataHandler
 from rl.utils.functions import back_specified_dimension, onehot_from_logits, gumbel_softmax, flatten_data, \
     onehot_from_int, save_callback, process_maddpg_experience_data, loss_callback, info_callback
@@ -71,7 +72,7 @@ class DDPGAgent:
         return action
 
 class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
-    loss_recoder = []
+    critic_loss_fn = staticmethod(double_q_critic_loss)
 
     def __init__(self, env: Env = None,
                  capacity=2e6,
@@ -94,7 +95,10 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
                  demo_experience:Experience=None,
                  batch_size_d = 128,
                  lambda_1 = 0.001,
-                 lambda_2 = 0.0078
+                 lambda_2 = 0.0078,
+
+                 share_parameters=False,
+                 agent_embed_dim=8
                  ):
         '''
         环境的输入有以下几点变化，设此时有N个智能体：
@@ -111,6 +115,8 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
         :param update_frequent:
         :param debug_log_frequent:
         :param gamma:
+        :param share_parameters: 所有智能体是否共用一个以智能体编号嵌入向量为条件的演员与评判家网络
+        :param agent_embed_dim: 参数共享时智能体编号嵌入向量的维数
         '''
         if env is None:
             raise Exception("agent should have an environment!")
@@ -143,14 +149,16 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
         self.device = torch.device('cuda:'+str(CUDA_DEVICE_ID)) if torch.cuda.is_available() else torch.device('cpu')
         self.agents = []
         self.experience = Experience(capacity)
-        for i in range(self.env.agent_count):
-            ag = DDPGAgent(self.state_dims[i], self.action_dims[i],
-                           self.learning_rate, self.discrete, self.device, self.state_dims,
-                           self.action_dims, actor_network, critic_network, self.actor_hidden_dim, self.critic_hidden_dim)
-            self.agents.append(ag)
+        self._init_shared_agents(lambda state_dim, action_dim, state_dims:
+                                 DDPGAgent(state_dim, action_dim, self.learning_rate, self.discrete, self.device,
+                                           state_dims, self.action_dims, actor_network, critic_network,
+                                           self.actor_hidden_dim, self.critic_hidden_dim),
+                                 share_parameters, agent_embed_dim)
 
         self.batch_size_d = batch_size_d
         if demo_experience:
+            if self.shared_agent is not None:
+                raise Exception("参数共享模式暂不支持使用演示经验!")
             if self.batch_size_d > self.batch_size:
                 raise Exception("演示经验批次数大于环境经验批次数!")
             #self.batch_size -= self.batch_size_d #减去演示经验批次数
@@ -174,6 +182,8 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
         :return:
         '''
         # 随机获取记忆里的Transmition
+        if self.shared_agent is not None:
+            return self._learn_shared_from_memory(trans_pieces)
         total_critic_loss = 0.0
         total_loss_actor = 0.0
 
@@ -198,13 +208,7 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
                 target_V = torch.min(target_Q1, target_Q2)
             # 优化两个评判家网络参数，优化的目标是使评判值与r + gamma * Q'(s1,a1)尽量接近
             target_Q = r1[:,i] + self.gamma * target_V * torch.tensor(1 - is_done[:,i]).to(self.device)
-            current_Q1, current_Q2 = self.agents[i].critic.forward(s0_critic_in, a0)  # 此时没有使用detach！
-            critic_loss = MSELoss(current_Q1, target_Q) + MSELoss(current_Q2, target_Q)
-            self.agents[i].critic_optimizer.zero_grad()
-            critic_loss.backward()
-            torch.nn.utils.clip_grad_norm_(self.agents[i].critic.parameters(), 0.5)
-            self.agents[i].critic_optimizer.step()
-            total_critic_loss += critic_loss.item()
+            total_critic_loss += self.update_critic(i, s0_critic_in, a0, target_Q)
 
             # 每隔K轮才对策略网络和目标网络进行一次更新
             if self.train_update_count % self.K == 0:
@@ -250,10 +254,9 @@ class MATD3Agent(MAAgentMixin, SaveNetworkMixin, Agent):
                 self.agents[i].actor_optimizer.step()
                 total_loss_actor += actor_loss.item()
 
-                if not BC:
-                    # 软更新参数
-                    soft_update(self.agents[i].target_actor, self.agents[i].actor, self.tau)
-                    soft_update(self.agents[i].target_critic, self.agents[i].critic, self.tau)
+        if not BC and self.train_update_count % self.K == 0:
+            # 所有智能体更新完成后一起软更新目标网络
+            soft_update_all(target_pairs(self.agents), self.tau)
 
         #为了更新bc,将该过程移到外部执行
         return (total_critic_loss, total_loss_actor)
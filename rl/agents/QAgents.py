@@ -15,16 +15,17 @@ from gym.spaces import Discrete
 
 from rl.agents.Agent import Agent
 from rl.utils.networks.pd_network import NetApproximator
-from rl.utils.functions import get_dict, set_dict, back_specified_dimension, process_experience_data, print_train_string
+from rl.utils.functions import back_specified_dimension, process_experience_data, print_train_string
 from rl.utils.policys import epsilon_greedy_policy, greedy_policy, deep_epsilon_greedy_policy
 from rl.utils.classes import SaveDictMixin, SaveNetworkMixin, Transition, Experience
+from rl.utils.tabular import TabularQ
 from rl.utils.updates import soft_update
 
 class QAgent(Agent,SaveDictMixin):
     def __init__(self,env:Env,capacity:int = 20000):
         super(QAgent, self).__init__(env,capacity)
         self.name = "QAgent"
-        self.Q = {}
+        self.Q = TabularQ.from_spaces(self.obs_space, self.action_space)
 
     def policy(self,A ,s = None,Q = None, epsilon = None):
         return epsilon_greedy_policy(A, s, Q, epsilon)
@@ -46,12 +47,12 @@ class QAgent(Agent,SaveDictMixin):
                 self.env.render()
             #估值部分
             self.policy = greedy_policy
-            a1 = greedy_policy(self.A, s1, self.Q)
-            old_q = get_dict(self.Q,s0,a0)
-            q_prime = get_dict(self.Q, s1, a1) #得到下一个状态，行为的估值
+            a1 = self.Q.greedy(s1)
+            old_q = self.Q.get(s0, a0)
+            q_prime = self.Q.get(s1, a1) #得到下一个状态，行为的估值
             td_target = r1 + gamma * q_prime
             new_q = old_q + alpha * (td_target - old_q)
-            set_dict(self.Q, new_q, s0, a0)
+            self.Q.set(s0, a0, new_q)
 
             s0 = s1
             time_in_episode += 1
@@ -3,14 +3,14 @@ import time
 from gym import Env
 
 from .Agent import Agent
-from rl.utils.functions import get_dict, set_dict
 from rl.utils.policys import epsilon_greedy_policy, greedy_policy
 from rl.utils.classes import SaveDictMixin
+from rl.utils.tabular import TabularQ
 
 class SarsaAgent(Agent, SaveDictMixin):
     def __init__(self,env:Env,capacity:int = 20000):
         super(SarsaAgent, self).__init__(env,capacity)
-        self.Q = {} #增加Q字典存储行为价值
+        self.Q = TabularQ.from_spaces(self.obs_space, self.action_space) #增加Q表存储行为价值
 
     def policy(self,A ,s = None,Q = None, epsilon = None):
         '''
@@ -36,11 +36,11 @@ class SarsaAgent(Agent, SaveDictMixin):
             if display:
                 self.env.render()
             a1 = self.perform_policy(s1,self.Q,epsilon)
-            old_q = get_dict(self.Q,s0,a0)
-            q_prime = get_dict(self.Q,s1,a1)
+            old_q = self.Q.get(s0, a0)
+            q_prime = self.Q.get(s1, a1)
             td_target = r1 + self.gamma * q_prime
             new_q = old_q + self.gamma * (td_target - old_q)
-            set_dict(self.Q,new_q,s0,a0)
+            self.Q.set(s0, a0, new_q)
             s0,a0 = s1,a1
             time_in_episode += 1
             if wait:
@@ -59,7 +59,7 @@ class SarsaAgent(Agent, SaveDictMixin):
 class SarsaLambdaAgent(Agent, SaveDictMixin):
     def __init__(self,env:Env,capacity:int = 20000):
         super(SarsaLambdaAgent, self).__init__(env,capacity)
-        self.Q = {}
+        self.Q = TabularQ.from_spaces(self.obs_space, self.action_space, traces=True) #同时存储效用值
 
     def policy(self,A,s,Q,epsilon):
         return epsilon_greedy_policy(A, s, Q, epsilon)
@@ -72,26 +72,17 @@ class SarsaLambdaAgent(Agent, SaveDictMixin):
         a0 = self.perform_policy(s0,self.Q,epsilon)
         time_in_episode, total_reward = 0,0
         is_done = False
-        E = {} #效用值
+        self.Q.reset_traces() #效用值
         while not is_done:
             s1, r1, is_done, info, total_reward = self.act(a0)
             if display:
                 self.env.render()
             a1 = self.perform_policy(s1,self.Q,epsilon)
-            q = get_dict(self.Q, s0, a0)
-            q_prime = get_dict(self.Q,s1,a1)
+            q = self.Q.get(s0, a0)
+            q_prime = self.Q.get(s1, a1)
             delta = r1 + self.gamma * q_prime - q
-            e = get_dict(E,s0,a0)
-            e += 1
-            set_dict(E,e,s0,a0)
-            for s in self.S: #对所有可能的Q(s,a)进行更新
-                for a in self.A:
-                    e_value = get_dict(E,s,a)
-                    old_q = get_dict(self.Q,s,a)
-                    new_q = old_q + self.alpha * delta * e_value
-                    new_e = self.gamma * self.lambda_ * e_value
-                    set_dict(self.Q,new_q,s,a)
-                    set_dict(E,new_e,s,a)
+            #只对资格迹不为0的Q(s,a)进行更新
+            self.Q.update_traces(s0, a0, self.alpha * delta, self.gamma * self.lambda_)
 
             s0, a0 = s1, a1
             time_in_episode += 1
@@ -29,7 +29,8 @@ def set_spine_visible(ax):
     ax.spines['top'].set_visible(False)
     ax.spines['bottom'].set_visible(False)
 
-info_part = ['collision_agent_agent.npy', 'collision_wall_agent.npy', 'evacuation_time.npy', 'leader_pos.npy']
+info_part = ['collision_agent_agent.npy', 'collision_wall_agent.npy', 'evacuation_time.npy', 'pos_heatmap.npy']
+legacy_heatmap_part = 'leader_pos.npy' #旧版本保存的稠密热力图 [episode数, leader数, W, H]
 
 def load_info_data(dir, part, clip=-1):
     y = defaultdict(list)
@@ -48,6 +49,57 @@ def load_info_data(dir, part, clip=-1):
         data.append(da)
     return np.array(data)
 
+def load_heatmap_data(dir, calc=(0, 200), agent_idx=None, crowd=False):
+    '''
+    按照与load_info_data相同的目录结构读取热力图，逐个episode累加，内存占用与episode数无关
+    :param calc: 统计的episode范围
+    :param agent_idx: 统计的leader下标，为None时统计所有leader
+    :param crowd: 为True时统计所有行人的热力图
+    :return: shape为[标签数,W,H]的数组，为各次实验中calc范围内占据次数之和的平均
+    '''
+    from rl.utils.classes import load_heatmap_episodes
+    y = defaultdict(list)
+    for folder in os.listdir(dir):
+        pa = os.path.join(dir, folder)
+        for label, folder_j in enumerate(os.listdir(pa)):
+            file = os.path.join(pa, folder_j, "extra_data", info_part[3])
+            if not os.path.exists(file):
+                y[label].append(load_legacy_heatmap(os.path.join(pa, folder_j, "extra_data", legacy_heatmap_part),
+                                                    calc, agent_idx, crowd))
+                continue
+            episodes = load_heatmap_episodes(file)
+            map_shape, agent_count, cell_size = next(episodes)
+            if crowd:
+                channels = [agent_count]
+            else:
+                channels = np.arange(agent_count) if agent_idx is None else agent_idx
+            total = np.zeros([map_shape[0] * map_shape[1]])
+            for i, episode in enumerate(episodes):
+                if i < calc[0]:
+                    continue
+                if i >= calc[1]:
+                    break
+                episode = episode[np.isin(episode[:, 0], channels)]
+                total += np.bincount(episode[:, 1], weights=episode[:, 2], minlength=total.shape[0])
+            y[label].append(total.reshape(map_shape))
+    data = []
+    for label, da in y.items():
+        data.append(np.mean(np.array(da), axis=0))
+    return np.array(data)
+
+def load_legacy_heatmap(file, calc=(0, 200), agent_idx=None, crowd=False):
+    '''
+    读取旧版本的leader_pos.npy，返回值与load_heatmap_data中单次实验的结果相同
+    '''
+    if crowd:
+        raise Exception("{}中只有leader的位置，没有所有行人的热力图!".format(file))
+    data = np.load(file, mmap_mode="r")
+    channels = np.arange(data.shape[1]) if agent_idx is None else np.atleast_1d(agent_idx)
+    total = np.zeros(data.shape[2:])
+    for episode in data[calc[0]:calc[1]]:
+        total += np.sum(episode[channels], axis=0)
+    return total
+
 def draw_explore_step_line(dir, calc=(0, 200), smooth_step=1, labels=None, ids=None):
     if labels is None:
         labels = ["GD-MAMBPO", "MAMBPO", "MATD3"]
@@ -89,21 +141,14 @@ def softmax(x, axis=None):
     y = np.exp(x)
     return y / y.sum(axis=axis, keepdims=True)
 
-def draw_heatmap(dir, calc=(0, 200), agent_idx=None, clip = -1, single=False, labels=None, ids=None):
+def draw_heatmap(dir, calc=(0, 200), agent_idx=None, clip = -1, single=False, labels=None, ids=None, crowd=False):
     set_plt_latex_form()
     if labels is None:
         labels = ["GD-MAMBPO", "MATD3"]
     if ids is None:
         ids = range(len(labels))
-    data = load_info_data(dir, info_part[3])
-    #取特定的人员索引
-    agent_count = data.shape[2]
-    if agent_idx == None:
-        agent_idx = np.arange(agent_count)
-
-    data = data[:, calc[0]:calc[1], agent_idx, :, :]
-    data = np.squeeze(np.sum(data, 2, keepdims=True), 2) #将不同智能体所在位置加和
-    data = np.squeeze(np.sum(data, 1, keepdims=True), 1) #将不同episode的数据相加
+    #取特定的人员索引，并将不同智能体与不同episode的数据相加
+    data = load_heatmap_data(dir, calc, agent_idx, crowd)
     data[:, 0, 0] = 0 #去掉默认地点为0的
     if clip != -1:
         data = np.where(data < clip, data, clip)
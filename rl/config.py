@@ -1,4 +1,7 @@
-from rl.utils.networks.maddpg_network import MLPNetworkActor, MLPNetworkCritic, DoubleQNetworkCritic
+from functools import partial
+
+from rl.utils.networks.maddpg_network import MLPNetworkActor, MLPNetworkCritic, DoubleQNetworkCritic, \
+    PermutationInvariantCritic, DoubleQPermutationInvariantCritic
 
 class Config:
     def __init__(self):
@@ -15,8 +18,12 @@ class Config:
         self.critic_network = MLPNetworkCritic
         self.actor_hidden_dim = 64
         self.critic_hidden_dim = 64
+        self.critic_architecture = "auto" #mlp为拼接所有智能体输入的评判家，attention与mean为置换不变、参数数量与智能体数量无关的评判家，auto在参数共享时使用attention，否则使用mlp
         self.n_steps_train = 5
         self.env_name = "training_env"
+        #parameter sharing parameter
+        self.share_parameters = False #为True时所有leader共用一个以智能体编号嵌入向量为条件的演员与评判家网络，不能与use_init_bc同时使用，参数数量只有配合置换不变的评判家时才与leader数量无关
+        self.agent_embed_dim = 8
         #Matd3 Parameters
         self.K = 1
         #Masac Parameters
@@ -30,6 +37,10 @@ class Config:
         self.model_batch_size = 2048
         self.model_train_freq = 1000
         self.n_steps_model = 50
+        self.model_dataset_size = 200000 #动力学模型训练数据集中保留的最近的真实经验数
+        self.model_inference = "sparse" #rollout时动力学模型的预测方式，可选full、sparse与elite_mean
+        self.reduced_precision = False #为True时动力学模型与rollout在CPU上使用bfloat16自动混合精度，经验池中的状态以float16保存
+        self.precision_check_interval = 10 #低精度模式下每隔多少次动力学模型训练与float32比较一次验证集mse，为0时不比较
         self.rollout_length_range = (1, 1)
         self.rollout_epoch_range = (60, 1500)
         self.rollout_batch_size = 256
@@ -48,14 +59,37 @@ class Config:
         self.epsilon_high = 1.0
         self.epsilon_low = 0.01
 
+        #async actor-learner parameter
+        self.n_collectors = 0 #大于0时使用异步的actor-learner训练方式
+        self.sync_interval = 1
+        self.update_ratio = 1.0
+
+        #data parallel critic update parameter
+        self.data_parallel_size = 1 #大于1时评判家网络在多个CPU进程上进行数据并行更新
+
+        #checkpoint parameter
+        self.checkpoint_keep = 0 #大于0时保存完整的训练状态，并保留最近的checkpoint_keep个检查点
+        self.checkpoint_dir = None #默认为log_dir下的checkpoint目录
+        self.resume_dir = "" #不为空时从该目录中最新的检查点继续训练
+
+        #tensorboard metrics parameter
+        self.metrics_flush_interval = 10.0 #指标在内存中累计，每隔若干秒写入一次TensorBoard
+
     def update_parameter(self, alg_type):
         self.rollout_epoch_range = (int(self.max_episode * 0.1), int(self.max_episode * 0.15))
-        if alg_type == "MATD3" or alg_type == "GD_MAMBPO" or alg_type == "MAMBPO":
-            self.actor_network = MLPNetworkActor
-            self.critic_network = DoubleQNetworkCritic
+        double_q = alg_type == "MATD3" or alg_type == "GD_MAMBPO" or alg_type == "MAMBPO"
+        self.actor_network = MLPNetworkActor
+        critic_architecture = self.critic_architecture
+        if critic_architecture == "auto":
+            # 共享的MLP评判家输入仍为所有智能体的拼接，只有置换不变的评判家才能使参数数量与智能体数量无关
+            critic_architecture = "attention" if self.share_parameters else "mlp"
+        if critic_architecture == "mlp":
+            self.critic_network = DoubleQNetworkCritic if double_q else MLPNetworkCritic
+        elif critic_architecture in ("attention", "mean"):
+            self.critic_network = partial(DoubleQPermutationInvariantCritic if double_q else PermutationInvariantCritic,
+                                          aggregation=critic_architecture)
         else:
-            self.actor_network = MLPNetworkActor
-            self.critic_network = MLPNetworkCritic
+            raise Exception("不支持的评判家网络结构{}!".format(critic_architecture))
 
 #从0.1-0.8时刻使用rollout
 class MPEConfig(Config):
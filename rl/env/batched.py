@@ -0,0 +1,420 @@
+import numpy as np
+from gym.spaces import Box, Discrete
+
+
+def _to_indices(actions, n_actions):
+    '''
+    将动作转换为整数编号，支持整数编号[N, ...]与独热编码[N, ..., n_actions]两种形式
+    '''
+    if hasattr(actions, "detach"):
+        actions = actions.detach().cpu().numpy()
+    actions = np.asarray(actions)
+    if actions.ndim > 0 and actions.shape[-1] == n_actions and not np.issubdtype(actions.dtype, np.integer):
+        actions = np.argmax(actions, axis=-1)
+    return actions.astype(int)
+
+
+class BatchedEnv(object):
+    '''
+    同时模拟num_envs个环境实例的批量环境，所有实例的状态保存在以实例为第一维的数组中，
+    step一次以NumPy向量化地推进所有实例，结束的实例会被自动重置：
+    返回的观察为重置后的观察，结束时的观察保存在info["terminal_obs"]中
+    '''
+    agent_count = 1
+
+    def __init__(self, num_envs, max_episode_steps=None, seed=None):
+        '''
+        :param num_envs: 环境实例数
+        :param max_episode_steps: 每个episode的最大步数，为None时只在环境本身结束时重置
+        :param seed: 随机数种子
+        '''
+        self.num_envs = int(num_envs)
+        self.max_episode_steps = max_episode_steps
+        self.np_random = np.random.RandomState(seed)
+        self.episode_steps = np.zeros([self.num_envs], dtype=int)
+
+    def seed(self, seed=None):
+        self.np_random = np.random.RandomState(seed)
+        return [seed]
+
+    def _reset_envs(self, mask):
+        '''
+        重置mask为True的实例
+        '''
+        raise NotImplementedError
+
+    def _step(self, actions):
+        '''
+        推进所有实例一步
+        :return: 奖励与是否结束，多智能体环境的形状为[N, agent_count]，否则为[N]
+        '''
+        raise NotImplementedError
+
+    def get_observation(self):
+        raise NotImplementedError
+
+    def reset(self):
+        self.episode_steps[:] = 0
+        self._reset_envs(np.ones([self.num_envs], dtype=bool))
+        return self.get_observation()
+
+    def step(self, actions):
+        reward, done = self._step(actions)
+        self.episode_steps += 1
+        finished = done if done.ndim == 1 else done.any(axis=1)
+        if self.max_episode_steps is not None:
+            finished = finished | (self.episode_steps >= self.max_episode_steps)
+        obs = self.get_observation()
+        info = {"terminal_obs": obs, "finished": finished}
+        if finished.any():
+            self.episode_steps[finished] = 0
+            self._reset_envs(finished)
+            obs = self.get_observation()
+        return obs, reward, done, info
+
+    def render(self, mode='human'):
+        pass
+
+    def close(self):
+        pass
+
+
+class BatchedGridWorldEnv(BatchedEnv):
+    '''
+    批量的格子世界，格子世界是确定性的，构造时对每个(状态, 动作)调用一次env.step，
+    将其编译为状态转移、奖励与终止的查找表，之后每一步只需要一次数组索引，
+    CliffWalk2等重写了step的子类同样适用
+    '''
+    def __init__(self, env, num_envs, max_episode_steps=None, seed=None):
+        '''
+        :param env: 作为模板的GridWorldEnv实例
+        '''
+        super().__init__(num_envs, max_episode_steps, seed)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        self.name = env.class_name()
+        n_states, n_actions = env.observation_space.n, env.action_space.n
+        self.next_state = np.zeros([n_states, n_actions], dtype=int)
+        self.rewards = np.zeros([n_states, n_actions])
+        self.dones = np.zeros([n_states, n_actions], dtype=bool)
+        for s in range(n_states):
+            for a in range(n_actions):
+                env.state = s
+                s1, r, done, _ = env.step(a)
+                self.next_state[s, a], self.rewards[s, a], self.dones[s, a] = s1, r, done
+        self.start_state = env.reset()
+        self.state = np.full([self.num_envs], self.start_state, dtype=int)
+
+    def class_name(self):
+        return self.name
+
+    def _reset_envs(self, mask):
+        self.state[mask] = self.start_state
+
+    def _step(self, actions):
+        actions = _to_indices(actions, self.action_space.n).reshape(self.num_envs)
+        reward = self.rewards[self.state, actions]
+        done = self.dones[self.state, actions]
+        self.state = self.next_state[self.state, actions]
+        return reward, done
+
+    def get_observation(self):
+        return self.state.copy()
+
+
+class BatchedPuckWorldEnv(BatchedEnv):
+    '''
+    批量的PuckWorld，continuous为False时对应puckworld.PuckWorldEnv(5个离散动作，碰到边界时速度反弹)，
+    为True时对应puckworld_continous.PuckWorldEnv(二维连续加速度，速度被限制在max_speed内)
+    '''
+    l_unit = 1.0
+    max_speed = 0.025
+    accel = 0.002
+    rad = 0.05
+    goal_dis = 0.05
+    update_time = 100
+
+    def __init__(self, num_envs, continuous=False, max_episode_steps=None, seed=None):
+        super().__init__(num_envs, max_episode_steps, seed)
+        self.continuous = continuous
+        low = np.array([0, 0, -self.max_speed, -self.max_speed, 0, 0])
+        high = np.array([self.l_unit, self.l_unit, self.max_speed, self.max_speed, self.l_unit, self.l_unit])
+        self.observation_space = Box(low, high, dtype=np.float32)
+        if continuous:
+            self.action_space = Box(low=-1.0, high=1.0, shape=(2,), dtype=np.float32)
+        else:
+            self.action_space = Discrete(5)
+        # 0,1,2,3,4分别为向左、向右、向上、向下与不动时的加速度方向
+        self.directions = np.array([[-1, 0], [1, 0], [0, 1], [0, -1], [0, 0]], dtype=float)
+        self.state = np.zeros([self.num_envs, 6])
+        self.t = np.zeros([self.num_envs], dtype=int)  # 与原环境相同，时钟在重置时不归零
+
+    def class_name(self):
+        return "PuckWorld"
+
+    def _reset_envs(self, mask):
+        n = int(mask.sum())
+        self.state[mask, 0:2] = self.np_random.uniform(0, self.l_unit, size=[n, 2])
+        self.state[mask, 2:4] = 0
+        self.state[mask, 4:6] = self.np_random.uniform(0, self.l_unit, size=[n, 2])
+
+    def _step(self, actions):
+        if self.continuous:
+            accel = np.asarray(actions, dtype=float).reshape(self.num_envs, 2)
+        else:
+            accel = self.directions[_to_indices(actions, self.action_space.n).reshape(self.num_envs)]
+        pos, vel, target = self.state[:, 0:2], self.state[:, 2:4], self.state[:, 4:6]
+        pos += vel
+        vel *= 0.95
+        vel += self.accel * accel
+        if self.continuous:
+            np.clip(vel, -self.max_speed, self.max_speed, out=vel)
+        out = (pos < self.rad) | (pos > self.l_unit - self.rad)
+        if not self.continuous:
+            vel[out] *= -0.5
+        np.clip(pos, self.rad, self.l_unit - self.rad, out=pos)
+
+        self.t += 1
+        update = self.t % self.update_time == 0
+        if update.any():
+            target[update] = self.np_random.uniform(0, self.l_unit, size=[int(update.sum()), 2])
+
+        dis = np.linalg.norm(pos - target, axis=1)
+        reward = self.goal_dis - dis
+        done = dis <= self.goal_dis
+        return reward, done
+
+    def get_observation(self):
+        return self.state.copy()
+
+
+class BatchedGridAgentsEnv(BatchedEnv):
+    '''
+    两个智能体在格子地图上移动的批量环境的基类，每个实例的occupancy[N, H, W]与原环境的记录方式相同：
+    智能体离开的格子置为0，进入的格子置为1，智能体按编号顺序依次移动，后移动的智能体看到的是先移动的智能体的新位置
+    '''
+    agent_count = 2
+    n_actions = 5
+    # 动作0,1,2,3在(行, 列)上的位移，其余动作不动
+    moves = np.array([[-1, 0], [1, 0], [0, -1], [0, 1], [0, 0]])
+
+    def __init__(self, num_envs, raw_occupancy, start, max_episode_steps=None, seed=None):
+        '''
+        :param raw_occupancy: 初始的占据地图[H, W]
+        :param start: 智能体的初始位置[agent_count, 2]
+        '''
+        super().__init__(num_envs, max_episode_steps, seed)
+        self.raw_occupancy = np.asarray(raw_occupancy, dtype=bool)
+        self.start = np.asarray(start)
+        self.idx = np.arange(self.num_envs)
+        self.pos = np.zeros([self.num_envs, self.agent_count, 2], dtype=int)
+        self.occupancy = np.zeros((self.num_envs,) + self.raw_occupancy.shape, dtype=bool)
+        self.action_space = [Discrete(n=self.n_actions) for _ in range(self.agent_count)]
+
+    def _reset_envs(self, mask):
+        self.occupancy[mask] = self.raw_occupancy
+        self.pos[mask] = self.start
+        for i in range(self.agent_count):
+            self._set(self.pos[:, i], True, mask)
+
+    def _set(self, pos, value, mask=None):
+        idx = self.idx if mask is None else self.idx[mask]
+        pos = pos if mask is None else pos[mask]
+        self.occupancy[idx, pos[:, 0], pos[:, 1]] = value
+
+    def _move_agents(self, actions, movable=None):
+        '''
+        智能体依次尝试移动一格，目标格子被占据时不动
+        :return: 每个智能体是否因为被阻挡而没有移动[N, agent_count]
+        '''
+        blocked = np.zeros([self.num_envs, self.agent_count], dtype=bool)
+        for i in range(self.agent_count):
+            is_move = actions[:, i] < 4
+            if movable is not None:
+                is_move &= movable[:, i]
+            target = self.pos[:, i] + self.moves[np.minimum(actions[:, i], 4)]
+            free = ~self.occupancy[self.idx, target[:, 0], target[:, 1]]
+            move = is_move & free
+            self._set(self.pos[:, i], False, move)
+            self.pos[move, i] = target[move]
+            self._set(self.pos[:, i], True, move)
+            blocked[:, i] = is_move & ~free
+        return blocked
+
+
+class BatchedFindGoalsEnv(BatchedGridAgentsEnv):
+    '''
+    批量的EnvFindGoals，位置为(x, y)，动作0,1,2,3,4分别为向上(y+1)、向下、向左(x-1)、向右与不动，
+    智能体到达目标后回到起点并获得50的奖励，智能体1到达目标时episode结束
+    '''
+    moves = np.array([[0, 1], [0, -1], [-1, 0], [1, 0], [0, 0]])
+    dest = np.array([[8, 2], [1, 2]])
+    colors = np.array([[1, 0, 0], [0, 0, 1]])  # 两个智能体在观察中的颜色
+
+    def __init__(self, num_envs, max_episode_steps=None, seed=None):
+        raw_occupancy = np.ones([10, 4])
+        raw_occupancy[1:9, 2] = 0
+        super().__init__(num_envs, raw_occupancy, [[3, 1], [6, 1]], max_episode_steps, seed)
+        self.observation_space = [Box(low=0, high=1, shape=[3, 3, 3]), Box(low=0, high=1, shape=[3, 3, 3])]
+
+    def class_name(self):
+        return "FindGoal"
+
+    def _step(self, actions):
+        actions = _to_indices(actions, self.n_actions).reshape(self.num_envs, self.agent_count)
+        reward = -1.0 - 3.0 * self._move_agents(actions)
+        for i in range(self.agent_count):
+            arrived = (self.pos[:, i] == self.dest[i]).all(axis=1)
+            self._set(self.pos[:, i], False, arrived)
+            self.pos[arrived, i] = self.start[i]
+            self._set(self.pos[:, i], True, arrived)
+            reward[:, i] += 50.0 * arrived
+        done = np.repeat(reward[:, 0:1] > 0, self.agent_count, axis=1)
+        return reward, done
+
+    def get_observation(self):
+        '''
+        每个智能体3x3的局部观察[N, 2, 3, 3, 3]：第一维从y+1到y-1，第二维从x-1到x+1，
+        空的格子为白色，被占据的格子为黑色，两个智能体所在的格子分别为红色与蓝色
+        '''
+        idx = self.idx[:, None, None]
+        dy, dx = np.meshgrid(np.array([1, 0, -1]), np.array([-1, 0, 1]), indexing="ij")
+        obs = np.zeros([self.num_envs, self.agent_count, 3, 3, 3])
+        for i in range(self.agent_count):
+            x = self.pos[:, i, 0, None, None] + dx
+            y = self.pos[:, i, 1, None, None] + dy
+            obs[:, i] = ~self.occupancy[idx, x, y, None]
+            obs[:, i, 1, 1] = self.colors[i]
+            d = self.pos[:, 1 - i] - self.pos[:, i]
+            near = (np.abs(d) <= 1).all(axis=1) & (d != 0).any(axis=1)
+            obs[near, i, 1 - d[near, 1], 1 + d[near, 0]] = self.colors[1 - i]
+        return obs
+
+    def get_full_obs(self):
+        '''
+        与EnvFindGoals.get_full_obs相同的全局观察[N, 4, 10, 3]，供Critic使用
+        '''
+        obs = np.ones([self.num_envs, 4, 10, 3])
+        obs[self.occupancy[:, :, ::-1].transpose(0, 2, 1)] = 0
+        for i in range(self.agent_count):
+            obs[self.idx, 3 - self.pos[:, i, 1], self.pos[:, i, 0]] = self.colors[i]
+        return obs
+
+
+class BatchedFindTreasureEnv(BatchedGridAgentsEnv):
+    '''
+    批量的EnvFindTreasure，位置为(行, 列)，地图中间的一行墙上有一扇暗门，有智能体站在机关上时暗门打开，
+    撞墙的惩罚为0.1，没有智能体在机关上时原地等待的惩罚为0.05，找到宝藏时获得200的奖励并结束
+    '''
+    def __init__(self, num_envs, map_size=7, max_episode_steps=None, seed=None):
+        self.map_size = max(map_size, 7)
+        self.half_pos = int((self.map_size - 1) / 2)
+        raw_occupancy = np.zeros([self.map_size, self.map_size])
+        raw_occupancy[[0, -1, self.half_pos], :] = 1
+        raw_occupancy[:, [0, -1]] = 1
+        start = [[self.half_pos + 1, 1], [self.map_size - 2, 1]]
+        super().__init__(num_envs, raw_occupancy, start, max_episode_steps, seed)
+        self.door = np.array([self.half_pos - 1, self.half_pos, self.half_pos + 1])
+        self.lever_pos = np.array([self.map_size - 2, self.map_size - 2])
+        self.treasure_pos = np.array([1, self.map_size - 2])
+        self.observation_space = [Box(low=0, high=1, shape=[1, 3]), Box(low=0, high=1, shape=[1, 3])]
+
+    def class_name(self):
+        return "FindTreasure"
+
+    def _on_lever(self):
+        return (self.pos == self.lever_pos).all(axis=2).any(axis=1)
+
+    def _step(self, actions):
+        actions = _to_indices(actions, self.n_actions).reshape(self.num_envs, self.agent_count)
+        reward = np.zeros([self.num_envs])
+        # 等待的惩罚取决于该智能体行动时两个智能体的位置，因此逐个智能体移动
+        for i in range(self.agent_count):
+            single = np.full_like(actions, 4)
+            single[:, i] = actions[:, i]
+            reward -= 0.1 * self._move_agents(single)[:, i]
+            reward -= 0.05 * ((actions[:, i] >= 4) & ~self._on_lever())
+        self.occupancy[:, self.half_pos, self.door] = ~self._on_lever()[:, None]
+        done = (self.pos == self.treasure_pos).all(axis=2).any(axis=1)
+        reward += 200.0 * done
+        return np.repeat(reward[:, None], self.agent_count, axis=1), np.repeat(done[:, None], self.agent_count, axis=1)
+
+    def get_observation(self):
+        '''
+        与FindTreasureWrapper相同的观察[N, 2, 1, 3]：归一化的位置与到宝藏距离的平方
+        '''
+        obs = np.zeros([self.num_envs, self.agent_count, 1, 3])
+        obs[:, :, 0, 0:2] = self.pos / self.map_size
+        obs[:, :, 0, 2] = ((self.treasure_pos - self.pos) ** 2).sum(axis=2)
+        return obs
+
+
+class BatchedMoveBoxEnv(BatchedGridAgentsEnv):
+    '''
+    批量的EnvMoveBox，位置为(行, 列)，两个智能体分别抓住箱子的两侧后只能一起移动，
+    两者动作相同且箱子前方没有障碍时带着箱子移动一格，箱子到达[6, 7]或[1, 7]时分别获得10或100的奖励并结束
+    '''
+    box_start = np.array([10, 7])
+    goals = np.array([[6, 7], [1, 7]])
+    goal_rewards = np.array([10.0, 100.0])
+
+    def __init__(self, num_envs, max_episode_steps=None, seed=None):
+        raw_occupancy = np.zeros([15, 15])
+        raw_occupancy[[0, 14, 1, 5, 6], :] = 1
+        raw_occupancy[:, [0, 14]] = 1
+        raw_occupancy[1, 6:9] = 0
+        raw_occupancy[5:7, 1:5] = 0
+        raw_occupancy[6, 6:9] = 0
+        raw_occupancy[11:14, 6:9] = 1
+        super().__init__(num_envs, raw_occupancy, [[13, 1], [13, 13]], max_episode_steps, seed)
+        self.box = np.zeros([self.num_envs, 2], dtype=int)
+        self.catch = np.zeros([self.num_envs, self.agent_count], dtype=bool)
+        self.observation_space = [Box(low=0, high=1, shape=[1, 3]), Box(low=0, high=1, shape=[1, 3])]
+
+    def class_name(self):
+        return "MoveBox"
+
+    def _reset_envs(self, mask):
+        super()._reset_envs(mask)
+        self.box[mask] = self.box_start
+        self._set(self.box, True, mask)
+        self.catch[mask] = False
+
+    def _step(self, actions):
+        actions = _to_indices(actions, self.n_actions).reshape(self.num_envs, self.agent_count)
+        self._move_agents(actions, movable=~self.catch)
+
+        # 两个智能体都抓住箱子且动作相同时一起移动：上下移动时箱子与两侧智能体前方的三个格子都需要为空，
+        # 左右移动时只需要移动方向上的智能体前方的格子为空
+        together = self.catch.all(axis=1) & (actions[:, 0] == actions[:, 1]) & (actions[:, 0] < 4)
+        if together.any():
+            move = self.moves[np.minimum(actions[:, 0], 4)]
+            front = self.box + move
+            vertical = move[:, 0] != 0
+            free = ~self.occupancy[self.idx, front[:, 0], front[:, 1] + move[:, 1]]
+            free &= ~vertical | (~self.occupancy[self.idx, front[:, 0], front[:, 1] - 1] &
+                                 ~self.occupancy[self.idx, front[:, 0], front[:, 1]] &
+                                 ~self.occupancy[self.idx, front[:, 0], front[:, 1] + 1])
+            push = together & free
+            for entity in (self.box, self.pos[:, 0], self.pos[:, 1]):
+                self._set(entity, False, push)
+                entity[push] += move[push]
+            for entity in (self.box, self.pos[:, 0], self.pos[:, 1]):
+                self._set(entity, True, push)
+
+        self.catch |= (self.pos[:, :, 0] == self.box[:, None, 0]) & (np.abs(self.pos[:, :, 1] - self.box[:, None, 1]) == 1)
+
+        at_goal = (self.box[:, None] == self.goals).all(axis=2)
+        done = at_goal.any(axis=1)
+        reward = np.where(done, (at_goal * self.goal_rewards).sum(axis=1), -1.0)
+        return np.repeat(reward[:, None], self.agent_count, axis=1), np.repeat(done[:, None], self.agent_count, axis=1)
+
+    def get_observation(self):
+        '''
+        与MoveBoxWrapper相同的观察[N, 2, 1, 3]：归一化的自身位置，智能体1附加箱子的行，智能体2附加箱子的列
+        '''
+        obs = np.zeros([self.num_envs, self.agent_count, 1, 3])
+        obs[:, :, 0, 0:2] = self.pos / 15
+        obs[:, 0, 0, 2] = self.box[:, 0] / 15
+        obs[:, 1, 0, 2] = self.box[:, 1] / 15
+        return obs
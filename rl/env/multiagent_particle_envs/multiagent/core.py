@@ -97,6 +97,14 @@ class World(object):
         # contact response parameters
         self.contact_force = 1e+2
         self.contact_margin = 1e-3
+        # batched physical state of all entities, rebuilt from the entities at every step
+        self.p_pos = None
+        self.p_vel = None
+        self.size = None
+        self.mass = None
+        self.movable = None
+        self.collide = None
+        self.max_speed = None
 
     # return all entities in the world
     @property
@@ -119,18 +127,40 @@ class World(object):
         for agent in self.scripted_agents:
             # agent.action = agent.action_callback(agent, self)
             agent.action.u = agent.action_callback(agent, self)  # NOTE: need this in the apply_action_force() function
+        entities = self.entities
+        self.gather_state(entities)
         # gather forces applied to entities
-        p_force = [None] * len(self.entities)
+        p_force = np.zeros_like(self.p_pos)
         # apply agent physical controls
         p_force = self.apply_action_force(p_force)
         # apply environment forces
         p_force = self.apply_environment_force(p_force)
         # integrate physical state
         self.integrate_state(p_force)
+        self.scatter_state(entities)
         # update agent state
         for agent in self.agents:
             self.update_agent_state(agent)
 
+    # stack the state and properties of all entities into arrays
+    # (scenarios may replace entity states or add entities between steps)
+    def gather_state(self, entities):
+        self.p_pos = np.array([entity.state.p_pos for entity in entities], dtype=float).reshape([-1, self.dim_p])
+        self.p_vel = np.array([entity.state.p_vel if entity.state.p_vel is not None else np.zeros(self.dim_p)
+                               for entity in entities], dtype=float).reshape([-1, self.dim_p])
+        self.size = np.array([entity.size for entity in entities], dtype=float)
+        self.mass = np.array([entity.mass for entity in entities], dtype=float)
+        self.movable = np.array([entity.movable for entity in entities], dtype=bool)
+        self.collide = np.array([entity.collide for entity in entities], dtype=bool)
+        self.max_speed = np.array([entity.max_speed if entity.max_speed is not None else np.inf
+                                   for entity in entities], dtype=float)
+
+    # give every entity a view of its row in the batched state
+    def scatter_state(self, entities):
+        for i, entity in enumerate(entities):
+            entity.state.p_pos = self.p_pos[i]
+            entity.state.p_vel = self.p_vel[i]
+
     # gather agent action forces
     def apply_action_force(self, p_force):
         # set applied forces
@@ -142,32 +172,31 @@ class World(object):
 
     # gather physical forces acting on entities
     def apply_environment_force(self, p_force):
-        # simple (but inefficient) collision response
-        for a,entity_a in enumerate(self.entities):
-            for b,entity_b in enumerate(self.entities):
-                if(b <= a): continue
-                [f_a, f_b] = self.get_collision_force(entity_a, entity_b)
-                if(f_a is not None):
-                    if(p_force[a] is None): p_force[a] = 0.0
-                    p_force[a] = f_a + p_force[a] 
-                if(f_b is not None):
-                    if(p_force[b] is None): p_force[b] = 0.0
-                    p_force[b] = f_b + p_force[b]        
+        # contact forces between all pairs of entities at once, same as get_collision_force for each pair
+        delta_pos = self.p_pos[:, None, :] - self.p_pos[None, :, :]
+        dist = np.sqrt(np.sum(np.square(delta_pos), axis=-1))
+        dist_min = self.size[:, None] + self.size[None, :]
+        k = self.contact_margin
+        penetration = np.logaddexp(0, -(dist - dist_min)/k)*k
+        collide = self.collide[:, None] & self.collide[None, :]
+        np.fill_diagonal(collide, False)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            force = self.contact_force * delta_pos / dist[:, :, None] * penetration[:, :, None]
+        force = np.where(collide[:, :, None], force, 0.0)
+        # force[a, b] is the force of b on a, only movable entities are pushed
+        p_force += np.where(self.movable[:, None], np.sum(force, axis=1), 0.0)
         return p_force
 
     # integrate physical state
     def integrate_state(self, p_force):
-        for i,entity in enumerate(self.entities):
-            if not entity.movable: continue
-            entity.state.p_vel = entity.state.p_vel * (1 - self.damping)
-            if (p_force[i] is not None):
-                entity.state.p_vel += (p_force[i] / entity.mass) * self.dt
-            if entity.max_speed is not None:
-                speed = np.sqrt(np.square(entity.state.p_vel[0]) + np.square(entity.state.p_vel[1]))
-                if speed > entity.max_speed:
-                    entity.state.p_vel = entity.state.p_vel / np.sqrt(np.square(entity.state.p_vel[0]) +
-                                                                  np.square(entity.state.p_vel[1])) * entity.max_speed
-            entity.state.p_pos += entity.state.p_vel * self.dt
+        movable = self.movable[:, None]
+        p_vel = np.where(movable, self.p_vel * (1 - self.damping) + (p_force / self.mass[:, None]) * self.dt,
+                         self.p_vel)
+        speed = np.sqrt(np.sum(np.square(p_vel), axis=1))
+        over = self.movable & (speed > self.max_speed)
+        p_vel[over] = p_vel[over] / speed[over, None] * self.max_speed[over, None]
+        self.p_vel = p_vel
+        self.p_pos = self.p_pos + np.where(movable, p_vel * self.dt, 0.0)
 
     def update_agent_state(self, agent):
         # set communication state (directly for now)
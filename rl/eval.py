@@ -8,18 +8,39 @@ sys.path.append(os.path.join(curPath, './rl/env/multiagent_particle_envs'))
 import ped_env.envs as my_env
 
 from ped_env.utils.maps import *
+from ped_env.utils.recorder import TrajectoryRecorder
 from rl.agents.Matd3Agent import MATD3Agent
 from rl.config import PedsMoveConfig, Config, DebugConfig
 from rl.env.mpe import SimpleSpread_v3
 from rl.run import test1, test2
+from rl.utils.export import export_policy
 
 def eval(useEnv,fileName,episode=5, AgentType=MATD3Agent,
-          config:Config=None, rep_action_num:int=1):
+          config:Config=None, rep_action_num:int=1, display:bool=True, record_dir:str=None):
+    '''
+    :param record_dir: 不为None时将每个episode的行人轨迹记录到该目录下，可在无显示的节点上使用
+        display=False进行评估，之后用ped_env/utils/viewer.py中的PedsMoveReplayViewer回放
+    '''
     env = useEnv
+    if record_dir is not None:
+        if not os.path.exists(record_dir):
+            os.makedirs(record_dir)
+        env.set_recorder(TrajectoryRecorder(os.path.join(record_dir, fileName + ".trj")))
     agent = AgentType(env,actor_network=config.actor_network, critic_network=config.critic_network,
                         actor_hidden_dim=config.actor_hidden_dim, critic_hidden_dim=config.critic_hidden_dim, log_dir=None)
-    agent.play(os.path.join("../data/models/",fileName,"model"), episode=episode,
-               waitSecond=0.05, rep_action_num=rep_action_num, press=True)
+    agent.play(os.path.join("../data/models/",fileName,"model"), episode=episode, display=display, wait=display,
+               waitSecond=0.05, rep_action_num=rep_action_num, press=display)
+
+def export(useEnv, fileName, exportFile, AgentType=MATD3Agent, config:Config=None):
+    '''
+    加载训练好的演员网络并导出为TorchScript策略包，之后可以用rl/utils/policy_runner.py在不导入训练代码的情况下评估
+    '''
+    agent = AgentType(useEnv, actor_network=config.actor_network, critic_network=config.critic_network,
+                      actor_hidden_dim=config.actor_hidden_dim, critic_hidden_dim=config.critic_hidden_dim, log_dir=None)
+    savePath = os.path.join("../data/models/", fileName, "model")
+    for i in range(useEnv.agent_count):
+        agent.load(os.path.join(savePath, "Actor{}.pkl".format(i)), agent.agents[i].actor)
+    return export_policy(agent, exportFile)
 
 def testEnv():
     env = SimpleSpread_v3()
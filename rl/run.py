@@ -1,7 +1,10 @@
+import json
 import multiprocessing
 import os
+import random
 import sys
 
+import numpy as np
 import torch
 
 curPath = os.path.abspath("../" + os.path.curdir)
@@ -12,15 +15,23 @@ sys.path.append(os.path.join(curPath, './rl/env/multiagent_particle_envs'))
 import ped_env.envs as my_env
 import argparse
 
-from multiprocessing import Process
 from ped_env.utils.maps import *
 from rl.utils.planners import load_offline_train
 from rl.agents.Matd3Agent import MATD3Agent
 from rl.agents.MAMBPOAgent import MAMBPOAgent
 from rl.utils.miscellaneous import save_experiment_data, save_parameter_setting
+from rl.utils.scheduler import ExperimentScheduler
 
 from rl.config import *
 
+def setup_training(agent, config:Config):
+    agent.writer.flush_interval = config.metrics_flush_interval
+    if config.resume_dir != "":
+        agent.resume_from_checkpoint(config.resume_dir, max(config.checkpoint_keep, 1))
+    elif config.checkpoint_keep > 0:
+        agent.enable_checkpoint(config.checkpoint_keep, config.checkpoint_dir)
+    agent.enable_data_parallel(config.data_parallel_size)
+
 def test1(useEnv, envName, config:Config, lock=None):
     alg_name = "MATD3"
     config.update_parameter(alg_name)
@@ -37,19 +48,35 @@ def test1(useEnv, envName, config:Config, lock=None):
                        critic_network=config.critic_network,actor_hidden_dim=config.actor_hidden_dim,
                        critic_hidden_dim=config.critic_hidden_dim,n_steps_train=config.n_steps_train,
                        env_name=envName,demo_experience=d_exp,batch_size_d=config.batch_size_d,
-                       lambda_1=config.lambda1, lambda_2=config.lambda2)
+                       lambda_1=config.lambda1, lambda_2=config.lambda2,
+                       share_parameters=config.share_parameters, agent_embed_dim=config.agent_embed_dim)
     save_parameter_setting(agent.log_dir,alg_name,config)
-    data = agent.learning(
+    setup_training(agent, config)
+    if config.n_collectors > 0:
+        data = agent.async_learning(
+                  n_collectors=config.n_collectors,
+                  sync_interval=config.sync_interval,
+                  update_ratio=config.update_ratio,
+                  decaying_epsilon=config.decaying_epsilon,
+                  epsilon_high=config.epsilon_high,
+                  epsilon_low=config.epsilon_low,
+                  max_episode_num=config.max_episode,
+                  explore_episodes_percent=0.8,
+                 )
+    else:
+        data = agent.learning(
                   decaying_epsilon=config.decaying_epsilon,
                   epsilon_high=config.epsilon_high,
                   epsilon_low=config.epsilon_low,
                   max_episode_num=config.max_episode,
                   explore_episodes_percent=0.8,
                  )
+    agent.disable_data_parallel()
     for i in range(agent.env.agent_count):
         agent.save(agent.log_dir,"Actor{}".format(i),agent.agents[i].actor, config.max_episode)
     save_experiment_data(data, 2, 1, step_index=0, title="{}Agent performance on {}".format(alg_name, envName),
                          x_name="episodes", y_name="rewards of episode", save_dir=agent.log_dir, saveName=alg_name)
+    return agent.log_dir
 
 def test2(useEnv, envName, config:Config, debug=False, lock=None):
     alg_name = "GD_MAMBPO" if config.use_init_bc else "MAMBPO"
@@ -71,12 +98,21 @@ def test2(useEnv, envName, config:Config, debug=False, lock=None):
                         env_name=envName, init_train_steps=config.init_train_steps,
                         network_size=config.network_size, elite_size=config.elite_size, use_decay=config.use_decay,
                         model_batch_size=config.model_batch_size, model_train_freq=config.model_train_freq, n_steps_model=config.n_steps_model,
+                        model_dataset_size=config.model_dataset_size, model_inference=config.model_inference,
                         rollout_length_range=config.rollout_length_range, rollout_epoch_range=config.rollout_epoch_range,
                         rollout_batch_size=config.rollout_batch_size, real_ratio=config.real_ratio,
                         model_retain_epochs=config.model_retain_epochs, demo_experience=d_exp, batch_size_d=config.batch_size_d,
-                        lambda_1=config.lambda1, lambda_2=config.lambda2)
+                        lambda_1=config.lambda1, lambda_2=config.lambda2,
+                        share_parameters=config.share_parameters, agent_embed_dim=config.agent_embed_dim,
+                        reduced_precision=config.reduced_precision,
+                        precision_check_interval=config.precision_check_interval)
     save_parameter_setting(agent.log_dir,alg_name,config)
-    data = agent.learning(
+    setup_training(agent, config)
+    if config.n_collectors > 0:
+        data = agent.async_learning(
+                  n_collectors=config.n_collectors,
+                  sync_interval=config.sync_interval,
+                  update_ratio=config.update_ratio,
                   decaying_epsilon=config.decaying_epsilon,
                   epsilon_high=config.epsilon_high,
                   epsilon_low=config.epsilon_low,
@@ -85,12 +121,24 @@ def test2(useEnv, envName, config:Config, debug=False, lock=None):
                   init_exp_file="./utils/data/exp/{}/experience.pkl".format(random_data),
                   lock=lock
                  )
+    else:
+        data = agent.learning(
+                  decaying_epsilon=config.decaying_epsilon,
+                  epsilon_high=config.epsilon_high,
+                  epsilon_low=config.epsilon_low,
+                  max_episode_num=config.max_episode,
+                  explore_episodes_percent=0.8,
+                  init_exp_file="./utils/data/exp/{}/experience.pkl".format(random_data),
+                  lock=lock
+                 )
+    agent.disable_data_parallel()
     for i in range(agent.env.agent_count):
         agent.save(agent.log_dir,"Actor{}".format(i),agent.agents[i].actor, config.max_episode)
     save_experiment_data(data, 2, 1, step_index=0, title="{}Agent performance on {}".format(alg_name, envName),
                          x_name="episodes", y_name="rewards of episode", save_dir=agent.log_dir, saveName=alg_name)
+    return agent.log_dir
 
-def run_experiment_once(args, id, lock=None):
+def create_experiment(args):
     env_dict = {
         "map_02": map_02,
         "map_05": map_05,
@@ -105,7 +153,21 @@ def run_experiment_once(args, id, lock=None):
 
     #config = DebugConfig()
 
-    config = PedsMoveConfig(n_rol_threads=args.threads, max_episode=args.train_step, use_decay_epsilon=args.use_decay)
+    config = PedsMoveConfig(n_rol_threads=1 if args.collectors > 0 else args.threads, max_episode=args.train_step,
+                            use_decay_epsilon=args.use_decay)
+    config.n_collectors = args.collectors
+    config.sync_interval = args.sync_interval
+    config.update_ratio = args.update_ratio
+    config.data_parallel_size = args.dp_size
+    config.checkpoint_keep = args.checkpoint_keep
+    config.critic_architecture = args.critic
+    config.reduced_precision = args.reduced_precision
+    config.precision_check_interval = args.precision_check_interval
+    config.resume_dir = args.resume
+    return envName, env, config
+
+def run_experiment_once(args, id, lock=None):
+    envName, env, config = create_experiment(args)
 
     if args.dir != './':
         os.mkdir("./" + args.dir + "/" + str(id))
@@ -131,6 +193,54 @@ def run_experiment_once(args, id, lock=None):
     # config.n_steps_train = 1
     # test1(env, envName, config=config)  # Matd3 1Step No BC(MATD3-1)
 
+def run_sweep_job(job, job_dir, num_threads, lock=None):
+    '''
+    运行扫描中的一个任务，由ExperimentScheduler在独立的进程中调用
+    :param job: 任务参数，缺省的参数使用命令行参数的默认值
+    :return: 写入结果索引的信息
+    '''
+    torch.set_num_threads(num_threads)
+    args = argparse.Namespace(**dict(vars(create_parser().parse_args([])), **job))
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    envName, env, config = create_experiment(args)
+    config.log_dir = job_dir
+    if config.checkpoint_keep > 0: #被中断的任务重新运行时从自己的检查点继续
+        config.checkpoint_dir = os.path.join(job_dir, "checkpoint")
+        if os.path.exists(os.path.join(config.checkpoint_dir, "index.json")):
+            config.resume_dir = config.checkpoint_dir
+    config.use_init_bc = job.get("use_init_bc", False)
+    config.n_steps_train = job.get("n_steps_train", 10)
+    print("任务{}，当前测试环境:{}".format(job["id"], env.terrain.name))
+    if args.algorithm == "MATD3":
+        log_dir = test1(env, envName, config=config, lock=lock)
+    elif args.algorithm == "MAMBPO":
+        log_dir = test2(env, envName, config=config, lock=lock)
+    else:
+        raise Exception("不支持的算法{}!".format(args.algorithm))
+    result = {"log_dir": log_dir}
+    for file in os.listdir(log_dir):
+        if file.startswith("rewards_"):
+            rewards = np.loadtxt(os.path.join(log_dir, file), delimiter=",", ndmin=2).mean(axis=1)
+            last = rewards[-max(len(rewards) // 10, 1):]  # 最后10%的episode的平均奖励
+            result.update({"reward_file": file, "episodes": len(rewards), "final_reward": float(np.mean(last))})
+    return result
+
+def run_sweep(spec, args):
+    '''
+    用有界的进程池运行扫描中的所有任务，命令行参数作为各个任务的缺省参数，中断后以相同的命令重新运行即可继续
+    '''
+    common = {key: value for key, value in vars(args).items() if key not in SCHEDULER_ARGS}
+    common.update(spec.get("common", {}))
+    spec = dict(spec, common=common)
+    # 每个任务占用主进程、环境(或采样)子进程以及数据并行的工作进程
+    procs_per_job = 1 + max(common["threads"], common["collectors"]) + max(common["dp_size"] - 1, 0)
+    scheduler = ExperimentScheduler(run_sweep_job, spec, args.dir, procs_per_job=procs_per_job,
+                                    mem_per_job=args.mem_per_job, max_workers=args.workers,
+                                    retry_failed=args.retry_failed)
+    scheduler.run()
+
 # xvfb-run -a python run.py --dir train_05 --map map_05 --train_step 400  --max_step 250 --threads 2 --p_num=8 --g_size=1
 # xvfb-run -a python run.py --dir train_05 --map map_05 --train_step 400  --max_step 250 --threads 2
 # xvfb-run -a python run.py --dir train_06 --map map_06 --train_step 300  --max_step 250 --threads 2
@@ -140,8 +250,19 @@ def run_experiment_once(args, id, lock=None):
 # xvfb-run -a python run.py --dir train_10 --map map_10 --train_step 400  --max_step 250 --threads 2 --p_num=20 --g_size=1 --count=1
 # xvfb-run -a python run.py --dir train_11 --map map_11 --train_step 400  --max_step 750 --threads 2 --p_num=40 --g_size=5 --count=5
 # xvfb-run -a python run.py --dir train_12 --map map_12 --train_step 600  --max_step 250 --threads 2 --p_num=32 --g_size=4 --count=5
+# xvfb-run -a python run.py --dir train_12 --map map_12 --train_step 600  --max_step 250 --collectors 6 --sync_interval 4 --update_ratio 1.0
+# xvfb-run -a python run.py --dir train_12 --map map_12 --train_step 600  --max_step 250 --threads 2 --dp_size 4
+# xvfb-run -a python run.py --dir train_12 --map map_12 --train_step 600  --max_step 250 --threads 2 --checkpoint_keep 3
 
-if __name__ == '__main__':
+# 扫描配置示例(sweep.json):
+# {"algorithms": ["MATD3", "MAMBPO"], "maps": ["map_10", "map_12"], "p_nums": [16, 32], "g_sizes": [4],
+#  "seeds": [0, 1, 2], "common": {"train_step": 400, "max_step": 250}}
+# xvfb-run -a python run.py --dir sweep_01 --sweep sweep.json --threads 2 --mem_per_job 3
+
+# 只属于调度器的命令行参数，不作为任务参数
+SCHEDULER_ARGS = ("dir", "count", "sweep", "workers", "mem_per_job", "retry_failed")
+
+def create_parser():
     my_parser = argparse.ArgumentParser(description="Run PedsMoveEnv use reinforcement learning algroithms!")
     my_parser.add_argument('--dir', default="01_train", type=str)
     my_parser.add_argument('--map', default="map_11", type=str)
@@ -154,22 +275,34 @@ if __name__ == '__main__':
     my_parser.add_argument('--random_init', default=True, type=bool)
     my_parser.add_argument('--threads', default=2, type=int)
     my_parser.add_argument('--use_decay', default=False, type=bool)
-    args = my_parser.parse_args()
-    os.environ["CUDA_VISIBLE_DEVICES"] = "0,1,2,3"
+    my_parser.add_argument('--collectors', default=0, type=int) #大于0时使用异步的actor-learner训练
+    my_parser.add_argument('--sync_interval', default=1, type=int)
+    my_parser.add_argument('--update_ratio', default=1.0, type=float)
+    my_parser.add_argument('--dp_size', default=1, type=int) #大于1时评判家网络在多个CPU进程上进行数据并行更新
+    my_parser.add_argument('--seed', default=0, type=int)
+    my_parser.add_argument('--critic', default="auto", type=str) #评判家网络结构，attention与mean的参数数量与智能体数量无关，auto在参数共享时使用attention
+    my_parser.add_argument('--reduced_precision', default=False, type=bool) #MAMBPO的动力学模型使用bfloat16，经验池状态使用float16
+    my_parser.add_argument('--precision_check_interval', default=10, type=int) #低精度模式下精度检查的间隔(动力学模型训练次数)，为0时不检查
+    my_parser.add_argument('--checkpoint_keep', default=0, type=int) #大于0时保存完整的训练状态
+    my_parser.add_argument('--resume', default="", type=str) #检查点目录，不为空时从其中最新的检查点继续训练
+    my_parser.add_argument('--sweep', default="", type=str) #扫描配置文件，不为空时使用调度器运行扫描中的所有任务
+    my_parser.add_argument('--workers', default=0, type=int) #同时运行的最大任务数，为0时根据CPU与内存自动确定
+    my_parser.add_argument('--mem_per_job', default=2.0, type=float) #每个任务预计占用的内存(GB)
+    my_parser.add_argument('--retry_failed', default=False, type=bool)
+    return my_parser
 
-    if args.dir != './':
-        os.mkdir("./" + args.dir)
-    if args.count == 1:#采用单线程的形式
-        run_experiment_once(args, "1")
-    else:
-        torch.multiprocessing.set_start_method("spawn")
-        lock = multiprocessing.Lock()
-        sub_processes = []
-        for i in range(args.count):
-            p = Process(target=run_experiment_once, args=(args, i, lock))
-            p.start()
-            sub_processes.append(p)
-        for p in sub_processes:
-            p.join()
-        print("主进程结束!")
+if __name__ == '__main__':
+    args = create_parser().parse_args()
+    os.environ["CUDA_VISIBLE_DEVICES"] = "" if args.dp_size > 1 else "0,1,2,3" # 数据并行只支持CPU
 
+    if args.sweep != "":
+        with open(args.sweep) as f:
+            spec = json.load(f)
+        run_sweep(spec, args)
+    elif args.count == 1:#采用单线程的形式
+        if args.dir != './':
+            os.mkdir("./" + args.dir)
+        run_experiment_once(args, "1")
+    else:#重复实验交给调度器，避免同时启动count*threads个进程
+        run_sweep({"algorithms": ["MAMBPO", "MATD3"], "seeds": list(range(args.count))}, args)
+    print("主进程结束!")
@@ -0,0 +1,273 @@
+import copy
+import inspect
+import json
+import os
+import pickle
+import queue
+import random
+import threading
+
+import numpy as np
+import torch
+from torch import nn
+
+from rl.utils.classes import Experience, Transition
+
+CHECKPOINT_FORMAT = "ckpt_{:07d}.pt"
+INDEX_FILE = "index.json"
+REPLAY_DIR = "replay"
+
+# 需要保存的训练计数器与训练历史，不存在的属性会被跳过
+CHECKPOINT_COUNTERS = ("total_steps_in_train", "total_episodes_in_train", "total_trans_in_train",
+                       "train_update_count", "model_trained", "rollout_length", "loss_recoder",
+                       "total_times", "episode_rewards", "num_episodes", "model_train_count")
+
+
+def clone_to_cpu(obj):
+    '''
+    将state_dict等嵌套结构中的张量拷贝到CPU上，使其不再受后续训练的影响
+    '''
+    if torch.is_tensor(obj):
+        return obj.detach().cpu().clone()
+    if isinstance(obj, dict):
+        return {key: clone_to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(clone_to_cpu(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+def get_rng_state():
+    state = {"random": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def torch_load_checkpoint(file):
+    '''
+    检查点中除了张量之外还有计数器、LossHistory与随机数状态等python对象，
+    新版本的torch.load默认weights_only=True无法加载，需要显式关闭
+    '''
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        return torch.load(file, map_location="cpu", weights_only=False)
+    return torch.load(file, map_location="cpu")
+
+
+def torch_save_atomic(obj, file):
+    tmp = file + ".tmp"
+    torch.save(obj, tmp)
+    os.replace(tmp, file)
+
+
+class CheckpointManager:
+    '''
+    保存完整的训练状态(网络、优化器、随机数状态、计数器、经验池与动力学模型)，使训练中断后可以继续。
+    训练线程中只拷贝一次状态，序列化与写入都在后台线程中进行，每个文件先写入临时文件再重命名；
+    经验池只以追加的方式写入上次保存后新加入的经验，只保留最近keep_last个检查点
+    '''
+    def __init__(self, checkpoint_dir, keep_last=3, buffers=("experience",)):
+        '''
+        :param checkpoint_dir: 检查点的保存目录
+        :param keep_last: 保留的检查点个数
+        :param buffers: 需要保存的经验池属性名，模型生成的经验可以由动力学模型重新生成，默认不保存
+        '''
+        self.checkpoint_dir = checkpoint_dir
+        self.replay_dir = os.path.join(checkpoint_dir, REPLAY_DIR)
+        self.keep_last = max(int(keep_last), 1)
+        self.buffers = buffers
+        os.makedirs(self.replay_dir, exist_ok=True)
+        self.index = self._load_index()
+        # 每个经验池当前所需的经验片段[(文件名, 经验数)]以及已经保存的经验总数
+        self.replay_segments = {}
+        self.replay_saved = {}
+
+        self.queue = queue.Queue()
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def _load_index(self):
+        file = os.path.join(self.checkpoint_dir, INDEX_FILE)
+        if not os.path.exists(file):
+            return {"checkpoints": []}
+        with open(file) as f:
+            return json.load(f)
+
+    def latest(self):
+        if len(self.index["checkpoints"]) == 0:
+            return None
+        return self.index["checkpoints"][-1]
+
+    def _snapshot_replay(self, name, buffer: Experience):
+        '''
+        取出上次保存后新加入的经验作为一个新的片段，并去掉已经被完全覆盖的旧片段
+        '''
+        push_count = buffer.push_count
+        saved = self.replay_saved.get(name)
+        segments = self.replay_segments.get(name, [])
+        if saved is None or push_count - saved >= buffer.total_trans:
+            new, segments = buffer.total_trans, []  # 首次保存或经验池已经被完全覆盖时写入全部经验
+        else:
+            new = push_count - saved
+        items = buffer.recent(new)
+        if len(items) > 0:
+            segments = segments + [("{}_{:012d}.pkl".format(name, push_count), len(items))]
+        while len(segments) > 1 and sum(n for _, n in segments[1:]) >= buffer.total_trans:
+            segments = segments[1:]
+        self.replay_segments[name] = segments
+        self.replay_saved[name] = push_count
+        meta = {"capacity": buffer.capacity, "push_count": push_count, "segments": segments}
+        return meta, (segments[-1][0], items) if len(items) > 0 else None
+
+    def snapshot(self, agent):
+        '''
+        在训练线程中拷贝agent的完整状态
+        '''
+        networks, saved = [], set()
+        for ag in agent.agents:
+            ag_networks = {}
+            for name, value in vars(ag).items():
+                if not isinstance(value, (nn.Module, torch.optim.Optimizer)):
+                    continue
+                # 参数共享模式下各个智能体的网络是同一个共享网络的视图，优化器也是同一个，只保存一次
+                key = id(getattr(value, "shared", value))
+                if key not in saved:
+                    saved.add(key)
+                    ag_networks[name] = clone_to_cpu(value.state_dict())
+            networks.append(ag_networks)
+        state = {
+            "networks": networks,
+            "counters": {name: copy.deepcopy(getattr(agent, name)) for name in CHECKPOINT_COUNTERS
+                         if hasattr(agent, name)},
+            "rng": get_rng_state(),
+        }
+        if getattr(agent, "model", None) is not None:
+            state["model"] = clone_to_cpu(agent.model.state_dict())
+        if agent.info_handler is not None:
+            state["info_handler"] = copy.deepcopy(agent.info_handler)
+        return state
+
+    def save(self, agent, episode, network_files=()):
+        '''
+        保存检查点，调用后立即返回
+        :param agent: 智能体
+        :param episode: 当前的episode数
+        :param network_files: 需要同时单独保存的网络[(文件路径, 网络)]，兼容只加载演员网络的测试代码
+        '''
+        self._check_error()
+        state = self.snapshot(agent)
+        state["episode"] = episode
+        replay_meta, replay_writes = {}, []
+        for name in self.buffers:
+            buffer = getattr(agent, name, None)
+            if buffer is None:
+                continue
+            replay_meta[name], write = self._snapshot_replay(name, buffer)
+            if write is not None:
+                replay_writes.append(write)
+        networks = [(file, clone_to_cpu(network.state_dict())) for file, network in network_files]
+        entry = {"file": CHECKPOINT_FORMAT.format(episode), "episode": episode, "replay": replay_meta}
+        self.queue.put((state, replay_writes, networks, entry))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, state, replay_writes, networks, entry):
+        for file, network_state in networks:
+            torch_save_atomic(network_state, file)
+        for file, items in replay_writes:
+            file = os.path.join(self.replay_dir, file)
+            with open(file + ".tmp", "wb") as f:
+                pickle.dump([item.data for item in items], f, pickle.HIGHEST_PROTOCOL)
+            os.replace(file + ".tmp", file)
+        torch_save_atomic(state, os.path.join(self.checkpoint_dir, entry["file"]))
+        # 检查点文件写入完成后再更新索引，索引中最后一项即为最新的完整检查点
+        checkpoints = [ckpt for ckpt in self.index["checkpoints"] if ckpt["file"] != entry["file"]] + [entry]
+        removed, checkpoints = checkpoints[:-self.keep_last], checkpoints[-self.keep_last:]
+        self.index = {"checkpoints": checkpoints}
+        index_file = os.path.join(self.checkpoint_dir, INDEX_FILE)
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(index_file + ".tmp", index_file)
+        for ckpt in removed:
+            file = os.path.join(self.checkpoint_dir, ckpt["file"])
+            if os.path.exists(file):
+                os.remove(file)
+        # 删除所有保留的检查点都不再需要的经验片段
+        used = set(file for ckpt in checkpoints for meta in ckpt["replay"].values() for file, _ in meta["segments"])
+        for file in os.listdir(self.replay_dir):
+            if file not in used and not file.endswith(".tmp"):
+                os.remove(os.path.join(self.replay_dir, file))
+
+    def _check_error(self):
+        if self.error is not None:
+            raise Exception("检查点写入失败:{}!".format(self.error))
+
+    def wait(self):
+        '''
+        等待所有已经提交的检查点写入完成
+        '''
+        self.queue.join()
+        self._check_error()
+
+    def close(self):
+        if self.closed:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+        self._check_error()
+
+    def _load_buffer(self, meta, obs_dtype=None):
+        buffer = Experience(meta["capacity"], obs_dtype)
+        for file, _ in meta["segments"]:
+            with open(os.path.join(self.replay_dir, file), "rb") as f:
+                for data in pickle.load(f):
+                    buffer.push(Transition(*data))
+        buffer.push_count = meta["push_count"]
+        return buffer
+
+    def restore(self, agent, entry=None):
+        '''
+        从检查点恢复agent的完整状态
+        :param entry: 检查点索引项，为None时使用最新的检查点
+        :return: 检查点对应的episode数
+        '''
+        entry = self.latest() if entry is None else entry
+        if entry is None:
+            raise Exception("{}中没有可用的检查点!".format(self.checkpoint_dir))
+        state = torch_load_checkpoint(os.path.join(self.checkpoint_dir, entry["file"]))
+        for ag, networks in zip(agent.agents, state["networks"]):
+            for name, network_state in networks.items():
+                getattr(ag, name).load_state_dict(network_state)
+        for name, value in state["counters"].items():
+            setattr(agent, name, value)
+        if "model" in state:
+            agent.model.load_state_dict(state["model"])
+        if "info_handler" in state:
+            agent.info_handler = state["info_handler"]
+        for name, meta in entry["replay"].items():
+            setattr(agent, name, self._load_buffer(meta, getattr(getattr(agent, name, None), "obs_dtype", None)))
+            self.replay_segments[name] = [tuple(segment) for segment in meta["segments"]]
+            self.replay_saved[name] = meta["push_count"]
+        set_rng_state(state["rng"])
+        return state["episode"]
@@ -1,6 +1,8 @@
 import copy
 import os
 import pickle
+import queue
+import shutil
 import time
 
 
@@ -9,12 +11,17 @@ import random
 import numpy as np
 import torch
 from torch import nn
-from multiprocessing import Pipe, Process
+from multiprocessing import Pipe, Process, Queue
+from tqdm import tqdm
 
 import ped_env
-from rl.utils.functions import flatten_data, process_maddpg_experience_data
+from rl.utils.functions import flatten_data, process_maddpg_experience_data, onehot_from_logits, onehot_from_int, \
+    gumbel_softmax
 from rl.utils.model.functions import set_rollout_length, set_model_train_freq
-from rl.utils.updates import hard_update
+from rl.utils.model.model import precision_context
+from rl.utils.networks.maddpg_network import AgentConditionedNetwork, AgentView
+from rl.utils.tabular import TabularQ
+from rl.utils.updates import hard_update, soft_update_all
 
 
 class Transition():
@@ -62,9 +69,15 @@ class Experience():
     该类是用来存储智能体的相关经历的，它由一个列表所组成，
     该类可以通过调用方法来随机返回几个不相关的序列
     '''
-    def __init__(self, capacity: int = 20000):
+    push_count = 0 #累计放入的经验数，用于检查点中增量保存经验
+
+    def __init__(self, capacity: int = 20000, obs_dtype=None):
+        '''
+        :param obs_dtype: 不为None时状态s0与s1以该类型的数组保存(如np.float16)，采样后在转换为张量时恢复为float32
+        '''
         capacity = int(capacity)
         self.capacity = capacity  # 容量：指的是trans总数量
+        self.obs_dtype = obs_dtype
         self.transitions = np.ndarray([self.capacity], dtype=np.object)
         self.next_id = 0  # 下一个episode的Id
         self.total_trans = 0
@@ -72,8 +85,15 @@ class Experience():
     def push(self, trans:Transition):
         if self.capacity <= 0:
             return
+        if self.obs_dtype is not None: #保存转换后的副本，不修改调用者的Transition
+            stored = copy.copy(trans)
+            stored.data = list(trans.data)
+            stored.data[0] = [np.asarray(o, dtype=self.obs_dtype) for o in trans.s0]
+            stored.data[4] = [np.asarray(o, dtype=self.obs_dtype) for o in trans.s1]
+            trans = stored
         self.transitions[self.next_id] = trans
         self.next_id = (self.next_id + 1) % self.capacity #循环队列
+        self.push_count += 1
         if self.total_trans < self.capacity:  #如果超过就丢弃掉最开始的trans
             self.total_trans += 1
         return trans
@@ -111,6 +131,14 @@ class Experience():
         '''
         return random.sample(self.transitions[:self.total_trans].tolist(), batch_size)
 
+    def recent(self, n):
+        '''
+        按照放入顺序返回最近放入的n条经验
+        '''
+        n = min(n, self.total_trans)
+        idx = (self.next_id - n + np.arange(n)) % self.capacity
+        return self.transitions[idx].tolist()
+
     def sample_and_shuffle(self):
         idx = np.random.permutation(self.total_trans)
         return self.transitions[idx]
@@ -137,6 +165,96 @@ class Experience():
     def __len__(self):
         return self.len
 
+class ArrayExperience():
+    '''
+    以数组形式存储经验的经验池，接口与Experience相同，用于模型生成的经验，
+    push_batch可以一次写入一批经验而不需要为每条经验创建Transition对象，
+    数组在第一次写入时根据经验的形状创建，并随着经验数增加逐步扩大到capacity
+    '''
+    push_count = 0
+
+    def __init__(self, capacity: int = 20000, obs_dtype=np.float32):
+        '''
+        :param obs_dtype: 状态s0与s1的存储类型，可以使用np.float16减少内存与带宽
+        '''
+        self.capacity = int(capacity)
+        self.obs_dtype = obs_dtype
+        self.arrays = None
+        self.next_id = 0
+        self.total_trans = 0
+
+    def _reserve(self, size):
+        allocated = 0 if self.arrays is None else len(self.arrays[0])
+        if size <= allocated:
+            return
+        size = min(max(size, allocated * 2), self.capacity)
+        for i, arr in enumerate(self.arrays):
+            new_arr = np.zeros((size,) + arr.shape[1:], dtype=arr.dtype)
+            new_arr[:allocated] = arr[:allocated]
+            self.arrays[i] = new_arr
+
+    def push_batch(self, s0, a0, reward, is_done, s1):
+        '''
+        写入一批经验，各参数的第一维为经验数
+        '''
+        if self.capacity <= 0:
+            return
+        data = [np.asarray(s0, dtype=self.obs_dtype), np.asarray(a0, dtype=np.float32),
+                np.asarray(reward, dtype=np.float32), np.asarray(is_done, dtype=bool), np.asarray(s1, dtype=self.obs_dtype)]
+        n = len(data[0])
+        if n > self.capacity: #只保留最后capacity条经验
+            data = [d[n - self.capacity:] for d in data]
+            self.push_count += n - self.capacity
+            n = self.capacity
+        if self.arrays is None:
+            self.arrays = [np.zeros((0,) + d.shape[1:], dtype=d.dtype) for d in data]
+        self._reserve(min(self.total_trans + n, self.capacity))
+        idx = (self.next_id + np.arange(n)) % self.capacity
+        for arr, d in zip(self.arrays, data):
+            arr[idx] = d
+        self.next_id = (self.next_id + n) % self.capacity
+        self.push_count += n
+        self.total_trans = min(self.total_trans + n, self.capacity)
+
+    def push(self, trans: Transition):
+        self.push_batch(*[np.asarray(d)[None] for d in trans])
+        return trans
+
+    def resize(self, capacity):
+        capacity = int(capacity)
+        if self.capacity == capacity:
+            return
+        if self.capacity < capacity and self.arrays is not None:
+            idx = (self.next_id - self.total_trans + np.arange(self.total_trans)) % self.capacity
+            self.arrays = [arr[idx] for arr in self.arrays] #按照放入顺序重新排列
+            self.next_id = self.total_trans % capacity
+        else: #与Experience相同，缩小容量时清空经验池
+            self.arrays = None
+            self.total_trans = 0
+            self.next_id = 0
+        self.capacity = capacity
+
+    def _transitions(self, idx):
+        return [Transition(*[arr[i] for arr in self.arrays]) for i in idx]
+
+    def sample(self, batch_size=1):
+        return self._transitions(random.sample(range(self.total_trans), batch_size))
+
+    def recent(self, n):
+        n = min(n, self.total_trans)
+        return self._transitions((self.next_id - n + np.arange(n)) % self.capacity)
+
+    @property
+    def len(self):
+        return self.total_trans
+
+    def __str__(self):
+        return "exp info:{0:5} trans, memory usage {1}/{2}". \
+            format(self.len, self.total_trans, self.capacity)
+
+    def __len__(self):
+        return self.len
+
 class Noise():
     '''
     用于连续动作空间的噪声辅助类，输出具有扰动的一系列值
@@ -163,7 +281,14 @@ class SaveNetworkMixin():
             os.mkdir(p)
         save_name = os.path.join("./",sname,"./model/{}.pkl".format(name))
         torch.save(network.state_dict(),save_name)
-        desc_txt_file = open(os.path.join(sname, "desc.txt"),"w+")
+        self.save_desc(sname)
+        return save_name
+
+    def save_desc(self, sname:str):
+        desc_file = os.path.join(sname, "desc.txt")
+        if os.path.exists(desc_file): #训练过程中参数不会改变，只需要写入一次
+            return
+        desc_txt_file = open(desc_file,"w+")
         desc_txt_file.write("algorithm:" + str(self) + "\n")
         desc_txt_file.write("batch_size:" + str(self.batch_size) + "\n")
         desc_txt_file.write("update_freq:" + str(self.update_frequent) + "\n")
@@ -182,25 +307,195 @@ class SaveNetworkMixin():
             desc_txt_file.write("group_size:" + str(a2) + "\n")
             desc_txt_file.write("max_step:" + str(a3) + "\n")
             desc_txt_file.write("map_name:" + str(a4) + "\n")
-        if self.info_handler != None:
-            self.info_handler.save(self.log_dir)
-        return save_name
+        desc_txt_file.close()
 
     def load(self,savePath,network:nn.Module):
         network.load_state_dict(torch.load(savePath))
 
 class SaveDictMixin():
     def save_obj(self,obj, name):
+        if isinstance(obj, TabularQ): #表格型价值函数以.npy格式保存
+            return obj.save(os.path.join("./",name+'.npy'))
         save_name = os.path.join("./",name+'.pkl')
         with open(save_name, 'wb') as f:
             pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
         return save_name
 
     def load_obj(self,savePath):
+        if savePath.endswith(".npy"):
+            return TabularQ.load(savePath)
         with open(savePath , 'rb') as f:
             return pickle.load(f)
 
+def share_agent_parameters(shared, agent_count, embed_dim):
+    '''
+    将一个DDPGAgent的演员与评判家网络改为以智能体编号嵌入向量为条件的共享网络，并返回agent_count个智能体视图，
+    每个视图的actor/critic等网络只是共享网络在该智能体编号上的视图，所有视图使用同一组优化器
+    :param shared: 状态输入维数已经包含embed_dim的DDPGAgent
+    :return: 智能体视图列表
+    '''
+    for name in ("actor", "target_actor", "critic", "target_critic"):
+        setattr(shared, name, AgentConditionedNetwork(getattr(shared, name), agent_count, embed_dim).to(shared.device))
+    hard_update(shared.target_actor, shared.actor)
+    hard_update(shared.target_critic, shared.critic)
+    # 嵌入层的参数需要加入优化器
+    shared.actor_optimizer = type(shared.actor_optimizer)(shared.actor.parameters(), **shared.actor_optimizer.defaults)
+    shared.critic_optimizer = type(shared.critic_optimizer)(shared.critic.parameters(), **shared.critic_optimizer.defaults)
+    shared.state_dim -= embed_dim
+    views = []
+    for i in range(agent_count):
+        view = copy.copy(shared)
+        for name in ("actor", "target_actor", "critic", "target_critic"):
+            setattr(view, name, AgentView(getattr(shared, name), i))
+        view.noise = copy.deepcopy(shared.noise)
+        view.count = [0 for _ in range(shared.action_dim)]
+        views.append(view)
+    return views
+
 class MAAgentMixin():
+    data_parallel = None
+    shared_agent = None #参数共享模式下所有智能体共用的DDPGAgent
+
+    def enable_data_parallel(self, world_size, num_threads=1):
+        '''
+        使用world_size个进程对评判家网络进行数据并行的更新，只支持CPU
+        :param world_size: 参与更新的进程数(包括主进程)，小于2时不启用
+        :param num_threads: 每个工作进程使用的torch线程数
+        '''
+        if world_size < 2 or self.data_parallel is not None:
+            return
+        if self.shared_agent is not None:
+            raise Exception("参数共享模式下不支持评判家网络的数据并行!")
+        from rl.utils.data_parallel import DataParallelCritics
+        self.data_parallel = DataParallelCritics([agent.critic for agent in self.agents],
+                                                 [agent.critic_optimizer for agent in self.agents],
+                                                 self.critic_loss_fn, world_size, num_threads=num_threads)
+
+    def disable_data_parallel(self):
+        if self.data_parallel is None:
+            return
+        self.data_parallel.close()
+        self.data_parallel = None
+
+    def enable_checkpoint(self, keep_last=3, checkpoint_dir=None):
+        '''
+        在save_callback中保存完整的训练状态，而不只是演员与评判家网络
+        :param keep_last: 保留的检查点个数
+        :param checkpoint_dir: 检查点的保存目录，默认为log_dir下的checkpoint目录
+        '''
+        from rl.utils.checkpoint import CheckpointManager
+        checkpoint_dir = os.path.join(self.log_dir, "checkpoint") if checkpoint_dir is None else checkpoint_dir
+        self.checkpointer = CheckpointManager(checkpoint_dir, keep_last)
+
+    def resume_from_checkpoint(self, checkpoint_dir, keep_last=3):
+        '''
+        从checkpoint_dir中最新的检查点恢复训练状态，之后的检查点继续保存在该目录中
+        :return: 检查点对应的episode数
+        '''
+        self.enable_checkpoint(keep_last, checkpoint_dir)
+        episode = self.checkpointer.restore(self)
+        if self.data_parallel is not None: #工作进程中的评判家网络与优化器需要重新复制
+            world_size = self.data_parallel.world_size
+            self.disable_data_parallel()
+            self.enable_data_parallel(world_size)
+        print("从第{}个episode的检查点恢复训练!".format(episode))
+        return episode
+
+    def update_critic(self, i, s, a, target):
+        '''
+        以整个批次更新第i个智能体的评判家网络，启用数据并行时将批次分发到各个进程上计算梯度
+        :return: 该批次上的损失
+        '''
+        if self.data_parallel is not None:
+            return self.data_parallel.update_critic(i, s, a, target)
+        from rl.utils.data_parallel import critic_update_step
+        return critic_update_step(self.agents[i].critic, self.agents[i].critic_optimizer, self.critic_loss_fn,
+                                  s, a, target, 0.5, False).item()
+
+    def _init_shared_agents(self, make_agent, share_parameters, agent_embed_dim):
+        '''
+        创建各个智能体，share_parameters为True时所有智能体共用一个以智能体编号嵌入向量为条件的演员与中心化评判家网络，
+        网络与优化器的数量以及每轮的更新次数与智能体数量无关，要求所有智能体的状态与动作空间相同。
+        MLP评判家的输入仍为所有智能体的拼接，参数数量随智能体数量增长，需要配合置换不变的评判家(Config中critic_architecture为auto、
+        attention或mean)才能使参数数量也与智能体数量无关；每轮更新的样本数为batch * agent_count，计算量仍随智能体数量增长
+        :param make_agent: make_agent(state_dim, action_dim, state_dims)返回一个DDPGAgent
+        '''
+        if not share_parameters:
+            self.agents = [make_agent(self.state_dims[i], self.action_dims[i], self.state_dims)
+                           for i in range(self.env.agent_count)]
+            self._index_critics()
+            return
+        if len(set(self.state_dims)) != 1 or len(set(self.action_dims)) != 1:
+            raise Exception("参数共享模式要求所有智能体的状态与动作空间相同!")
+        self.shared_agent = make_agent(self.state_dims[0] + agent_embed_dim, self.action_dims[0],
+                                       self.state_dims + [agent_embed_dim])
+        self.agents = share_agent_parameters(self.shared_agent, self.env.agent_count, agent_embed_dim)
+
+    def _index_critics(self):
+        '''
+        置换不变的评判家网络需要知道自己评估的是第几个智能体
+        '''
+        for i, agent in enumerate(self.agents):
+            for critic in (agent.critic, agent.target_critic):
+                if getattr(critic, "indexed_agents", False):
+                    critic.agent_index = i
+
+    def _learn_shared_from_memory(self, trans_pieces):
+        '''
+        参数共享模式下从记忆学习，将一批联合经验展开为batch * agent_count个以智能体编号为条件的样本，
+        评判家网络与演员网络各进行一次更新；TD3类的智能体使用双Q目标并每隔K轮更新一次演员网络
+        :return: 与逐个智能体更新时相同尺度(各智能体损失之和)的评判家与演员损失
+        '''
+        n = self.env.agent_count
+        shared = self.shared_agent
+        double_q = hasattr(shared.critic.network, "Q1")
+        s0, a0, r1, is_done, s1, s0_critic_in, s1_critic_in = \
+            process_maddpg_experience_data(trans_pieces, self.state_dims, n, self.device)
+        batch = s0_critic_in.shape[0]
+        # 样本按智能体编号排列：第i * batch到(i + 1) * batch个样本对应第i个智能体
+        agent_idx = torch.arange(n, device=self.device).repeat_interleave(batch)
+        s0_all, s1_all = torch.cat(s0, dim=0), torch.cat(s1, dim=0)
+
+        def joint(actions):
+            # [n * batch, action_dim] -> [batch, n * action_dim]
+            return actions.reshape(n, batch, -1).transpose(0, 1).reshape(batch, -1)
+
+        with torch.no_grad():
+            a1 = shared.target_actor(s1_all, agent_idx=agent_idx)
+            a1 = joint(onehot_from_logits(a1) if self.discrete else a1).repeat(n, 1)
+            target_V = shared.target_critic(s1_critic_in.repeat(n, 1), a1, agent_idx=agent_idx)
+            if double_q:
+                target_V = torch.min(*target_V)
+            not_done = 1 - torch.as_tensor(np.asarray(is_done, dtype=float).T.reshape(-1), dtype=torch.float32,
+                                           device=self.device)
+            target_Q = r1.t().reshape(-1) + self.gamma * target_V * not_done
+        from rl.utils.data_parallel import critic_update_step
+        critic_loss = critic_update_step(AgentView(shared.critic, agent_idx), shared.critic_optimizer, self.critic_loss_fn,
+                                         s0_critic_in.repeat(n, 1), a0.repeat(n, 1), target_Q, 0.5, False).item()
+
+        actor_loss = 0.0
+        if getattr(self, "train_update_count", 0) % getattr(self, "K", 1) == 0:
+            curr_pol_out = shared.actor(s0_all, agent_idx=agent_idx)
+            if self.discrete:
+                own, others = gumbel_softmax(curr_pol_out).to(self.device), onehot_from_logits(curr_pol_out).detach()
+            else:
+                own, others = curr_pol_out, curr_pol_out.detach()
+            # 第i个智能体的样本中只有自身的动作保留梯度，其余智能体的动作与逐个智能体更新时一样视为常量
+            own, others = own.reshape(n, batch, 1, -1), others.reshape(n, batch, -1).transpose(0, 1).unsqueeze(0)
+            mask = torch.eye(n, device=self.device).reshape(n, 1, n, 1)
+            pred_a = (mask * own + (1 - mask) * others).reshape(n * batch, -1)
+            critic = shared.critic.Q1 if double_q else shared.critic
+            loss = -1 * critic(s0_critic_in.repeat(n, 1), pred_a, agent_idx=agent_idx).mean()
+            loss += (curr_pol_out ** 2).mean() * 1e-3
+            shared.actor_optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(shared.actor.parameters(), 0.5)
+            shared.actor_optimizer.step()
+            actor_loss = loss.item()
+
+            soft_update_all([(shared.target_actor, shared.actor), (shared.target_critic, shared.critic)], self.tau)
+        return critic_loss * n, actor_loss * n
+
     def get_exploitation_action(self, state):
         """
         得到给定状态下依据目标演员网络计算出的行为，不探索
@@ -230,6 +525,35 @@ class MAAgentMixin():
         action_list = np.array(action_list,dtype=np.float)
         return action_list
 
+    def get_batch_exploration_action(self, states, epsilon=0.1):
+        '''
+        与get_exploration_action相同，但对一批联合状态只调用一次各个演员网络
+        :param states: numpy数组 [batch, agent_count, state_dim]
+        :return: 动作 numpy数组 [batch, agent_count, action_dim]，离散动作时为One-hot形式；
+            离散动作时同时返回动作编号 [batch, agent_count]，否则为None
+        '''
+        batch = states.shape[0]
+        explore = np.random.rand(batch) < epsilon #与get_exploration_action相同，每个联合状态中所有智能体同时探索
+        actions, action_idx = [], []
+        with torch.no_grad():
+            for i in range(self.env.agent_count):
+                agent = self.agents[i]
+                s = torch.from_numpy(np.ascontiguousarray(states[:, i])).float().to(self.device)
+                out = agent.actor(s.reshape([batch, self.state_dims[i]])).float().cpu().numpy()
+                if self.discrete:
+                    idx = np.where(explore, np.random.randint(0, agent.action_dim, size=batch), np.argmax(out, axis=1))
+                    action_idx.append(idx)
+                    actions.append(np.eye(agent.action_dim)[idx])
+                else:
+                    noise = np.clip(np.random.randn(batch, agent.action_dim) * agent.noise.policy_noise,
+                                    -agent.noise.noise_clip, agent.noise.noise_clip)
+                    actions.append(np.clip(np.where(explore[:, None], noise, out), -1, 1))
+                # 与逐个环境调用agent.step时相同，统计每个环境中所选动作的次数
+                for k, c in enumerate(np.bincount(np.argmax(actions[-1], axis=1), minlength=agent.action_dim)):
+                    agent.count[k] += int(c)
+        actions = np.stack(actions, axis=1)
+        return actions, np.stack(action_idx, axis=1) if self.discrete else None
+
     def play_init(self, savePath, s0):
         import os
         for i in range(self.env.agent_count):
@@ -346,6 +670,125 @@ class MAAgentMixin():
                 agent.count = [0 for _ in range(agent.action_dim)]
         return time_in_episode, total_reward, loss
 
+    def async_learning(self,
+                       n_collectors=2,
+                       sync_interval=1,
+                       update_ratio=1.0,
+                       send_interval=16,
+                       queue_size=64,
+                       epsilon_high=1.0,
+                       epsilon_low=0.01,
+                       p=0.6,
+                       decaying_epsilon=True,
+                       explore_episodes_percent=1.0,
+                       max_episode_num=800,
+                       init_exp_file=None,
+                       lock=None):
+        '''
+        异步的actor-learner训练方式，n_collectors个采样进程持续与环境交互并把经验送入经验池，
+        learner在主进程中不断进行梯度更新，两者不再交替等待，返回值与learning相同
+        :param n_collectors: 采样进程数，使用该模式时n_rol_threads需要为1
+        :param sync_interval: 每隔多少轮更新向采样进程同步一次演员网络，即允许的最大策略滞后
+        :param update_ratio: 每采集update_frequent条经验进行的更新轮数(每轮为n_steps_train次梯度下降)，
+            learner超前时会等待新的经验，为1时与learning的更新频率相同
+        :param send_interval: 采样进程每积累多少条经验发送一次
+        :param queue_size: 经验队列中最多缓存的批次数，learner跟不上时采样进程会阻塞
+        其余参数与learning相同，奖励、损失与回调均以episode为单位，info只记录0号采样进程，
+        从检查点恢复时与learning一样继续之前的训练历史
+        '''
+        if self.n_rol_threads != 1:
+            raise Exception("异步训练模式下n_rol_threads需要为1，采样进程数由n_collectors设置!")
+        self.max_episode_num = max_episode_num
+        resume = self.total_episodes_in_train > 0
+        if not resume:
+            self.total_times, self.episode_rewards, self.num_episodes = [], [], []
+        #从检查点恢复时继续之前的训练历史
+        total_times, num_episodes = self.total_times, self.num_episodes
+        total_time = total_times[-1] if len(total_times) > 0 else 0
+        num_episode = len(num_episodes)
+        max_explore_num = int(max_episode_num * explore_episodes_percent)
+
+        def get_epsilon(i):
+            if decaying_epsilon:
+                return epsilon_low + (epsilon_high - epsilon_low) * np.power(np.e, -4/p*i/max_explore_num) if i < max_explore_num else 0
+            return epsilon_high
+
+        # 必须在环境第一次reset之前复制，否则环境中的Box2D对象无法被序列化
+        env_fn = make_parallel_env(self.env, 1)
+        collectors = AsyncCollectors([env_fn for _ in range(n_collectors)], [agent.actor for agent in self.agents],
+                                     self.discrete, [agent.action_dim for agent in self.agents], send_interval, queue_size)
+        if not resume:
+            self.init_train(init_exp_file, lock) #加载用于初始化的探索经验
+        epsilon = get_epsilon(num_episode)
+        version, last_sync = 0, 0
+        self.policy_init_step()
+        rounds_in_episode, lag_sum, trans_count = 0, 0, 0
+        stop = False
+        pbar = tqdm(total=max_episode_num, initial=num_episode)
+        try:
+            collectors.sync(version, epsilon, [agent.actor for agent in self.agents])
+            while num_episode < max_episode_num and not stop:
+                # learner超前于设定的更新比例时阻塞等待新的经验，否则只取出已经到达的经验
+                allowed_rounds = int(trans_count * update_ratio / self.update_frequent)
+                for worker_id, trans_version, trans, infos, episode in collectors.get(block=version >= allowed_rounds):
+                    for s0, a0, r1, is_done, s1 in trans:
+                        self.experience.push(Transition(s0, a0, r1, is_done, s1))
+                    trans_count += len(trans)
+                    lag_sum += (version - trans_version) * len(trans)
+                    self.total_steps_in_train += len(trans)
+                    if self.info_callback_ != None:
+                        for info in infos:
+                            self.info_callback_(info, self.info_handler)
+                    if episode is None:
+                        continue
+                    episode_reward, time_in_episode, info = episode
+                    if self.info_callback_ != None and worker_id == 0:
+                        self.info_callback_(info, self.info_handler, True)
+                    loss = self.policy_end_step(max(rounds_in_episode, 1))
+                    self.policy_init_step()
+                    rounds_in_episode = 0
+
+                    total_time += time_in_episode
+                    num_episode += 1
+                    self.total_episodes_in_train += 1
+                    total_times.append(total_time)
+                    self.episode_rewards.append(episode_reward)
+                    num_episodes.append(num_episode)
+                    pbar.update(1)
+                    self.writer.add_scalars("agents/reward", {'Agent{}'.format(i): r for i, r in enumerate(episode_reward)},
+                                            self.total_steps_in_train)
+                    self.writer.add_scalar("agents/mean_reward", np.mean(episode_reward), self.total_steps_in_train)
+                    self.writer.add_scalar("async/policy_lag", lag_sum / max(trans_count, 1), self.total_steps_in_train)
+                    self.writer.add_scalar("async/update_ratio", version * self.update_frequent / max(trans_count, 1),
+                                           self.total_steps_in_train)
+                    if self.loss_callback_ and loss:
+                        self.loss_callback_(self, loss)
+                    if self.save_callback_:
+                        self.save_callback_(self, num_episode)
+                    epsilon = get_epsilon(num_episode)
+                    if self.early_stop_callback_ != None and self.early_stop_callback_(self, episode_reward, num_episode):
+                        print("Early stop in {} episode!".format(num_episode))
+                        stop = True
+                        break
+                    if num_episode >= max_episode_num:
+                        break
+
+                if not stop and version < int(trans_count * update_ratio / self.update_frequent):
+                    version += 1
+                    rounds_in_episode += 1
+                    self.policy_update_step(version * self.update_frequent, epsilon)
+                    if version - last_sync >= sync_interval:
+                        collectors.sync(version, epsilon, [agent.actor for agent in self.agents])
+                        last_sync = version
+        finally:
+            pbar.close()
+            collectors.close()
+            if self.checkpointer is not None:
+                self.checkpointer.close()
+        self.env.close()
+        self.writer.close()
+        return total_times, self.episode_rewards, num_episodes
+
 from math import cos, sin
 
 identity = np.array([1, 0])
@@ -357,8 +800,14 @@ for idx, angle in enumerate(range(0, 360, int(360 / 8))):
                    sin(theta), cos(theta)]).reshape([2, 2])
     vec = np.matmul(mat, identity)
     DIRECTIONS.append(vec)
+DIRECTIONS_TABLE = np.stack(DIRECTIONS) #[9, 2]，由离散动作编号直接查表得到方向向量
 
 class ModelBasedMAAgentMixin():
+    model_data_push_count = None #动力学模型数据集已经包含的经验数
+    precision_tolerance = 0.05 #低精度下验证集mse与float32相比的相对差距超过该值时给出警告
+    precision_check_interval = 10 #低精度下每隔多少次动力学模型训练进行一次精度检查，为0时不检查
+    model_train_count = 0 #动力学模型的训练次数
+
     def policy_init_step(self):
         self.loss_critic, self.loss_actor, self.loss_model = 0.0, 0.0, 0.0
 
@@ -427,68 +876,88 @@ class ModelBasedMAAgentMixin():
         return [self.loss_critic, self.loss_actor, self.loss_model]
 
     def transform_discrete_a(self, a0_idx):
-        global DIRECTIONS
-        a0 = np.zeros([a0_idx.shape[0], a0_idx.shape[1] * 2])
-        for i in range(a0_idx.shape[0]):
-            for j in range(a0_idx.shape[1]):
-                a0[i, j * 2:(j + 1) * 2] = DIRECTIONS[a0_idx[i, j]]
+        a0 = DIRECTIONS_TABLE[a0_idx].reshape([a0_idx.shape[0], a0_idx.shape[1] * 2])
         return torch.from_numpy(a0).to(self.device)
 
-    def _learn_simulate_world(self):
-        global DIRECTIONS
-        mean_losses = [0.0 for _ in range(3)]
-        for i in range(self.n_steps_model):
-            trans_pieces = self.experience.sample(self.model_batch_size)
+    def _sync_model_data(self, chunk_size=4096):
+        '''
+        将上次训练后新加入经验池的真实经验转换为张量加入动力学模型的数据集，每条经验只转换一次
+        '''
+        push_count = self.experience.push_count
+        if self.model_data_push_count is None: #首次训练或从检查点恢复后由整个经验池重建数据集
+            self.model.reset_data()
+            new = self.experience.total_trans
+        else:
+            new = push_count - self.model_data_push_count
+        self.model_data_push_count = push_count
+        trans = self.experience.recent(min(new, self.model.dataset_size))
+        for start in range(0, len(trans), chunk_size):
+            trans_pieces = trans[start:start + chunk_size]
             s0, temp_a0, r1, is_done, s1, s0_critic_in, s1_critic_in = \
                 process_maddpg_experience_data(trans_pieces, self.state_dims, self.env.agent_count, self.device)
             if self.discrete:
                 a0_idx = np.argmax(np.array([x.a0 for x in trans_pieces]), axis=2).astype(int)  # 将One-hot形式转换为索引
-                a0 = self.transform_discrete_a(a0_idx)
+                a0 = self.transform_discrete_a(a0_idx).float()
             else:
                 a0 = temp_a0
-            delta_state = s1_critic_in - s0_critic_in
-            # world model输入为(s,a),输出为(s',r,is_done)
-            inputs = torch.cat([s0_critic_in, a0], dim=-1).detach().cpu().numpy()
-            labels = torch.cat([torch.reshape(r1, (r1.shape[0], -1)), delta_state], dim=-1).detach().cpu().numpy()
-            # 输入x = (state,action),y = (r,delta_state)
-            eval_loss, var_loss, mse_loss = self.predict_env.model.train(inputs, labels, batch_size=256, holdout_ratio=0.2)
-
-            mean_losses[0] += eval_loss.mean().item()
-            mean_losses[1] += var_loss
-            mean_losses[2] += mse_loss.mean().item()
-        for i in range(mean_losses.__len__()):
-            mean_losses[i] /= self.n_steps_model
+            # world model输入为(s,a),输出为(r,delta_state)
+            inputs = torch.cat([s0_critic_in, a0], dim=-1)
+            labels = torch.cat([torch.reshape(r1, (r1.shape[0], -1)), s1_critic_in - s0_critic_in], dim=-1)
+            self.model.add_data(inputs, labels)
+
+    def _learn_simulate_world(self):
+        self._sync_model_data()
+        eval_loss, var_loss, mse_loss = self.model.train_incremental(batch_size=256, max_epochs=self.n_steps_model,
+                                                                     epoch_size=self.model_batch_size)
+        mean_losses = [float(eval_loss), var_loss.item(), mse_loss.mean().item()]
         print("model learn finished,eval_loss:{},var_loss:{},mse_loss:{}.".format(mean_losses[0], mean_losses[1], mean_losses[2]))
+        # 精度检查需要在验证集上分别以两种精度前向一次，只在第一次训练以及之后每隔precision_check_interval次训练时进行
+        if self.model.precision != "float32" and self.precision_check_interval > 0 \
+                and self.model_train_count % self.precision_check_interval == 0:
+            self._check_model_precision()
+        self.model_train_count += 1
         return mean_losses
 
+    def _check_model_precision(self):
+        '''
+        低精度模式的准确性检查，记录低精度与float32下验证集的mse
+        '''
+        check = self.model.compare_precision()
+        gap = check.pop("relative_gap")
+        self.writer.add_scalars("step_loss/holdout_mse_precision", check, self.total_steps_in_train)
+        if gap > self.precision_tolerance:
+            print("警告:{}下验证集的mse与float32相差{:.2%}!".format(self.model.precision, gap))
+
     def init_random_step(self, state, step):
         a0 = self.step_in_network(state, True, 1.0)
         return self.act(a0)
 
     def _rollout_model(self, rollout_length, epsilon, use_a_star_policy=False):
+        '''
+        从真实经验中采样rollout_batch_size个初始状态，在动力学模型中以批次的形式同时推演rollout_length步，
+        生成的经验以数组的形式直接写入模型经验池
+        '''
         trans_pieces = self.experience.sample(self.rollout_batch_size)
         s0 = np.array([x.s0 for x in trans_pieces])
         r1 = np.array([x.reward for x in trans_pieces])
-        #is_done = np.array([x.is_done for x in trans_pieces])
         s1 = np.array([x.s1 for x in trans_pieces])
 
+        with precision_context(self.model.precision): #低精度模式下rollout中演员网络的前向运算同样使用bfloat16
+            self._rollout_steps(s0, r1, s1, rollout_length, epsilon, use_a_star_policy)
+
+    def _rollout_steps(self, s0, r1, s1, rollout_length, epsilon, use_a_star_policy):
         state = s0
         for i in range(rollout_length):
             state_in = np.reshape(state, [state.shape[0], state.shape[1] * state.shape[2]]) #打平数组以便输入
             if use_a_star_policy:
-                raw_action = []
-                for s in state:
-                    raw_action.append(self.a_star_policy.step(s))
+                raw_action = np.array([self.a_star_policy.step(s) for s in state])
+                action_idx = np.argmax(raw_action, axis=2) if self.discrete else None
             else:
-                raw_action = []
-                for s in state:
-                    raw_action.append(self.get_exploration_action(s, epsilon))
+                raw_action, action_idx = self.get_batch_exploration_action(state, epsilon)
             if self.discrete:
-                action_idx = np.argmax(np.array(raw_action), axis=2) #将One-hot形式转换为索引
-                action = self.transform_discrete_a(action_idx).cpu().numpy()
+                action = DIRECTIONS_TABLE[action_idx].reshape([state.shape[0], -1])
             else:
-                action = np.array(raw_action).astype(np.float)
-                action = np.reshape(action, [action.shape[0], action.shape[1] * action.shape[2]])
+                action = np.reshape(raw_action, [state.shape[0], -1]).astype(np.float)
             next_states, rewards, terminals, info = self.predict_env.step(state_in, action)
             if i == 0:
                 delta_s1 = abs(s1 - next_states)
@@ -497,23 +966,13 @@ class ModelBasedMAAgentMixin():
                 r_data = {"max":np.max(delta_r),"min":np.min(delta_r),"mean":np.mean(delta_r)}
                 self.writer.add_scalars("step_loss/state", s1_data, self.total_steps_in_train)
                 self.writer.add_scalars("step_loss/reward", r_data, self.total_steps_in_train)
-                # log_string = "s1_delta,max:{}%%%min:{}%%%mean:{},".format(str(np.max(delta_s1)), str(np.min(delta_s1)), str(np.mean(delta_s1))) + \
-                #              "r_delta,max:{}%%%min:{}%%%mean:{},".format(str(np.max(delta_r)), str(np.min(delta_r)), str(np.mean(delta_r))) + \
-                #              "loss_model:{},".format(self.loss_model)
-                # max_delta_s1_idx = np.unravel_index(np.argmax(delta_s1, axis=None), delta_s1.shape)
-                # log_string2 = "max_delta_s1_idx:{}{}".format(max_delta_s1_idx, max_delta_s1_idx[1] % 16)
-                # print("Step:{},{},{}".format(self.total_steps_in_train, log_string, log_string2))
-
-            for j in range(state.shape[0]):
-                tran = Transition(state[j], raw_action[j], rewards[j], terminals[j], next_states[j])
-                if use_a_star_policy:
-                    self.demo_experience.push(tran)
-                else:
-                    self.model_experience.push(tran)
-            nonterm_mask = np.ones([terminals.shape[0]], dtype=np.bool)
-            for idx in range(terminals.shape[0]):
-                if terminals[idx].all(): #这里将any改为all
-                    nonterm_mask[idx] = False
+
+            if use_a_star_policy:
+                for j in range(state.shape[0]):
+                    self.demo_experience.push(Transition(state[j], raw_action[j], rewards[j], terminals[j], next_states[j]))
+            else:
+                self.model_experience.push_batch(state, raw_action, rewards, terminals, next_states)
+            nonterm_mask = ~terminals.all(axis=1) #所有智能体都到达终态时才去掉该状态
             if nonterm_mask.sum() == 0:
                 break
             state = next_states[nonterm_mask] #去掉终止态的状态
@@ -545,6 +1004,10 @@ def worker(remote, parent_remote, env_fn_wrapper):
             env.render()
         elif cmd == 'get_type':
             remote.send(type(env))
+        elif cmd == 'get_state':
+            remote.send(env.get_state())
+        elif cmd == 'set_state':
+            remote.send(env.set_state(data))
         elif cmd == 'get_attr':
             if isinstance(env, ped_env.envs.PedsMoveEnv):
                 remote.send((env.person_num, env.group_size, env.maxStep, env.terrain.name))
@@ -652,34 +1115,203 @@ class SubprocEnv(gym.Env):
     def get_env_attr(self):
         return self.extra_data
 
+    def get_state(self):
+        for remote in self.remotes:
+            remote.send(('get_state', None))
+        return [remote.recv() for remote in self.remotes]
+
+    def set_state(self, states):
+        for remote, state in zip(self.remotes, states):
+            remote.send(('set_state', state))
+        return np.stack([remote.recv() for remote in self.remotes])
+
+def collector_worker(remote, parent_remote, trans_queue, env_fn_wrapper, actors_wrapper, worker_id, send_interval, seed):
+    '''
+    异步训练中的采样进程，使用本地的演员网络副本持续与环境交互，并将经验批量放入trans_queue，
+    每批经验都带有产生它的策略版本号，learner通过'sync'命令下发新的网络参数与epsilon
+    '''
+    parent_remote.close()
+    torch.set_num_threads(1)  # 每个采样进程只占用一个核
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    env = env_fn_wrapper.x()
+    actors, discrete, action_dims = actors_wrapper.x
+    noises = [Noise(1 if discrete else action_dim) for action_dim in action_dims]
+    version, epsilon = -1, 1.0
+    state = env.reset()
+    trans, infos = [], []
+    total_reward = np.zeros([len(actors)])
+    time_in_episode = 0
+    while True:
+        # 处理learner发来的命令，在收到第一份网络参数之前阻塞等待
+        while version < 0 or remote.poll():
+            cmd, data = remote.recv()
+            if cmd == 'sync':
+                version, epsilon, state_dicts = data
+                for actor, state_dict in zip(actors, state_dicts):
+                    actor.load_state_dict(state_dict)
+            elif cmd == 'close':
+                remote.close()
+                env.close()
+                return
+            else:
+                raise NotImplementedError
+        explore = random.random() < epsilon
+        action = []
+        with torch.no_grad():
+            for i, actor in enumerate(actors):
+                if explore and discrete:
+                    a = onehot_from_int(random.randint(0, action_dims[i] - 1), action_dims[i])
+                elif explore and not discrete:
+                    a = torch.Tensor(noises[i].sample()).clamp(-1, 1)
+                elif discrete:
+                    s = torch.from_numpy(np.asarray(state[i], dtype=np.float32).reshape([1, -1]))
+                    a = torch.squeeze(onehot_from_logits(actor(s)))
+                else:
+                    s = torch.from_numpy(np.asarray(state[i], dtype=np.float32).reshape([1, -1]))
+                    a = torch.squeeze(actor(s).clamp(-1, 1))
+                action.append(a.numpy())
+        action = np.array(action, dtype=np.float)
+        s1, r1, is_done, info = env.step(action)
+        trans.append((state, action, r1, is_done, s1))
+        if worker_id == 0:
+            infos.append(info)
+        total_reward += np.array([np.mean(r) for r in r1])
+        time_in_episode += 1
+        episode = None
+        if np.array(is_done).any():
+            episode = (total_reward.tolist(), time_in_episode, info)
+            state = env.reset()
+            total_reward = np.zeros([len(actors)])
+            time_in_episode = 0
+        else:
+            state = s1
+        if len(trans) >= send_interval or episode is not None:
+            trans_queue.put((worker_id, version, trans, infos, episode))
+            trans, infos = [], []
+
+class AsyncCollectors:
+    '''
+    异步采样进程组，每个进程拥有独立的环境与演员网络副本，不再与learner的梯度更新交替进行，
+    经验队列有上限，learner跟不上时采样进程会阻塞，从而限制经验与当前策略之间的差距
+    '''
+    def __init__(self, env_fns, actors, discrete, action_dims, send_interval=16, queue_size=64):
+        '''
+        :param env_fns: 每个采样进程创建环境的函数
+        :param actors: learner中的演员网络，会复制到CPU上发送给各个进程
+        :param discrete: 动作空间是否离散
+        :param action_dims: 每个智能体的动作维数
+        :param send_interval: 采样进程每积累多少条经验发送一次
+        :param queue_size: 经验队列中最多缓存的批次数
+        '''
+        self.closed = False
+        self.queue = Queue(maxsize=queue_size)
+        actors = [copy.deepcopy(actor).cpu() for actor in actors]
+        nworkers = len(env_fns)
+        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nworkers)])
+        self.ps = [Process(target=collector_worker,
+                           args=(work_remote, remote, self.queue, CloudpickleWrapper(env_fn),
+                                 CloudpickleWrapper((actors, discrete, action_dims)), worker_id, send_interval,
+                                 np.random.randint(2 ** 31)))
+                   for worker_id, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns))]
+        for p in self.ps:
+            p.daemon = True
+            p.start()
+        for remote in self.work_remotes:
+            remote.close()
+
+    def sync(self, version, epsilon, actors):
+        state_dicts = [{key: value.detach().cpu() for key, value in actor.state_dict().items()} for actor in actors]
+        for remote in self.remotes:
+            remote.send(('sync', (version, epsilon, state_dicts)))
+
+    def get(self, block=True):
+        '''
+        取出队列中所有已经到达的经验批次，block为True时至少等待一个批次
+        '''
+        items = []
+        while block and len(items) == 0:
+            try:
+                items.append(self.queue.get(timeout=1.0))
+            except queue.Empty:
+                if not all(p.is_alive() for p in self.ps):
+                    raise Exception("采样进程异常退出!")
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def close(self):
+        if self.closed:
+            return
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for p in self.ps:
+            # 采样进程可能阻塞在已满的队列上，需要一边取出数据一边等待其退出
+            while p.is_alive():
+                self.get(block=False)
+                p.join(timeout=0.1)
+        self.closed = True
+
+HEATMAP_FILE = "pos_heatmap.npy"
+
 class PedsMoveInfoDataHandler:
-    def __init__(self, terrain, agent_count, save_l_pos=True):
+    heatmap_file = None #上一次写入的热力图文件
+    heatmap_offset = 0 #该文件中文件头与已经保存的episode所占的字节数，随检查点一起保存
+
+    def __init__(self, terrain, agent_count, save_l_pos=True, cell_size=1.0):
+        '''
+        记录每个episode的疏散时间、碰撞次数与行人位置热力图，
+        热力图包含agent_count个leader各自的占据次数以及所有行人的总占据次数(最后一个通道)
+        :param terrain: 地图
+        :param agent_count: leader的数量
+        :param save_l_pos: 是否记录热力图
+        :param cell_size: 热力图每个格子的边长(米)，小于1时可以得到更精细的热力图
+        '''
         self.info_data = {
             "evacuation_time":[],
             "collision_wall_agent":[],
             "collision_agent_agent":[],
-            "leader_pos":[]
         }
         self.agent_count = agent_count
         self.save_l_pos= save_l_pos
-        self.map_shape = terrain.map.shape
-        self.leader_pos_arr = np.zeros([agent_count, self.map_shape[0], self.map_shape[1]], dtype=np.int)
+        self.cell_size = cell_size
+        self.map_shape = (int(np.ceil(terrain.map.shape[0] / cell_size)), int(np.ceil(terrain.map.shape[1] / cell_size)))
+        self.cell_count = self.map_shape[0] * self.map_shape[1]
+        self.channel_count = agent_count + 1
+        self.pos_arr = np.zeros([self.channel_count * self.cell_count], dtype=np.int32)
+        self.pending_episodes = [] #还未写入磁盘的episode热力图(稀疏形式)
+
+    def _flat_cells(self, pos):
+        idx = np.floor(np.asarray(pos, dtype=np.float32).reshape([-1, 2]) / self.cell_size).astype(np.int64)
+        idx[:, 0] = np.clip(idx[:, 0], 0, self.map_shape[0] - 1)
+        idx[:, 1] = np.clip(idx[:, 1], 0, self.map_shape[1] - 1)
+        return idx[:, 0] * self.map_shape[1] + idx[:, 1]
 
     def step(self, info):
         if not self.save_l_pos:
             return
-        time, c_wa, c_aa, l_pos = info
-        l_pos_idx = np.array(l_pos).astype(int)
-        for i in range(self.leader_pos_arr.shape[0]):
-            self.leader_pos_arr[i, l_pos_idx[i, 0], l_pos_idx[i, 1]] += 1
+        l_pos = info[3]
+        crowd_pos = info[4] if len(info) > 4 else np.zeros([0, 2])
+        leader_idx = self._flat_cells(l_pos) + np.arange(len(l_pos)) * self.cell_count
+        crowd_idx = self._flat_cells(crowd_pos) + self.agent_count * self.cell_count
+        self.pos_arr += np.bincount(np.concatenate([leader_idx, crowd_idx]),
+                                    minlength=self.pos_arr.shape[0]).astype(np.int32)
 
     def reset(self, info):
-        time, c_wa, c_aa, l_pos = info
+        time, c_wa, c_aa = info[0], info[1], info[2]
         self.info_data["evacuation_time"].append(time)
         self.info_data["collision_wall_agent"].append(c_wa)
         self.info_data["collision_agent_agent"].append(c_aa)
-        self.info_data["leader_pos"].append(self.leader_pos_arr)
-        self.leader_pos_arr = np.zeros([self.agent_count, self.map_shape[0], self.map_shape[1]], dtype=np.int)
+        if self.save_l_pos:
+            # 只保存非零的格子，每行为[通道,格子下标,次数]
+            nonzero = np.nonzero(self.pos_arr)[0]
+            self.pending_episodes.append(np.stack([nonzero // self.cell_count, nonzero % self.cell_count,
+                                                   self.pos_arr[nonzero]], axis=1).astype(np.int32))
+            self.pos_arr[:] = 0
 
     def save(self, dir):
         pa = os.path.join(dir, "extra_data")
@@ -690,6 +1322,48 @@ class PedsMoveInfoDataHandler:
             arr = np.array(value, dtype=np.float32)
             np.save(file, arr)
             file.close()
+        # 热力图以追加的方式写入上次保存后新完成的episode，写入后即从内存中释放
+        file_name = os.path.abspath(os.path.join(pa, HEATMAP_FILE))
+        self._prepare_heatmap_file(file_name)
+        with open(file_name, "ab") as file:
+            for episode in self.pending_episodes:
+                np.save(file, episode)
+            self.heatmap_offset = file.tell()
+        self.heatmap_file = file_name
+        self.pending_episodes.clear()
+
+    def _prepare_heatmap_file(self, file_name):
+        '''
+        根据磁盘上的文件与heatmap_offset决定追加还是重新写入，使file_name中恰好包含文件头与之前保存过的episode：
+        同一个文件截断到上一次保存的位置(从检查点恢复时丢弃检查点之后写入的episode)，
+        保存目录改变时(例如恢复训练时新的log_dir)复制上一次的文件，没有保存过时写入新的文件头
+        '''
+        last_file = self.heatmap_file
+        if self.heatmap_offset > 0 and last_file is not None and os.path.exists(last_file) \
+                and os.path.getsize(last_file) >= self.heatmap_offset:
+            if last_file != file_name:
+                shutil.copyfile(last_file, file_name)
+            with open(file_name, "r+b") as file:
+                file.truncate(self.heatmap_offset)
+            return
+        with open(file_name, "wb") as file:
+            np.save(file, np.array([self.map_shape[0], self.map_shape[1], self.agent_count, self.cell_size],
+                                   dtype=np.float64))
+
+def load_heatmap_episodes(file):
+    '''
+    依次读取PedsMoveInfoDataHandler保存的热力图文件中每个episode的数据，不会一次性载入全部episode
+    :param file: pos_heatmap.npy文件路径
+    :return: 生成器，首先产生(map_shape, agent_count, cell_size)，之后每次产生一个episode的稀疏数据[通道,格子下标,次数]
+    '''
+    with open(file, "rb") as f:
+        header = np.load(f)
+        yield (int(header[0]), int(header[1])), int(header[2]), float(header[3])
+        while True:
+            try:
+                yield np.load(f)
+            except (EOFError, ValueError, OSError):
+                break
 
 if __name__ == "__main__":
     cap = 20
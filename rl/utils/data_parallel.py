@@ -0,0 +1,211 @@
+import copy
+import datetime
+import multiprocessing
+import socket
+
+import torch
+import torch.nn.functional as F
+import torch.distributed as dist
+
+from rl.utils.functions import average_gradients
+
+# 主进程通过广播命令张量[命令, 智能体编号, 批次大小, 状态维数, 动作维数]驱动各个工作进程
+CMD_UPDATE = 0
+CMD_SYNC = 1
+CMD_CLOSE = 2
+CMD_SIZE = 5
+
+
+def double_q_critic_loss(critic, s, a, target):
+    '''
+    双Q评判家网络(MATD3/MAMBPO)的损失
+    '''
+    current_Q1, current_Q2 = critic.forward(s, a)
+    return F.mse_loss(current_Q1, target) + F.mse_loss(current_Q2, target)
+
+
+def critic_loss(critic, s, a, target):
+    '''
+    单Q评判家网络(MADDPG)的损失
+    '''
+    current_Q = critic.forward(s, a)
+    return F.mse_loss(current_Q, target)
+
+
+def critic_update_step(critic, optimizer, loss_fn, s, a, target, max_grad_norm, distributed):
+    '''
+    单进程与数据并行共用的一次评判家网络更新，数据并行时在裁剪梯度前对各进程的梯度求平均，
+    由于各分片大小相同，平均后的梯度与整个批次上计算的梯度相同
+    '''
+    loss = loss_fn(critic, s, a, target)
+    optimizer.zero_grad()
+    loss.backward()
+    if distributed:
+        average_gradients(critic)
+    torch.nn.utils.clip_grad_norm_(critic.parameters(), max_grad_norm)
+    optimizer.step()
+    return loss.detach()
+
+
+def sharded_update_step(critic, optimizer, loss_fn, s, a, target, max_grad_norm, world_size):
+    '''
+    在单个进程中按照与DataParallelCritics相同的方式进行一次更新：批次按顺序平均切分为world_size片，
+    各分片的梯度按进程编号顺序相加后除以world_size，再进行裁剪与优化器更新，用于验证数据并行更新的结果。
+    两个进程时gloo的all_reduce与这里的加法顺序相同，结果逐位一致
+    :return: 整个批次上的平均损失
+    '''
+    params = list(critic.parameters())
+    total_grad, total_loss = None, None
+    for s_k, a_k, target_k in zip(torch.chunk(s, world_size), torch.chunk(a, world_size), torch.chunk(target, world_size)):
+        loss = loss_fn(critic, s_k, a_k, target_k)
+        optimizer.zero_grad()
+        loss.backward()
+        flat = torch.cat([param.grad.reshape(-1) for param in params if param.grad is not None])
+        total_grad = flat if total_grad is None else total_grad + flat
+        total_loss = loss.detach() if total_loss is None else total_loss + loss.detach()
+    total_grad /= float(world_size)
+    offset = 0
+    for param in params:
+        if param.grad is None:
+            continue
+        param.grad.copy_(total_grad[offset:offset + param.grad.numel()].view_as(param.grad))
+        offset += param.grad.numel()
+    torch.nn.utils.clip_grad_norm_(critic.parameters(), max_grad_norm)
+    optimizer.step()
+    return total_loss.item() / world_size
+
+
+def _broadcast_parameters(critics):
+    for critic in critics:
+        for param in critic.parameters():
+            dist.broadcast(param.data, src=0)
+
+
+def _scatter_batch(cmd, data=None, world_size=1):
+    rank = dist.get_rank()
+    batch, state_dim, action_dim = int(cmd[2]), int(cmd[3]), int(cmd[4])
+    shard = torch.zeros([batch // world_size, state_dim + action_dim + 1])
+    dist.scatter(shard, list(torch.chunk(data, world_size)) if rank == 0 else None, src=0)
+    return shard[:, :state_dim], shard[:, state_dim:state_dim + action_dim], shard[:, -1]
+
+
+def data_parallel_worker(rank, world_size, init_method, wrapper, num_threads, timeout):
+    torch.set_num_threads(num_threads)
+    critics, optimizer_args, loss_fn, max_grad_norm = wrapper.x
+    optimizers = []
+    for critic, (optimizer_cls, defaults, state_dict) in zip(critics, optimizer_args):
+        optimizer = optimizer_cls(critic.parameters(), **defaults)
+        optimizer.load_state_dict(state_dict)
+        optimizers.append(optimizer)
+    dist.init_process_group("gloo", init_method=init_method, rank=rank, world_size=world_size,
+                            timeout=datetime.timedelta(seconds=timeout))
+    try:
+        cmd = torch.zeros([CMD_SIZE], dtype=torch.long)
+        while True:
+            dist.broadcast(cmd, src=0)
+            if cmd[0] == CMD_UPDATE:
+                i = int(cmd[1])
+                s, a, target = _scatter_batch(cmd, world_size=world_size)
+                loss = critic_update_step(critics[i], optimizers[i], loss_fn, s, a, target, max_grad_norm, True)
+                dist.all_reduce(loss, op=dist.ReduceOp.SUM)
+            elif cmd[0] == CMD_SYNC:
+                _broadcast_parameters(critics)
+            elif cmd[0] == CMD_CLOSE:
+                break
+            else:
+                raise NotImplementedError
+    finally:
+        dist.destroy_process_group()
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class DataParallelCritics:
+    '''
+    在CPU上以gloo后端进行数据并行的评判家网络更新，主进程为0号进程并直接更新智能体自身的评判家网络，
+    其余进程持有评判家网络与优化器的副本。每次更新时主进程将整个批次平均切分发送给各进程，
+    各进程在自己的分片上计算梯度后通过all_reduce求平均，再各自进行相同的裁剪与优化器更新，
+    因此所有进程中的参数始终保持一致，与单进程在整个批次上的更新等价
+    '''
+    def __init__(self, critics, optimizers, loss_fn, world_size, max_grad_norm=0.5, num_threads=1, timeout=300):
+        '''
+        :param critics: 各个智能体的评判家网络
+        :param optimizers: 各个评判家网络对应的优化器
+        :param loss_fn: 损失函数，形如loss_fn(critic, s, a, target)
+        :param world_size: 参与更新的进程数(包括主进程)
+        :param max_grad_norm: 梯度裁剪的最大范数
+        :param num_threads: 每个工作进程使用的torch线程数
+        :param timeout: 集合通信的超时时间(秒)，工作进程异常退出时主进程不会一直阻塞
+        '''
+        if world_size < 2:
+            raise Exception("数据并行至少需要两个进程!")
+        if dist.is_initialized():
+            raise Exception("当前进程中已经存在进程组!")
+        if any(param.is_cuda for critic in critics for param in critic.parameters()):
+            raise Exception("数据并行的评判家更新只支持CPU上的网络!")
+        self.critics = critics
+        self.optimizers = optimizers
+        self.loss_fn = loss_fn
+        self.world_size = world_size
+        self.max_grad_norm = max_grad_norm
+        self.closed = False
+
+        from rl.utils.classes import CloudpickleWrapper
+        init_method = "tcp://127.0.0.1:{}".format(_free_port())
+        optimizer_args = [(type(opt), opt.defaults, copy.deepcopy(opt.state_dict())) for opt in optimizers]
+        wrapper = CloudpickleWrapper((critics, optimizer_args, loss_fn, max_grad_norm))
+        ctx = multiprocessing.get_context("spawn")  # 避免fork后的子进程继承主进程中torch的线程状态
+        self.ps = [ctx.Process(target=data_parallel_worker,
+                               args=(rank, world_size, init_method, wrapper, num_threads, timeout))
+                   for rank in range(1, world_size)]
+        for p in self.ps:
+            p.daemon = True
+            p.start()
+        dist.init_process_group("gloo", init_method=init_method, rank=0, world_size=world_size,
+                                timeout=datetime.timedelta(seconds=timeout))
+
+    def _send_cmd(self, *args):
+        cmd = torch.zeros([CMD_SIZE], dtype=torch.long)
+        cmd[:len(args)] = torch.tensor(args, dtype=torch.long)
+        dist.broadcast(cmd, src=0)
+        return cmd
+
+    def update_critic(self, i, s, a, target):
+        '''
+        对第i个智能体的评判家网络进行一次数据并行的更新
+        :param s: 评判家网络的状态输入 [batch, state_dim]
+        :param a: 评判家网络的动作输入 [batch, action_dim]
+        :param target: TD目标 [batch]
+        :return: 整个批次上的平均损失
+        '''
+        batch = s.shape[0]
+        if batch % self.world_size != 0:
+            raise Exception("批次大小{}不能被进程数{}整除!".format(batch, self.world_size))
+        data = torch.cat([s.float(), a.float(), target.float().reshape([-1, 1])], dim=1).detach()
+        cmd = self._send_cmd(CMD_UPDATE, i, batch, s.shape[1], a.shape[1])
+        s, a, target = _scatter_batch(cmd, data, self.world_size)
+        loss = critic_update_step(self.critics[i], self.optimizers[i], self.loss_fn, s, a, target,
+                                  self.max_grad_norm, True)
+        dist.all_reduce(loss, op=dist.ReduceOp.SUM)
+        return loss.item() / self.world_size
+
+    def sync(self):
+        '''
+        将主进程中评判家网络的参数广播到各个工作进程，在主进程中加载或修改了网络参数后调用
+        '''
+        self._send_cmd(CMD_SYNC)
+        _broadcast_parameters(self.critics)
+
+    def close(self):
+        if self.closed:
+            return
+        self._send_cmd(CMD_CLOSE)
+        for p in self.ps:
+            p.join()
+        dist.destroy_process_group()
+        self.closed = True
+
@@ -0,0 +1,91 @@
+import copy
+import json
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+from rl.utils.policy_runner import POLICY_META_FILE
+
+
+class PolicyBundle(nn.Module):
+    '''
+    将所有智能体的演员网络打包为一个模块，输入为所有智能体观测的拼接 [batch, sum(state_dims)]，
+    输出为所有智能体确定性动作的拼接 [batch, sum(action_dims)]，离散动作输出为one-hot，连续动作限制在[-1, 1]
+    '''
+    def __init__(self, actors, state_dims, action_dims, discrete, shared_actor=None):
+        '''
+        :param actors: 各智能体的演员网络
+        :param shared_actor: 参数共享模式下的共享演员网络(AgentConditionedNetwork)，不为None时一次前向运算得到所有智能体的动作
+        '''
+        super(PolicyBundle, self).__init__()
+        self.state_dims = list(state_dims)
+        self.action_dims = list(action_dims)
+        self.discrete = discrete
+        self.shared_actor = shared_actor
+        self.actors = nn.ModuleList(actors) if shared_actor is None else nn.ModuleList()
+
+    def _postprocess(self, out):
+        if self.discrete:
+            return F.one_hot(out.argmax(dim=1), out.shape[1]).float()
+        return out.clamp(-1, 1)
+
+    def forward(self, obs):
+        if self.shared_actor is not None:
+            n = len(self.state_dims)
+            agent_idx = torch.arange(n, device=obs.device).repeat(obs.shape[0])
+            out = self.shared_actor(obs.reshape(-1, self.state_dims[0]), agent_idx=agent_idx)
+            return self._postprocess(out).reshape(obs.shape[0], -1)
+        actions, start = [], 0
+        for actor, dim in zip(self.actors, self.state_dims):
+            actions.append(self._postprocess(actor(obs[:, start:start + dim])))
+            start += dim
+        return torch.cat(actions, dim=1)
+
+
+def env_metadata(env):
+    '''
+    重新创建评估环境所需的参数，目前只记录PedsMoveEnv的参数
+    '''
+    meta = {"name": type(env).__name__}
+    if hasattr(env, "terrain"):
+        meta.update({
+            "map": env.terrain.name,
+            "person_num": env.person_num,
+            "group_size": list(env.group_size),
+            "discrete": env.discrete,
+            "frame_skipping": env.frame_skipping,
+            "maxStep": env.maxStep,
+            "random_init_mode": env.random_init_mode,
+            "use_planner": env.person_handler.use_planner,
+        })
+    return meta
+
+
+def export_policy(agent, file, optimize=True):
+    '''
+    将多智能体的演员网络导出为一个TorchScript文件，观测与动作的布局以及环境参数以元数据的形式保存在同一个文件中，
+    使用rl/utils/policy_runner.py加载时不需要导入任何训练代码
+    :param agent: 已经加载好演员网络的多智能体
+    :param file: 导出的文件路径
+    :param optimize: 是否冻结并优化导出的模块，冻结后只能用于推理
+    :return: 导出的文件路径
+    '''
+    shared = getattr(agent, "shared_agent", None)
+    bundle = PolicyBundle([ag.actor for ag in agent.agents], agent.state_dims, agent.action_dims, agent.discrete,
+                          shared.actor if shared is not None else None)
+    bundle = copy.deepcopy(bundle).cpu().eval() #不改变训练中网络所在的设备与模式
+    example = torch.zeros([2, sum(agent.state_dims)])
+    with torch.no_grad():
+        module = torch.jit.trace(bundle, example)
+    if optimize and hasattr(torch.jit, "freeze"):
+        module = torch.jit.freeze(module)
+    meta = {
+        "state_dims": list(agent.state_dims),
+        "action_dims": list(agent.action_dims),
+        "discrete": agent.discrete,
+        "agent_count": len(agent.state_dims),
+        "env": env_metadata(agent.env),
+    }
+    torch.jit.save(module, file, _extra_files={POLICY_META_FILE: json.dumps(meta)})
+    return file
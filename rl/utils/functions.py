@@ -14,17 +14,23 @@ from gym.spaces import Discrete, Box
 import ped_env
 import rl
 from rl.utils.miscellaneous import str_key
+from rl.utils.tabular import TabularQ
 
 
 def set_dict(target_dict, value, *args):
     if target_dict is None:
         return
+    if isinstance(target_dict, TabularQ):
+        target_dict.set(*args, value)
+        return
     target_dict[str_key(*args)] = value
 
 def get_dict(target_dict, *args):
     #print("key: {}".format(str_key(*args)))
     if target_dict is None:
         return
+    if isinstance(target_dict, TabularQ):
+        return target_dict.get(*args)
     return target_dict.get(str_key(*args),0)
 
 def uniform_random_pi(A, s = None, Q = None, a = None):
@@ -44,6 +50,10 @@ def greedy_pi(A, s, Q, a):
     '''依据贪婪选择，计算在行为空间A中，状态s下，a行为被贪婪选中的几率
     考虑多个行为的价值相同的情况
     '''
+    if isinstance(Q, TabularQ):
+        q = Q.row(s)
+        a_max_q = np.flatnonzero(q == q.max())
+        return 1.0 / len(a_max_q) if int(a) in a_max_q else 0.0
     #print("in greedy_pi: s={},a={}".format(s,a))
     max_q, a_max_q = -float('inf'), []
     for a_opt in A:# 统计后续状态的最大价值以及到达到达该状态的行为（可能不止一个）
@@ -83,10 +93,18 @@ def back_specified_dimension(space)->int:
 # https://github.com/seba-1511/dist_tuto.pth/blob/gh-pages/train_dist.py
 def average_gradients(model):
     """ Gradient averaging. """
+    # 将所有梯度拼接为一个张量后只做一次all_reduce，减少通信次数
+    grads = [param.grad.data for param in model.parameters() if param.grad is not None]
+    if len(grads) == 0:
+        return
     size = float(dist.get_world_size())
-    for param in model.parameters():
-        dist.all_reduce(param.grad.data, op=dist.reduce_op.SUM, group=0)
-        param.grad.data /= size
+    flat = torch.cat([grad.reshape(-1) for grad in grads])
+    dist.all_reduce(flat, op=dist.ReduceOp.SUM)
+    flat /= size
+    offset = 0
+    for grad in grads:
+        grad.copy_(flat[offset:offset + grad.numel()].view_as(grad))
+        offset += grad.numel()
 
 def onehot_from_int(x,action_dim:int):
     #小数是为了能够做梯度计算！
@@ -200,48 +218,37 @@ def print_train_string(experience, trans=500):
     print("{}".format(experience.__str__()))
 
 def loss_callback(agent, loss):
-    agent.loss_recoder.append(list(loss))
-    if len(agent.loss_recoder) > 0: #每一个episode都进行记录
-        arr = np.array(agent.loss_recoder)
-        critic_loss_mean = np.mean(arr[-agent.log_frequent:, 0])
-        actor_loss_mean = np.mean(arr[-agent.log_frequent:, 1])
-        agent.writer.add_scalar('loss/actor', actor_loss_mean, agent.total_steps_in_train)
-        agent.writer.add_scalar('loss/critic', critic_loss_mean, agent.total_steps_in_train)
-
-    if agent.total_episodes_in_train % agent.log_frequent == 0 \
-            and len(agent.loss_recoder) > 0:
-        arr = np.array(agent.loss_recoder)
-        critic_loss_mean = np.mean(arr[-agent.log_frequent:, 0])
-        actor_loss_mean = np.mean(arr[-agent.log_frequent:, 1])
+    agent.loss_recoder.append(loss)
+    #每一个episode都进行记录
+    critic_loss_mean = agent.loss_recoder.recent_mean(agent.log_frequent, 0)
+    actor_loss_mean = agent.loss_recoder.recent_mean(agent.log_frequent, 1)
+    agent.writer.add_scalar('loss/actor', actor_loss_mean, agent.total_steps_in_train)
+    agent.writer.add_scalar('loss/critic', critic_loss_mean, agent.total_steps_in_train)
+
+    if agent.total_episodes_in_train % agent.log_frequent == 0:
         print("Critic mean Loss:{},Actor mean Loss:{}"
               .format(critic_loss_mean, actor_loss_mean))
 
 def model_based_loss_callback(agent, loss):
-    agent.loss_recoder.append(list(loss))
-    if len(agent.loss_recoder) > 0:  # 每一个episode都进行记录
-        arr = np.array(agent.loss_recoder)
-        critic_loss_mean = np.mean(arr[-agent.log_frequent:, 0])
-        actor_loss_mean = np.mean(arr[-agent.log_frequent:, 1])
-        model_loss_mean = np.mean(arr[-agent.log_frequent:, 2])
-        agent.writer.add_scalar('loss/actor', actor_loss_mean, agent.total_steps_in_train)
-        agent.writer.add_scalar('loss/critic', critic_loss_mean, agent.total_steps_in_train)
-        agent.writer.add_scalar('loss/model', model_loss_mean, agent.total_steps_in_train)
-
-    if agent.total_episodes_in_train % agent.log_frequent == 0 \
-            and len(agent.loss_recoder) > 0:
-        arr = np.array(agent.loss_recoder)
-        critic_loss_mean = np.mean(arr[-agent.log_frequent:, 0])
-        actor_loss_mean = np.mean(arr[-agent.log_frequent:, 1])
-        print("Critic mean Loss:{},Actor mean Loss:{}"
-              .format(critic_loss_mean, actor_loss_mean))
+    loss_callback(agent, loss)
+    model_loss_mean = agent.loss_recoder.recent_mean(agent.log_frequent, 2)
+    agent.writer.add_scalar('loss/model', model_loss_mean, agent.total_steps_in_train)
 
 def save_callback(agent, episode_num: int):
     sname = agent.log_dir
     if episode_num % (agent.log_frequent) == 0:
         print("save network!......")
-        for i in range(agent.env.agent_count):
-            agent.save(sname, "Actor{}".format(i), agent.agents[i].actor, episode_num)
-            agent.save(sname, "Critic{}".format(i), agent.agents[i].critic, episode_num)
+        if agent.checkpointer is not None: #由后台线程写入完整的训练状态以及各个网络
+            network_files = []
+            for i in range(agent.env.agent_count):
+                network_files.append((os.path.join(agent.model_dir, "Actor{}.pkl".format(i)), agent.agents[i].actor))
+                network_files.append((os.path.join(agent.model_dir, "Critic{}.pkl".format(i)), agent.agents[i].critic))
+            agent.save_desc(sname)
+            agent.checkpointer.save(agent, episode_num, network_files)
+        else:
+            for i in range(agent.env.agent_count):
+                agent.save(sname, "Actor{}".format(i), agent.agents[i].actor, episode_num)
+                agent.save(sname, "Critic{}".format(i), agent.agents[i].critic, episode_num)
         #if isinstance(agent, rl.agents.MAMBPOAgent.MAMBPOAgent):
             #agent.save_model()
     if agent.info_callback_ != None:
@@ -0,0 +1,88 @@
+import threading
+from collections import deque
+from itertools import islice
+
+from torch.utils.tensorboard import SummaryWriter
+
+
+class MetricsSink:
+    '''
+    与SummaryWriter接口相同的指标记录器，训练过程中只在内存中累计每个标签的均值、最小值与最大值，
+    由后台线程每隔flush_interval秒将累计结果写入TensorBoard，避免在训练的热路径中序列化与写文件
+    '''
+    def __init__(self, summary_dir, flush_interval=10.0):
+        '''
+        :param summary_dir: TensorBoard日志目录
+        :param flush_interval: 写入TensorBoard的时间间隔(秒)
+        '''
+        self.writer = SummaryWriter(log_dir=summary_dir)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.stats = {}  # tag -> [次数, 总和, 最小值, 最大值, 最后一次的step]
+        self.closed = False
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self.thread.start()
+
+    def add_scalar(self, tag, value, step):
+        value = float(value)
+        with self.lock:
+            stat = self.stats.get(tag)
+            if stat is None:
+                self.stats[tag] = [1, value, value, value, step]
+            else:
+                stat[0] += 1
+                stat[1] += value
+                stat[2] = min(stat[2], value)
+                stat[3] = max(stat[3], value)
+                stat[4] = step
+
+    def add_scalars(self, main_tag, tag_scalar_dict, step):
+        # 以main_tag/key的形式记录，不会像SummaryWriter.add_scalars一样为每个key创建新的日志文件
+        for key, value in tag_scalar_dict.items():
+            self.add_scalar("{}/{}".format(main_tag, key), value, step)
+
+    def flush(self):
+        with self.lock:
+            stats, self.stats = self.stats, {}
+        for tag, (count, total, min_value, max_value, step) in stats.items():
+            self.writer.add_scalar(tag, total / count, step)
+            if count > 1:
+                self.writer.add_scalar(tag + "/min", min_value, step)
+                self.writer.add_scalar(tag + "/max", max_value, step)
+        self.writer.flush()
+
+    def _flush_loop(self):
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.stop_event.set()
+        self.thread.join()
+        self.flush()
+        self.writer.close()
+        self.closed = True
+
+
+class LossHistory:
+    '''
+    长度有上限的损失记录，只保留最近maxlen个episode的损失
+    '''
+    def __init__(self, maxlen=1000):
+        self.data = deque(maxlen=maxlen)
+
+    def append(self, loss):
+        self.data.append(list(loss))
+
+    def recent_mean(self, n, idx):
+        '''
+        最近n个episode中第idx项损失的均值
+        '''
+        n = min(n, len(self.data))
+        recent = islice(self.data, len(self.data) - n, None)
+        return sum(loss[idx] for loss in recent) / max(n, 1)
+
+    def __len__(self):
+        return len(self.data)
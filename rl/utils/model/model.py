@@ -1,3 +1,4 @@
+import contextlib
 import itertools
 import os.path
 
@@ -10,9 +11,29 @@ from rl.utils.miscellaneous import CUDA_DEVICE_ID
 
 device = torch.device('cuda:'+str(CUDA_DEVICE_ID) if torch.cuda.is_available() else "cpu")
 
+PRECISIONS = ("float32", "bfloat16")
+
+def precision_context(precision):
+    '''
+    前向运算的精度上下文，bfloat16时在CPU上使用bfloat16自动混合精度，网络参数与优化器状态仍然保持float32
+    '''
+    if precision not in PRECISIONS:
+        raise Exception("不支持的精度{}!".format(precision))
+    if precision == "float32":
+        return contextlib.suppress() #不做任何事的上下文
+    if not hasattr(torch, "autocast"):
+        raise Exception("当前版本的torch不支持CPU上的bfloat16自动混合精度!")
+    return torch.autocast("cpu", dtype=torch.bfloat16)
+
 class StandardScaler(object):
     def __init__(self):
-        pass
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+        self._device_stats = None
 
     def fit(self, data):
         """Runs two ops, one for assigning the mean of the data to the internal mean, and
@@ -22,9 +43,38 @@ class StandardScaler(object):
         data (np.ndarray): A numpy array containing the input
         Returns: None.
         """
-        self.mu = np.mean(data, axis=0, keepdims=True)
-        self.std = np.std(data, axis=0, keepdims=True)
+        self.reset()
+        self.partial_fit(data)
+
+    def partial_fit(self, data):
+        '''
+        将新数据的均值与方差合并到已有的统计量中(Chan等人的并行合并公式)，不需要重新遍历之前的数据
+        :param data: numpy数组或张量 [N, dim]
+        '''
+        if data.shape[0] == 0:
+            return
+        if torch.is_tensor(data):
+            data = data.detach().double()
+            batch_mean = torch.mean(data, dim=0)
+            batch_m2 = torch.sum(torch.square(data - batch_mean), dim=0).cpu().numpy()
+            batch_mean = batch_mean.cpu().numpy()
+        else:
+            data = np.asarray(data, dtype=np.float64)
+            batch_mean = np.mean(data, axis=0)
+            batch_m2 = np.sum(np.square(data - batch_mean), axis=0)
+        n = data.shape[0]
+        if self.count == 0:
+            self.mean, self.m2 = batch_mean, batch_m2
+        else:
+            total = self.count + n
+            delta = batch_mean - self.mean
+            self.mean = self.mean + delta * n / total
+            self.m2 = self.m2 + batch_m2 + np.square(delta) * self.count * n / total
+        self.count += n
+        self.mu = self.mean[None, :]
+        self.std = np.sqrt(self.m2 / self.count)[None, :]
         self.std[self.std < 1e-12] = 1.0
+        self._device_stats = None
 
     def transform(self, data):
         """Transforms the input matrix data using the parameters of this scaler.
@@ -32,6 +82,11 @@ class StandardScaler(object):
         data (np.array): A numpy array containing the points to be transformed.
         Returns: (np.array) The transformed dataset.
         """
+        if torch.is_tensor(data):
+            if self._device_stats is None or self._device_stats[0].device != data.device:
+                self._device_stats = (torch.from_numpy(self.mu).float().to(data.device),
+                                      torch.from_numpy(self.std).float().to(data.device))
+            return (data - self._device_stats[0]) / self._device_stats[1]
         return (data - self.mu) / self.std
 
     def inverse_transform(self, data):
@@ -42,6 +97,45 @@ class StandardScaler(object):
         """
         return self.std * data + self.mu
 
+    def state_dict(self):
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    def load_state_dict(self, state):
+        self.reset()
+        if state["count"] > 0:
+            self.count, self.mean, self.m2 = state["count"], state["mean"], state["m2"]
+            self.mu = self.mean[None, :]
+            self.std = np.sqrt(self.m2 / self.count)[None, :]
+            self.std[self.std < 1e-12] = 1.0
+
+class ModelDataset:
+    '''
+    预先分配在device上的动力学模型训练数据(循环队列)，每条数据在加入时按holdout_ratio随机划分到验证集，
+    训练时直接在张量上索引，不需要在numpy与张量之间来回转换
+    '''
+    def __init__(self, capacity, input_size, label_size, holdout_ratio=0.2):
+        self.capacity = int(capacity)
+        self.holdout_ratio = holdout_ratio
+        self.inputs = torch.zeros([self.capacity, input_size], device=device)
+        self.labels = torch.zeros([self.capacity, label_size], device=device)
+        self.holdout = torch.zeros([self.capacity], dtype=torch.bool, device=device)
+        self.next_id = 0
+        self.size = 0
+
+    def add(self, inputs, labels):
+        inputs, labels = inputs[-self.capacity:], labels[-self.capacity:]
+        n = inputs.shape[0]
+        idx = (self.next_id + torch.arange(n, device=device)) % self.capacity
+        self.inputs[idx] = inputs.float().to(device)
+        self.labels[idx] = labels.float().to(device)
+        self.holdout[idx] = torch.rand(n, device=device) < self.holdout_ratio
+        self.next_id = (self.next_id + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def split(self):
+        holdout = self.holdout[:self.size]
+        return torch.nonzero(~holdout).squeeze(1), torch.nonzero(holdout).squeeze(1)
+
 def init_weights(m):
     def truncated_normal_init(t, mean=0.0, std=0.01):
         torch.nn.init.normal_(t, mean=mean, std=std)
@@ -89,7 +183,13 @@ class EnsembleFC(nn.Module):
     def reset_parameters(self) -> None:
         pass
 
-    def forward(self, input: torch.Tensor) -> torch.Tensor:
+    def forward(self, input: torch.Tensor, members: torch.Tensor = None) -> torch.Tensor:
+        '''
+        :param input: [ensemble_size, N, in_features]，指定members时为[len(members), N, in_features]
+        :param members: 只使用其中的网络进行计算，为None时使用全部网络
+        '''
+        if members is not None:
+            return torch.baddbmm(self.bias[members][:, None, :], input, self.weight[members])
         w_times_x = torch.bmm(input, self.weight)
         return torch.add(w_times_x, self.bias[:, None, :])  # w times x + b
 
@@ -127,13 +227,13 @@ class EnsembleModel(nn.Module):#其线性层为[s1, s2, ensemble_size]等于将
         self.apply(init_weights)
         self.no_linear = Swish()
 
-    def forward(self, x, ret_log_var=False):
+    def forward(self, x, ret_log_var=False, members=None):
 
-        nn1_output = self.no_linear(self.nn1(x))
-        nn2_output = self.no_linear(self.nn2(nn1_output))
-        nn3_output = self.no_linear(self.nn3(nn2_output))
-        nn4_output = self.no_linear(self.nn4(nn3_output))
-        nn5_output = self.nn5(nn4_output)
+        nn1_output = self.no_linear(self.nn1(x, members))
+        nn2_output = self.no_linear(self.nn2(nn1_output, members))
+        nn3_output = self.no_linear(self.nn3(nn2_output, members))
+        nn4_output = self.no_linear(self.nn4(nn3_output, members))
+        nn5_output = self.nn5(nn4_output, members).float() #方差的计算与损失始终使用float32
 
         mean = nn5_output[:, :, :self.output_dim]
 
@@ -203,7 +303,13 @@ class Swish(nn.Module):
         return x
 
 class EnsembleDynamicsModel():
-    def __init__(self, network_size, elite_size, state_size, action_size, reward_size=1, hidden_size=200, use_decay=False):
+    def __init__(self, network_size, elite_size, state_size, action_size, reward_size=1, hidden_size=200, use_decay=False,
+                 dataset_size=200000, holdout_ratio=0.2, precision="float32"):
+        '''
+        :param precision: 前向与反向运算的精度，bfloat16时在CPU上使用自动混合精度，参数仍以float32保存与更新
+        '''
+        precision_context(precision)
+        self.precision = precision
         self.network_size = network_size
         self.elite_size = elite_size
         self.model_list = []
@@ -214,6 +320,70 @@ class EnsembleDynamicsModel():
         self.elite_model_idxes = []
         self.ensemble_model = EnsembleModel(state_size, action_size, reward_size, network_size, hidden_size, use_decay=use_decay).to(device)
         self.scaler = StandardScaler()
+        self.dataset_size = dataset_size
+        self.holdout_ratio = holdout_ratio
+        self.dataset = None
+
+    def reset_data(self):
+        self.dataset = None
+        self.scaler.reset()
+
+    def add_data(self, inputs, labels):
+        '''
+        向训练数据集中加入新的数据，并增量更新输入的标准化参数
+        :param inputs: 张量 [N, state_size + action_size]
+        :param labels: 张量 [N, reward_size + state_size]
+        '''
+        if self.dataset is None:
+            self.dataset = ModelDataset(self.dataset_size, inputs.shape[1], labels.shape[1], self.holdout_ratio)
+        self.scaler.partial_fit(inputs)
+        self.dataset.add(inputs, labels)
+
+    def train_incremental(self, batch_size=256, max_epochs=50, epoch_size=2048, max_epochs_since_update=5,
+                          max_holdout=5000):
+        '''
+        在add_data积累的数据集上继续训练，以当前模型在验证集上的损失作为早停的起点，
+        而不是每次都从头开始早停计数
+        :param epoch_size: 每个epoch中每个网络抽取的训练数据量
+        :param max_holdout: 验证时最多使用的最近加入的验证数据量
+        :return: 验证集上的平均mse，最后一个批次的损失与各个网络的mse
+        '''
+        train_idx, holdout_idx = self.dataset.split()
+        if holdout_idx.shape[0] == 0:
+            holdout_idx = train_idx
+        holdout_idx = holdout_idx[-max_holdout:]
+        holdout_inputs = self.scaler.transform(self.dataset.inputs[holdout_idx])
+        holdout_inputs = holdout_inputs[None, :, :].expand([self.network_size, -1, -1])
+        holdout_labels = self.dataset.labels[holdout_idx][None, :, :].expand([self.network_size, -1, -1])
+
+        def evaluate():
+            with torch.no_grad(), precision_context(self.precision):
+                holdout_mean, holdout_logvar = self.ensemble_model(holdout_inputs, ret_log_var=False)
+                _, holdout_mse_losses = self.ensemble_model.loss(holdout_mean, holdout_logvar, holdout_labels,
+                                                                 inc_var_loss=False)
+            return holdout_mse_losses.cpu().numpy()
+
+        self._max_epochs_since_update = max_epochs_since_update
+        self._epochs_since_update = 0
+        self._snapshots = {i: (None, loss) for i, loss in enumerate(evaluate())}
+        num = min(epoch_size, train_idx.shape[0])
+        for epoch in range(max_epochs):
+            # 每个网络独立地有放回抽取训练数据
+            idxes = train_idx[torch.randint(train_idx.shape[0], [self.network_size, num], device=device)]
+            for start_pos in range(0, num, batch_size):
+                idx = idxes[:, start_pos: start_pos + batch_size]
+                train_input = self.scaler.transform(self.dataset.inputs[idx])
+                train_label = self.dataset.labels[idx]
+                with precision_context(self.precision):
+                    mean, logvar = self.ensemble_model(train_input, ret_log_var=False)
+                loss, mse_loss = self.ensemble_model.loss(mean, logvar, train_label, inc_var_loss=False)
+                self.ensemble_model.train(loss)
+
+            holdout_mse_losses = evaluate()
+            self.elite_model_idxes = np.argsort(holdout_mse_losses)[:self.elite_size].tolist()
+            if self._save_best(epoch, holdout_mse_losses):
+                break
+        return np.mean(holdout_mse_losses), loss.detach().cpu(), mse_loss.detach().cpu()
 
     def train(self, inputs, labels, batch_size=256, holdout_ratio=0., max_epochs_since_update=5):
         self._max_epochs_since_update = max_epochs_since_update
@@ -246,12 +416,13 @@ class EnsembleDynamicsModel():
                 train_input = torch.from_numpy(train_inputs[idx]).float().to(device)
                 train_label = torch.from_numpy(train_labels[idx]).float().to(device)
                 losses = []
-                mean, logvar = self.ensemble_model(train_input, ret_log_var=False)
+                with precision_context(self.precision):
+                    mean, logvar = self.ensemble_model(train_input, ret_log_var=False)
                 loss, mse_loss = self.ensemble_model.loss(mean, logvar, train_label, inc_var_loss=False)
                 self.ensemble_model.train(loss)
                 losses.append(loss)
 
-            with torch.no_grad():
+            with torch.no_grad(), precision_context(self.precision):
                 holdout_mean, holdout_logvar = self.ensemble_model(holdout_inputs, ret_log_var=False)
                 _, holdout_mse_losses = self.ensemble_model.loss(holdout_mean, holdout_logvar, holdout_labels, inc_var_loss=False)
                 holdout_mse_losses = holdout_mse_losses.detach().cpu().numpy()
@@ -263,6 +434,32 @@ class EnsembleDynamicsModel():
             #print('epoch: {}, holdout mse losses: {}'.format(epoch, holdout_mse_losses))
         return np.mean(holdout_mse_losses), loss.cpu(), mse_loss.cpu()
 
+    def holdout_mse(self, precision=None, max_holdout=5000):
+        '''
+        各个网络在最近加入的验证数据上的mse
+        :param precision: 计算使用的精度，为None时使用self.precision
+        '''
+        _, holdout_idx = self.dataset.split()
+        holdout_idx = holdout_idx[-max_holdout:]
+        if holdout_idx.shape[0] == 0:
+            return np.zeros([self.network_size])
+        inputs = self.scaler.transform(self.dataset.inputs[holdout_idx])[None, :, :].expand([self.network_size, -1, -1])
+        labels = self.dataset.labels[holdout_idx][None, :, :].expand([self.network_size, -1, -1])
+        with torch.no_grad(), precision_context(self.precision if precision is None else precision):
+            mean, logvar = self.ensemble_model(inputs, ret_log_var=False)
+            _, mse_losses = self.ensemble_model.loss(mean, logvar, labels, inc_var_loss=False)
+        return mse_losses.cpu().numpy()
+
+    def compare_precision(self, max_holdout=5000):
+        '''
+        低精度的准确性检查：比较当前精度与float32下精英网络在验证集上的平均mse
+        :return: {"float32": mse, self.precision: mse, "relative_gap": 相对差距}
+        '''
+        elites = self.elite_model_idxes if len(self.elite_model_idxes) > 0 else list(range(self.network_size))
+        full = float(np.mean(self.holdout_mse("float32", max_holdout)[elites]))
+        reduced = float(np.mean(self.holdout_mse(self.precision, max_holdout)[elites]))
+        return {"float32": full, self.precision: reduced, "relative_gap": abs(reduced - full) / max(full, 1e-12)}
+
     def _save_best(self, epoch, holdout_losses):
         updated = False
         for i in range(len(holdout_losses)):
@@ -331,7 +528,8 @@ class EnsembleDynamicsModel():
         ensemble_mean, ensemble_var = [], []
         for i in range(0, inputs.shape[0], batch_size):
             input = torch.from_numpy(inputs[i:min(i + batch_size, inputs.shape[0])]).float().to(device)
-            b_mean, b_var = self.ensemble_model(input[None, :, :].repeat([self.network_size, 1, 1]), ret_log_var=False)
+            with torch.no_grad(), precision_context(self.precision):
+                b_mean, b_var = self.ensemble_model(input[None, :, :].repeat([self.network_size, 1, 1]), ret_log_var=False)
             ensemble_mean.append(b_mean.detach().cpu().numpy())
             ensemble_var.append(b_var.detach().cpu().numpy())
         ensemble_mean = np.hstack(ensemble_mean)
@@ -345,6 +543,47 @@ class EnsembleDynamicsModel():
             var = torch.mean(ensemble_var, dim=0) + torch.mean(torch.square(ensemble_mean - mean[None, :, :]), dim=0)
             return mean, var
 
+    def _transform_inputs(self, inputs):
+        if not torch.is_tensor(inputs):
+            inputs = torch.from_numpy(np.asarray(inputs))
+        return self.scaler.transform(inputs.float().to(device))
+
+    def predict_members(self, inputs, model_idxes):
+        '''
+        每个样本只经过为其抽取的网络进行计算。样本按网络编号分组后补齐为[组数, 最大组大小, dim]，
+        各层只取出用到的网络的参数做一次批量矩阵乘法，计算量约为predict的1/network_size
+        :param inputs: numpy数组或张量 [N, state_size + action_size]
+        :param model_idxes: 每个样本对应的网络编号 [N]
+        :return: 各样本在其对应网络下的均值与方差 numpy数组 [N, reward_size + state_size]
+        '''
+        x = self._transform_inputs(inputs)
+        model_idxes = torch.as_tensor(np.asarray(model_idxes), dtype=torch.long, device=device)
+        members, group, counts = torch.unique(model_idxes, return_inverse=True, return_counts=True)
+        # pos为每个样本在其所属组中的位置
+        order = torch.argsort(group)
+        starts = torch.cumsum(counts, dim=0) - counts
+        pos = torch.empty_like(group)
+        pos[order] = torch.arange(group.shape[0], device=device) - starts[group[order]]
+        grouped = x.new_zeros([members.shape[0], int(counts.max()), x.shape[1]])
+        grouped[group, pos] = x
+        with torch.no_grad(), precision_context(self.precision):
+            mean, var = self.ensemble_model(grouped, ret_log_var=False, members=members)
+        return mean[group, pos].cpu().numpy(), var[group, pos].cpu().numpy()
+
+    def predict_elite_mean(self, inputs):
+        '''
+        只用精英网络进行计算，以各精英网络均值的平均作为确定性的预测
+        :return: 均值与方差(各网络方差的均值加上均值之间的方差) numpy数组 [N, reward_size + state_size]
+        '''
+        x = self._transform_inputs(inputs)
+        members = torch.as_tensor(self.elite_model_idxes, dtype=torch.long, device=device)
+        with torch.no_grad(), precision_context(self.precision):
+            mean, var = self.ensemble_model(x[None, :, :].expand([members.shape[0], -1, -1]), ret_log_var=False,
+                                            members=members)
+            elite_mean = torch.mean(mean, dim=0)
+            elite_var = torch.mean(var, dim=0) + torch.mean(torch.square(mean - elite_mean[None, :, :]), dim=0)
+        return elite_mean.cpu().numpy(), elite_var.cpu().numpy()
+
     def save(self, base_dir):
         pa = os.path.join(base_dir, "dynamic_model")
         if not os.path.exists(pa):
@@ -353,3 +592,20 @@ class EnsembleDynamicsModel():
 
     def load(self, model_dir):
         self.ensemble_model.load(model_dir)
+
+    def state_dict(self):
+        '''
+        用于检查点的完整状态，包括网络参数、优化器、数据标准化参数与精英模型编号
+        '''
+        return {
+            "ensemble_model": self.ensemble_model.state_dict(),
+            "optimizer": self.ensemble_model.optimizer.state_dict(),
+            "scaler": self.scaler.state_dict(),
+            "elite_model_idxes": list(self.elite_model_idxes),
+        }
+
+    def load_state_dict(self, state):
+        self.ensemble_model.load_state_dict(state["ensemble_model"])
+        self.ensemble_model.optimizer.load_state_dict(state["optimizer"])
+        self.scaler.load_state_dict(state["scaler"])
+        self.elite_model_idxes = list(state["elite_model_idxes"])
@@ -2,11 +2,18 @@ import numpy as np
 
 from rl.utils.model.model import EnsembleDynamicsModel
 
+# 预测方式：full为所有网络都计算后取每个样本抽取的精英网络的输出，
+# sparse为每个样本只经过为其抽取的精英网络，elite_mean为以所有精英网络均值的平均作为预测
+INFERENCE_MODES = ("full", "sparse", "elite_mean")
+
 class PredictEnv:
-    def __init__(self, model:EnsembleDynamicsModel, env_name, model_type):
+    def __init__(self, model:EnsembleDynamicsModel, env_name, model_type, inference_mode="sparse"):
+        if inference_mode not in INFERENCE_MODES:
+            raise Exception("不支持的预测方式{}!".format(inference_mode))
         self.model = model
         self.env_name = env_name
         self.model_type = model_type
+        self.inference_mode = inference_mode if model_type == 'pytorch' else "full"
 
     def _termination_fn(self, env_name, obs, act, next_obs):
         if env_name == "Hopper-v2":
@@ -35,14 +42,10 @@ class PredictEnv:
             done = done[:, None]
             return done
         elif env_name == "PedsMoveEnv":
-            state_dim = int(next_obs.shape[1] / self.model.reward_size)
-            done = np.ones([next_obs.shape[0], self.model.reward_size], dtype=np.bool)
-            for i in range(self.model.reward_size):
-                rel = next_obs[:,i:i+state_dim][:, 4:6] #得到智能体i相对出口的位置,速度可能预测不准
-                dis = np.sqrt(np.power(rel[:,0],2)+np.power(rel[:,1],2))
-                idx = np.where(dis > 1.2) #1.2是指离出口的距离
-                done[idx[0], i] = False #一旦出现大于0.1的就将终态置为False
-            return done # np.zeros([next_obs.shape[0], self.model.reward_size], dtype=np.bool)
+            agent_count = self.model.reward_size
+            rel = next_obs.reshape([next_obs.shape[0], agent_count, -1])[:, :, 4:6] #得到各个智能体相对出口的位置,速度可能预测不准
+            dis = np.sqrt(np.sum(np.power(rel, 2), axis=-1))
+            return ~(dis > 1.2) #1.2是指离出口的距离，距离大于1.2时不是终态
         elif 'walker_' in env_name:
             torso_height =  next_obs[:, -2]
             torso_ang = next_obs[:, -1]
@@ -86,26 +89,39 @@ class PredictEnv:
             return_single = False
 
         inputs = np.concatenate((obs, act), axis=-1)
-        if self.model_type == 'pytorch':
-            ensemble_model_means, ensemble_model_vars = self.model.predict(inputs)
-        else:
-            ensemble_model_means, ensemble_model_vars = self.model.predict(inputs, factored=True)
-        ensemble_model_means[:, :, self.model.reward_size:] += obs #因为预测的是delta_state，故而要加上state
-        ensemble_model_stds = np.sqrt(ensemble_model_vars)
+        if self.inference_mode == "full":
+            if self.model_type == 'pytorch':
+                ensemble_model_means, ensemble_model_vars = self.model.predict(inputs)
+            else:
+                ensemble_model_means, ensemble_model_vars = self.model.predict(inputs, factored=True)
+            ensemble_model_means[:, :, self.model.reward_size:] += obs #因为预测的是delta_state，故而要加上state
+            ensemble_model_stds = np.sqrt(ensemble_model_vars)
 
-        if deterministic:
-            ensemble_samples = ensemble_model_means
-        else:
-            ensemble_samples = ensemble_model_means + np.random.normal(size=ensemble_model_means.shape) * ensemble_model_stds
+            if deterministic:
+                ensemble_samples = ensemble_model_means
+            else:
+                ensemble_samples = ensemble_model_means + np.random.normal(size=ensemble_model_means.shape) * ensemble_model_stds
 
-        num_models, batch_size, _ = ensemble_model_means.shape
-        if self.model_type == 'pytorch':
-            model_idxes = np.random.choice(self.model.elite_model_idxes, size=batch_size)
-        else:
-            model_idxes = self.model.random_inds(batch_size)
-        batch_idxes = np.arange(0, batch_size)
+            num_models, batch_size, _ = ensemble_model_means.shape
+            if self.model_type == 'pytorch':
+                model_idxes = np.random.choice(self.model.elite_model_idxes, size=batch_size)
+            else:
+                model_idxes = self.model.random_inds(batch_size)
+            batch_idxes = np.arange(0, batch_size)
 
-        samples = ensemble_samples[model_idxes, batch_idxes]
+            samples = ensemble_samples[model_idxes, batch_idxes]
+        else:
+            if self.inference_mode == "sparse":
+                # 与full相同先为每个样本抽取精英网络，但只计算被抽中的网络
+                model_idxes = np.random.choice(self.model.elite_model_idxes, size=inputs.shape[0])
+                model_means, model_vars = self.model.predict_members(inputs, model_idxes)
+            else:
+                model_means, model_vars = self.model.predict_elite_mean(inputs)
+            model_means[:, self.model.reward_size:] += obs
+            if deterministic:
+                samples = model_means
+            else:
+                samples = model_means + np.random.normal(size=model_means.shape) * np.sqrt(model_vars)
         #model_means = ensemble_model_means[model_idxes, batch_idxes]
         #model_stds = ensemble_model_stds[model_idxes, batch_idxes]
 
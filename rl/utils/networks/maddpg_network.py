@@ -64,6 +64,89 @@ class DoubleQNetworkCritic(nn.Module):
 
         return q1
 
+class PermutationInvariantCritic(nn.Module):
+    indexed_agents = True #forward接受agent_index参数，参数共享时由AgentConditionedNetwork传入智能体编号
+
+    def __init__(self, state_dims:list, action_dims:list, hidden_dim=64, aggregation="attention"):
+        '''
+        置换不变的中心化评判家网络，所有智能体的(状态, 动作)经过同一个编码器后以注意力或平均池化聚合，
+        参数数量与智能体数量无关，同一组参数可以评估不同智能体数量的场景，智能体数量在前向运算时由动作的维数得到
+        :param state_dims: 各智能体的状态维数，参数共享模式下末尾附加的嵌入向量维数作为条件输入
+        :param action_dims: 各智能体的动作维数
+        :param aggregation: 聚合方式，attention或mean
+        '''
+        super(PermutationInvariantCritic, self).__init__()
+        agent_count = len(action_dims)
+        if len(set(action_dims)) != 1 or len(set(state_dims[:agent_count])) != 1:
+            raise Exception("置换不变的评判家网络要求所有智能体的状态与动作空间相同!")
+        if aggregation not in ("attention", "mean"):
+            raise Exception("不支持的聚合方式{}!".format(aggregation))
+        self.state_dim = state_dims[0]
+        self.action_dim = action_dims[0]
+        self.condition_dim = sum(state_dims) - self.state_dim * agent_count
+        self.hidden_dim = hidden_dim
+        self.aggregation = aggregation
+        self.agent_index = None #评估的智能体编号，为None时以所有智能体编码的平均值代替自身的编码
+
+        self.encoder1 = nn.Linear(self.state_dim + self.action_dim, hidden_dim)
+        self.encoder2 = nn.Linear(hidden_dim, hidden_dim)
+        if aggregation == "attention":
+            self.query = nn.Linear(hidden_dim, hidden_dim)
+            self.key = nn.Linear(hidden_dim, hidden_dim)
+            self.value = nn.Linear(hidden_dim, hidden_dim)
+        self.layer1 = nn.Linear(hidden_dim * 2 + self.condition_dim, hidden_dim)
+        self.out_layer = nn.Linear(hidden_dim, 1)
+        self.no_linear = F.relu
+        self.apply(weights_init_)
+
+    def forward(self, state, action, agent_index=None):
+        '''
+        :param state: 所有智能体的状态拼接(以及条件输入) Tensor [batch, n * state_dim + condition_dim]
+        :param action: 所有智能体的动作拼接 Tensor [batch, n * action_dim]
+        :param agent_index: 评估的智能体编号(int或每个样本的LongTensor)，为None时使用self.agent_index
+        '''
+        agent_index = self.agent_index if agent_index is None else agent_index
+        batch = state.shape[0]
+        n = action.shape[1] // self.action_dim
+        per_agent = torch.cat([state[:, :n * self.state_dim].reshape(batch, n, self.state_dim),
+                               action.reshape(batch, n, self.action_dim)], dim=2)
+        h = self.no_linear(self.encoder2(self.no_linear(self.encoder1(per_agent)))) # [batch, n, hidden]
+        if agent_index is None:
+            own = h.mean(dim=1)
+        elif torch.is_tensor(agent_index):
+            own = h[torch.arange(batch, device=h.device), agent_index]
+        else:
+            own = h[:, int(agent_index)]
+        if self.aggregation == "attention":
+            score = (self.query(own).unsqueeze(1) * self.key(h)).sum(dim=2) / math.sqrt(self.hidden_dim)
+            weight = F.softmax(score, dim=1).unsqueeze(2)
+            context = (weight * self.value(h)).sum(dim=1)
+        else:
+            context = h.mean(dim=1)
+        temp = torch.cat([own, context, state[:, n * self.state_dim:]], dim=1)
+        h1 = self.no_linear(self.layer1(temp))
+        return torch.squeeze(self.out_layer(h1))
+
+class DoubleQPermutationInvariantCritic(nn.Module):
+    indexed_agents = True
+
+    def __init__(self, state_dims:list, action_dims:list, hidden_dim=64, aggregation="attention"):
+        '''
+        双Q版本的置换不变评判家网络，两个Q网络各自使用独立的编码器
+        '''
+        super(DoubleQPermutationInvariantCritic, self).__init__()
+        self.q1 = PermutationInvariantCritic(state_dims, action_dims, hidden_dim, aggregation)
+        self.q2 = PermutationInvariantCritic(state_dims, action_dims, hidden_dim, aggregation)
+        self.agent_index = None
+
+    def forward(self, state, action, agent_index=None):
+        agent_index = self.agent_index if agent_index is None else agent_index
+        return self.q1(state, action, agent_index), self.q2(state, action, agent_index)
+
+    def Q1(self, state, action, agent_index=None):
+        agent_index = self.agent_index if agent_index is None else agent_index
+        return self.q1(state, action, agent_index)
+
 class MLPNetworkActor(nn.Module):
     def __init__(self, state_dim, action_dim, discrete, hidden_dim = 64, norm_in = True):
         '''
@@ -102,6 +185,49 @@ class MLPNetworkActor(nn.Module):
         action = self.out_fc(self.fc3(x))
         return action
 
+class AgentConditionedNetwork(nn.Module):
+    def __init__(self, network:nn.Module, agent_count, embed_dim=8):
+        '''
+        所有智能体共享的网络，智能体编号的嵌入向量拼接在第一个输入(状态)之后
+        :param network: 被共享的网络，其状态输入维数需要包含embed_dim
+        :param agent_count: 智能体数量
+        :param embed_dim: 智能体编号嵌入向量的维数
+        '''
+        super(AgentConditionedNetwork, self).__init__()
+        self.network = network
+        self.embedding = nn.Embedding(agent_count, embed_dim)
+
+    def _condition(self, x, agent_idx):
+        if not torch.is_tensor(agent_idx):
+            agent_idx = torch.full([x.shape[0]], int(agent_idx), dtype=torch.long, device=x.device)
+        return torch.cat([x, self.embedding(agent_idx)], dim=-1)
+
+    def _kwargs(self, agent_idx):
+        # 置换不变的评判家网络还需要知道评估的是哪一个智能体
+        return {"agent_index": agent_idx} if getattr(self.network, "indexed_agents", False) else {}
+
+    def forward(self, x, *args, agent_idx=0):
+        return self.network(self._condition(x, agent_idx), *args, **self._kwargs(agent_idx))
+
+    def Q1(self, x, *args, agent_idx=0):
+        return self.network.Q1(self._condition(x, agent_idx), *args, **self._kwargs(agent_idx))
+
+class AgentView(nn.Module):
+    def __init__(self, shared:AgentConditionedNetwork, agent_idx):
+        '''
+        共享网络在某个智能体(或一批智能体编号)上的视图，调用方式与原先每个智能体独立的网络相同
+        :param agent_idx: 智能体编号(int)或每个样本对应的智能体编号(LongTensor)
+        '''
+        super(AgentView, self).__init__()
+        self.shared = shared
+        self.agent_idx = agent_idx
+
+    def forward(self, x, *args):
+        return self.shared(x, *args, agent_idx=self.agent_idx)
+
+    def Q1(self, x, *args):
+        return self.shared.Q1(x, *args, agent_idx=self.agent_idx)
+
 class MLPModelNetwork(nn.Module):
     def __init__(self, state_dims:List[int], action_dims:List[int], hidden_dim):
         super(MLPModelNetwork, self).__init__()
@@ -0,0 +1,167 @@
+'''
+独立的策略评估程序，只依赖torch、numpy与ped_env，不导入任何训练代码。
+加载rl/utils/export.py导出的策略包，在一个或一批环境中运行确定性策略并输出评估指标：
+
+python -m rl.utils.policy_runner --bundle policy.pt --episodes 10 --envs 4 --out metrics.json
+'''
+import argparse
+import json
+import time
+
+import numpy as np
+
+POLICY_META_FILE = "policy.json"
+
+
+def load_policy(file, device="cpu"):
+    '''
+    :return: (TorchScript模块, 元数据dict)
+    '''
+    import torch # 只在加载策略的进程中导入torch，推理服务的客户端进程不需要
+    extra = {POLICY_META_FILE: ""}
+    module = torch.jit.load(file, map_location=device, _extra_files=extra)
+    return module.eval(), json.loads(extra[POLICY_META_FILE])
+
+
+def make_env(meta, train_mode=False):
+    '''
+    根据策略包中记录的参数重新创建PedsMoveEnv
+    '''
+    if meta.get("name") != "PedsMoveEnv":
+        raise Exception("只能根据元数据创建PedsMoveEnv，{}需要自行创建!".format(meta.get("name")))
+    from ped_env.envs import PedsMoveEnv
+    from ped_env.utils.maps import get_map
+    return PedsMoveEnv(terrain=get_map(meta["map"]), person_num=meta["person_num"], group_size=tuple(meta["group_size"]),
+                       discrete=meta["discrete"], frame_skipping=meta["frame_skipping"], maxStep=meta["maxStep"],
+                       use_planner=meta["use_planner"], random_init_mode=meta["random_init_mode"], train_mode=train_mode)
+
+
+class PolicyRunner:
+    '''
+    使用导出的策略包为一个或一批环境计算动作，所有环境的观测合并为一次前向运算
+    '''
+    def __init__(self, file, device="cpu", num_threads=None):
+        '''
+        :param file: 策略包文件
+        :param num_threads: torch使用的线程数，为None时不改变
+        '''
+        import torch
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.device = torch.device(device)
+        self.module, meta = load_policy(file, self.device)
+        self._set_meta(meta)
+
+    def _set_meta(self, meta):
+        self.meta = meta
+        self.state_dims = self.meta["state_dims"]
+        self.action_dims = self.meta["action_dims"]
+        self.action_splits = np.cumsum(self.action_dims)[:-1]
+
+    def _flatten(self, obs):
+        return np.concatenate([np.asarray(o, dtype=np.float32).reshape(-1) for o in obs])
+
+    def forward(self, obs):
+        '''
+        :param obs: 拼接后的观测 float32数组 [N, sum(state_dims)]
+        :return: 拼接后的动作 float32数组 [N, sum(action_dims)]
+        '''
+        import torch
+        with torch.no_grad():
+            return self.module(torch.from_numpy(obs).to(self.device)).cpu().numpy()
+
+    def act_batch(self, obs_batch):
+        '''
+        :param obs_batch: 每个环境的观测(各智能体观测的列表)组成的列表
+        :return: 每个环境的动作，各智能体动作维数相同时为数组 [N, agent_count, action_dim]，否则为列表
+        '''
+        actions = self.forward(np.stack([self._flatten(obs) for obs in obs_batch]))
+        if len(set(self.action_dims)) == 1:
+            return actions.reshape(actions.shape[0], len(self.action_dims), self.action_dims[0])
+        return [np.split(a, self.action_splits) for a in actions]
+
+    def act(self, obs):
+        return self.act_batch([obs])[0]
+
+    def evaluate(self, envs, episodes=1):
+        '''
+        在一批环境中同时运行共episodes个episode，每一步所有未结束的环境合并为一次前向运算
+        :param envs: 环境列表
+        :return: 每个episode的评估指标列表
+        '''
+        results = []
+        started = min(len(envs), episodes)
+        states = [env.reset() for env in envs[:started]]
+        stats = [self._new_stats() for _ in range(started)]
+        active = list(range(started))
+        while len(active) > 0:
+            actions = self.act_batch([states[k] for k in active])
+            still_active = []
+            for k, action in zip(active, actions):
+                obs, reward, is_done, info = envs[k].step(action)
+                self._update_stats(stats[k], reward, info)
+                if np.any(is_done):
+                    results.append(self._finish_stats(stats[k], envs[k]))
+                    if started < episodes:
+                        started += 1
+                        states[k], stats[k] = envs[k].reset(), self._new_stats()
+                        still_active.append(k)
+                    continue
+                states[k] = obs
+                still_active.append(k)
+            active = still_active
+        return results
+
+    def _new_stats(self):
+        return {"steps": 0, "reward": 0.0, "start_time": time.time(), "info": None}
+
+    def _update_stats(self, stats, reward, info):
+        stats["steps"] += 1
+        stats["reward"] += float(np.mean(reward))
+        stats["info"] = info
+
+    def _finish_stats(self, stats, env):
+        result = {"steps": stats["steps"], "reward": stats["reward"], "wall_time": time.time() - stats["start_time"]}
+        info = stats["info"]
+        if hasattr(env, "terrain") and isinstance(info, list) and len(info) >= 3:
+            # PedsMoveEnv的info：[各leader到达出口的步数, 与墙的碰撞次数, 行人之间的碰撞次数, ...]
+            result.update({"evacuation_step": int(env.step_in_env), "leader_exit_step": [int(x) for x in info[0]],
+                           "collision_wall_agent": int(info[1]), "collision_agent_agent": int(info[2])})
+        return result
+
+
+def summarize(results):
+    '''
+    各项数值指标在所有episode上的均值
+    '''
+    keys = [key for key, value in results[0].items() if isinstance(value, (int, float))] if len(results) > 0 else []
+    return {key: float(np.mean([result[key] for result in results])) for key in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate an exported policy bundle without the training code!")
+    parser.add_argument('--bundle', default="", type=str)
+    parser.add_argument('--episodes', default=5, type=int)
+    parser.add_argument('--envs', default=1, type=int) #同时运行的环境数，各环境的观测合并为一次前向运算
+    parser.add_argument('--threads', default=None, type=int)
+    parser.add_argument('--out', default="", type=str) #不为空时将评估指标保存为json文件
+    parser.add_argument('--socket', default="", type=str) #不为空时从该地址上的推理服务获取动作，此时不需要--bundle
+    args = parser.parse_args()
+
+    if args.socket != "":
+        from rl.utils.policy_server import PolicyClient
+        runner = PolicyClient(args.socket)
+    else:
+        runner = PolicyRunner(args.bundle, num_threads=args.threads)
+    envs = [make_env(runner.meta["env"]) for _ in range(min(args.envs, args.episodes))]
+    results = runner.evaluate(envs, args.episodes)
+    for env in envs:
+        env.close()
+    summary = summarize(results)
+    print(json.dumps(summary, indent=2))
+    if args.out != "":
+        with open(args.out, "w") as f:
+            json.dump({"summary": summary, "episodes": results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+'''
+本地的批量策略推理服务：只加载一次导出的策略包，通过Unix socket接收多个客户端进程(SubprocEnv的工作进程、
+调度器中并行的评估任务等)发来的观测，在一个很短的等待时间内把多个请求合并为一次前向运算后返回各自的动作，
+同时统计队列长度、批大小与请求延迟。
+
+python -m rl.utils.policy_server --bundle policy.pt --socket /tmp/policy.sock --max_delay_ms 2
+'''
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from rl.utils.policy_runner import PolicyRunner
+
+# 消息头：(消息类型, 行数, 列数)，推理请求与结果的数据为float32数组，其余消息的数据为utf-8编码的json，长度记录在行数中
+HEADER = struct.Struct("!BII")
+MSG_INFER, MSG_STATS, MSG_META, MSG_ERROR = 0, 1, 2, 255
+
+
+def _recv_exact(conn, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("连接已关闭!")
+        data += chunk
+    return bytes(data)
+
+
+def send_message(conn, kind, payload):
+    '''
+    :param payload: 推理消息为二维float32数组，其余消息为可以json序列化的对象或错误信息字符串
+    '''
+    if kind == MSG_INFER:
+        payload = np.ascontiguousarray(payload, dtype="<f4")
+        conn.sendall(HEADER.pack(kind, payload.shape[0], payload.shape[1]) + payload.tobytes())
+    else:
+        data = (payload if kind == MSG_ERROR else json.dumps(payload)).encode("utf-8")
+        conn.sendall(HEADER.pack(kind, len(data), 0) + data)
+
+
+def recv_message(conn):
+    kind, rows, cols = HEADER.unpack(_recv_exact(conn, HEADER.size))
+    if kind == MSG_INFER:
+        return kind, np.frombuffer(_recv_exact(conn, rows * cols * 4), dtype="<f4").reshape(rows, cols)
+    data = _recv_exact(conn, rows).decode("utf-8")
+    return kind, (data if kind == MSG_ERROR else json.loads(data))
+
+
+class _Request:
+    def __init__(self, obs):
+        self.obs = obs
+        self.time = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PolicyServer:
+    '''
+    动态批处理的策略推理服务，每个连接由一个线程负责收发，所有请求进入同一个队列，
+    由批处理线程在max_delay秒内尽量凑够max_batch行观测后进行一次前向运算
+    '''
+    def __init__(self, file, socket_path, max_batch=4096, max_delay=0.002, device="cpu", num_threads=None,
+                 latency_window=10000):
+        '''
+        :param file: 策略包文件
+        :param socket_path: Unix socket的路径
+        :param max_batch: 一次前向运算最多包含的观测行数，单个请求超过该值时单独处理
+        :param max_delay: 第一个请求到达后最多等待其他请求的时间(秒)
+        :param latency_window: 统计延迟时保留的最近请求数
+        '''
+        self.runner = PolicyRunner(file, device, num_threads)
+        self.obs_dim = sum(self.runner.state_dims)
+        self.socket_path = socket_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.pending = None #超出上一批容量而留到下一批的请求
+        self.running = False
+        self.listener = None
+        self.threads = []
+        self.connections = {} #连接 -> 负责该连接的线程
+
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = deque(maxlen=latency_window)
+        self.request_count = 0
+        self.batch_count = 0
+        self.max_queue_depth = 0
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(128)
+        self.listener.settimeout(0.5) #定期检查服务是否已经关闭
+        self.running = True
+        for target in (self._accept_loop, self._batch_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def serve_forever(self):
+        if not self.running:
+            self.start()
+        try:
+            while self.running:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+        self.close()
+
+    def close(self):
+        '''
+        停止服务：批处理线程结束后，队列中尚未处理的请求以错误返回，再关闭所有客户端连接并等待其线程结束
+        '''
+        with self.lock: #之后submit不会再有请求进入队列
+            if not self.running:
+                return
+            self.running = False
+        for thread in self.threads:
+            thread.join()
+        self.listener.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        while True:
+            try:
+                request = self._next_request(0.0)
+            except queue.Empty:
+                break
+            request.error = "推理服务已关闭!"
+            request.done.set()
+        with self.lock:
+            connections = list(self.connections.items())
+        for conn, thread in connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            thread.join()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                conn, _ = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.settimeout(None)
+            thread = threading.Thread(target=self._serve_connection, args=(conn,), daemon=True)
+            with self.lock:
+                self.connections[conn] = thread
+            thread.start()
+
+    def _serve_connection(self, conn):
+        try:
+            with conn:
+                self._handle_messages(conn)
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self.lock:
+                self.connections.pop(conn, None)
+
+    def _handle_messages(self, conn):
+        while self.running:
+            kind, payload = recv_message(conn)
+            if kind == MSG_INFER:
+                if payload.shape[1] != self.obs_dim:
+                    send_message(conn, MSG_ERROR, "观测的维数{}与策略的输入维数{}不一致!".format(payload.shape[1], self.obs_dim))
+                    continue
+                request = self.submit(payload)
+                request.done.wait()
+                if request.error is not None:
+                    send_message(conn, MSG_ERROR, request.error)
+                else:
+                    send_message(conn, MSG_INFER, request.result)
+            elif kind == MSG_STATS:
+                send_message(conn, MSG_STATS, self.stats())
+            elif kind == MSG_META:
+                send_message(conn, MSG_META, self.runner.meta)
+            else:
+                send_message(conn, MSG_ERROR, "未知的消息类型{}!".format(kind))
+
+    def submit(self, obs):
+        '''
+        将一批观测加入队列，返回的请求在完成后其done被设置
+        '''
+        request = _Request(obs)
+        with self.lock:
+            if not self.running:
+                request.error = "推理服务已关闭!"
+                request.done.set()
+                return request
+            self.requests.put(request)
+            self.max_queue_depth = max(self.max_queue_depth, self.requests.qsize())
+        return request
+
+    def _next_request(self, timeout):
+        if self.pending is not None:
+            request, self.pending = self.pending, None
+            return request
+        return self.requests.get(timeout=timeout)
+
+    def _collect_batch(self):
+        batch = [self._next_request(0.1)]
+        rows = batch[0].obs.shape[0]
+        deadline = batch[0].time + self.max_delay
+        while rows < self.max_batch:
+            try:
+                request = self.requests.get(timeout=max(deadline - time.time(), 0.0))
+            except queue.Empty:
+                break
+            if rows + request.obs.shape[0] > self.max_batch:
+                self.pending = request
+                break
+            batch.append(request)
+            rows += request.obs.shape[0]
+        return batch, rows
+
+    def _batch_loop(self):
+        while self.running:
+            try:
+                batch, rows = self._collect_batch()
+            except queue.Empty:
+                continue
+            try:
+                actions = self.runner.forward(np.concatenate([request.obs for request in batch]))
+                results = np.split(actions, np.cumsum([request.obs.shape[0] for request in batch])[:-1])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = "推理失败:{}!".format(e)
+            now = time.time()
+            with self.lock:
+                self.batch_count += 1
+                self.request_count += len(batch)
+                self.batch_sizes.append(rows)
+                self.latencies.extend(now - request.time for request in batch)
+            for request in batch:
+                request.done.set()
+
+    def stats(self):
+        '''
+        :return: 队列长度、批大小与最近请求延迟(毫秒)的统计
+        '''
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000.0
+            stats = {
+                "queue_depth": self.requests.qsize() + (self.pending is not None),
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.request_count,
+                "batches": self.batch_count,
+                "mean_batch_rows": float(np.mean(self.batch_sizes)) if len(self.batch_sizes) > 0 else 0.0,
+            }
+        if len(latencies) > 0:
+            stats.update({"latency_mean_ms": float(latencies.mean()),
+                          "latency_p50_ms": float(np.percentile(latencies, 50)),
+                          "latency_p99_ms": float(np.percentile(latencies, 99))})
+        return stats
+
+
+class PolicyClient(PolicyRunner):
+    '''
+    推理服务的客户端，接口与PolicyRunner相同(act、act_batch与evaluate)，但不加载网络也不导入torch
+    '''
+    def __init__(self, socket_path, timeout=None):
+        self.conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.conn.settimeout(timeout)
+        self.conn.connect(socket_path)
+        self._set_meta(self._request(MSG_META, None))
+
+    def _request(self, kind, payload):
+        send_message(self.conn, kind, payload)
+        reply_kind, reply = recv_message(self.conn)
+        if reply_kind == MSG_ERROR:
+            raise Exception(reply)
+        return reply
+
+    def forward(self, obs):
+        return self._request(MSG_INFER, obs)
+
+    def stats(self):
+        return self._request(MSG_STATS, None)
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve an exported policy bundle to local clients over a Unix socket!")
+    parser.add_argument('--bundle', required=True, type=str)
+    parser.add_argument('--socket', default="/tmp/policy.sock", type=str)
+    parser.add_argument('--max_batch', default=4096, type=int)
+    parser.add_argument('--max_delay_ms', default=2.0, type=float) #第一个请求到达后等待其他请求的最长时间
+    parser.add_argument('--threads', default=None, type=int)
+    args = parser.parse_args()
+
+    server = PolicyServer(args.bundle, args.socket, args.max_batch, args.max_delay_ms / 1000.0,
+                          num_threads=args.threads)
+    print("策略推理服务已启动:{}".format(args.socket))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
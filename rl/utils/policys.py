@@ -8,11 +8,14 @@ from gym import Env
 from torch import nn
 
 from rl.utils.functions import get_dict
+from rl.utils.tabular import TabularQ
 
 def greedy_policy(A, s, Q, epsilon = None):
     """在给定一个状态下，从行为空间A中选择一个行为a，使得Q(s,a) = max(Q(s,))
     考虑到多个行为价值相同的情况返回一个随机行为
     """
+    if isinstance(Q, TabularQ):
+        return Q.greedy(s)
     max_q, a_max_q = -float('inf'), []
     for a_opt in A:
         q = get_dict(Q, s, a_opt)
@@ -0,0 +1,230 @@
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from rl.utils.classes import CloudpickleWrapper
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+SPEC_FILE = "sweep_spec.json"
+STATE_FILE = "sweep_state.json"
+RESULT_FILE = "job_result.json"
+INDEX_FILE = "results_index"
+
+# 扫描配置中各个维度的名称与对应的单个任务中的参数名
+SWEEP_AXES = (("algorithms", "algorithm"), ("maps", "map"), ("p_nums", "p_num"), ("g_sizes", "g_size"),
+              ("seeds", "seed"))
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory():
+    '''
+    当前系统可用的内存(字节)，无法获取时返回None
+    '''
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def dump_json_atomic(obj, file):
+    # 先写入临时文件再重命名，避免中断时留下不完整的文件
+    tmp = file + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, file)
+
+
+def expand_sweep(spec):
+    '''
+    将扫描配置展开为任务列表
+    :param spec: 形如{"algorithms": [...], "maps": [...], "p_nums": [...], "g_sizes": [...], "seeds": [...],
+        "common": {...}}的字典，common中为所有任务共用的参数，除algorithms外的维度缺省时使用common中的值
+    :return: 任务列表，每个任务为一个包含id的参数字典
+    '''
+    if len(spec.get("algorithms", [])) == 0:
+        raise Exception("扫描配置中缺少algorithms!")
+    keys = [name for _, name in SWEEP_AXES]
+    values = [spec.get(key, [None]) for key, _ in SWEEP_AXES]
+    jobs = []
+    for combination in itertools.product(*values):
+        job = dict(spec.get("common", {}))
+        job.update({key: value for key, value in zip(keys, combination) if value is not None})
+        job["id"] = "_".join(str(job[key]) for key in keys if key in job)
+        jobs.append(job)
+    return jobs
+
+
+def _job_entry(job_fn_wrapper, job, job_dir, num_threads, lock):
+    result = {"id": job["id"], "start_time": time.time()}
+    try:
+        result.update(job_fn_wrapper.x(job, job_dir, num_threads, lock) or {})
+        result["status"] = JOB_DONE
+    except BaseException:
+        result["status"] = JOB_FAILED
+        result["error"] = traceback.format_exc()
+    result["end_time"] = time.time()
+    dump_json_atomic(result, os.path.join(job_dir, RESULT_FILE))
+    if result["status"] == JOB_FAILED:
+        print(result["error"])
+        os._exit(1)
+
+
+class ExperimentScheduler:
+    '''
+    本地实验调度器，按照CPU核数与可用内存确定同时运行的任务数，在有界的进程池中依次运行扫描中的所有任务，
+    每个任务结束后将进度写入sweep_state.json，中断后重新运行同一扫描时会跳过已经完成的任务，
+    所有任务的结果汇总在results_index.json/csv中
+    '''
+    def __init__(self, job_fn, spec, sweep_dir, procs_per_job=1, mem_per_job=2.0, max_workers=0,
+                 retry_failed=False, poll_interval=1.0):
+        '''
+        :param job_fn: 任务函数，形如job_fn(job, job_dir, num_threads, lock)，返回写入结果索引的字典
+        :param spec: 扫描配置，见expand_sweep
+        :param sweep_dir: 扫描的保存目录，每个任务保存在以其id命名的子目录中
+        :param procs_per_job: 每个任务占用的进程(核)数，包括任务内部的环境子进程
+        :param mem_per_job: 每个任务预计占用的内存(GB)
+        :param max_workers: 同时运行的最大任务数，为0时根据资源自动确定
+        :param retry_failed: 是否重新运行之前失败的任务
+        :param poll_interval: 检查任务状态的时间间隔(秒)
+        '''
+        self.job_fn = job_fn
+        self.spec = spec
+        self.sweep_dir = sweep_dir
+        self.procs_per_job = max(int(procs_per_job), 1)
+        self.poll_interval = poll_interval
+        self.jobs = expand_sweep(spec)
+        if len(set(job["id"] for job in self.jobs)) != len(self.jobs):
+            raise Exception("扫描配置中存在重复的任务!")
+
+        workers = max(available_cpus() // self.procs_per_job, 1)
+        memory = available_memory()
+        if memory is not None:
+            workers = min(workers, max(int(memory // (mem_per_job * 1024 ** 3)), 1))
+        if max_workers > 0:
+            workers = min(workers, max_workers)
+        self.max_workers = min(workers, len(self.jobs))
+        # 每个任务中torch使用的线程数，避免多个任务同时运行时线程数超过核数
+        self.num_threads = max(available_cpus() // (self.max_workers * self.procs_per_job), 1)
+
+        os.makedirs(sweep_dir, exist_ok=True)
+        self.state = self._load_state(retry_failed)
+
+    def _load_state(self, retry_failed):
+        file = os.path.join(self.sweep_dir, STATE_FILE)
+        old_state = {}
+        if os.path.exists(file):
+            with open(file) as f:
+                old_state = json.load(f)
+        state = {}
+        for job in self.jobs:
+            entry = old_state.get(job["id"], {})
+            if entry.get("params") != job:  # 参数发生变化的任务需要重新运行
+                entry = {}
+            status = entry.get("status", JOB_PENDING)
+            # 上次中断时仍在运行的任务与需要重试的失败任务重新排队
+            if status == JOB_RUNNING or (status == JOB_FAILED and retry_failed):
+                status = JOB_PENDING
+            entry.update({"params": job, "status": status, "job_dir": os.path.join(self.sweep_dir, job["id"])})
+            state[job["id"]] = entry
+        return state
+
+    def _save_state(self):
+        dump_json_atomic(self.spec, os.path.join(self.sweep_dir, SPEC_FILE))
+        dump_json_atomic(self.state, os.path.join(self.sweep_dir, STATE_FILE))
+        self._write_index()
+
+    def _write_index(self):
+        rows = []
+        for job_id, entry in self.state.items():
+            row = dict(entry["params"])
+            row.update({key: value for key, value in entry.items() if key not in ("params", "error")})
+            rows.append(row)
+        dump_json_atomic(rows, os.path.join(self.sweep_dir, INDEX_FILE + ".json"))
+        fields = []
+        for row in rows:
+            fields.extend(key for key in row if key not in fields)
+        tmp = os.path.join(self.sweep_dir, INDEX_FILE + ".csv.tmp")
+        with open(tmp, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp, os.path.join(self.sweep_dir, INDEX_FILE + ".csv"))
+
+    def _launch(self, ctx, job, lock):
+        entry = self.state[job["id"]]
+        for key in [key for key in entry if key not in ("params", "status", "job_dir")]:
+            del entry[key]  # 清除上一次运行留下的结果
+        os.makedirs(entry["job_dir"], exist_ok=True)
+        result_file = os.path.join(entry["job_dir"], RESULT_FILE)
+        if os.path.exists(result_file):
+            os.remove(result_file)
+        # 任务内部还会创建环境子进程，因此任务进程不能是守护进程
+        p = ctx.Process(target=_job_entry, args=(CloudpickleWrapper(self.job_fn), job, entry["job_dir"],
+                                                 self.num_threads, lock))
+        p.start()
+        entry["status"] = JOB_RUNNING
+        self._save_state()
+        return p
+
+    def _finish(self, job_id, p):
+        entry = self.state[job_id]
+        result_file = os.path.join(entry["job_dir"], RESULT_FILE)
+        if os.path.exists(result_file):
+            with open(result_file) as f:
+                entry.update(json.load(f))
+            entry["duration"] = entry["end_time"] - entry["start_time"]
+        else:
+            entry["status"] = JOB_FAILED
+            entry["error"] = "任务进程异常退出，退出码为{}".format(p.exitcode)
+        self._save_state()
+        print("任务{}结束，状态:{}".format(job_id, entry["status"]))
+
+    def run(self):
+        '''
+        运行所有未完成的任务，直到全部结束
+        :return: 各个任务的状态字典
+        '''
+        pending = [job for job in self.jobs if self.state[job["id"]]["status"] == JOB_PENDING]
+        print("共{}个任务，待运行{}个，同时运行{}个，每个任务使用{}个torch线程".format(
+            len(self.jobs), len(pending), self.max_workers, self.num_threads))
+        ctx = multiprocessing.get_context("spawn")
+        lock = ctx.Lock()
+        running = {}
+        try:
+            while len(pending) > 0 or len(running) > 0:
+                while len(pending) > 0 and len(running) < self.max_workers:
+                    job = pending.pop(0)
+                    running[job["id"]] = self._launch(ctx, job, lock)
+                for job_id, p in list(running.items()):
+                    if not p.is_alive():
+                        p.join()
+                        self._finish(job_id, p)
+                        del running[job_id]
+                time.sleep(self.poll_interval)
+        finally:
+            for p in running.values():
+                if p.is_alive():
+                    p.terminate()
+                p.join()
+            self._save_state()
+        return self.state
@@ -0,0 +1,194 @@
+import os
+import random
+
+import numpy as np
+from gym.spaces import Discrete
+
+
+def _hash_key(s):
+    '''
+    不可枚举的状态转换为可哈希的键
+    '''
+    if isinstance(s, np.ndarray):
+        return s.dtype.str, s.shape, s.tobytes()
+    if isinstance(s, (list, tuple)):
+        return tuple(_hash_key(x) for x in s)
+    return s
+
+
+class EligibilityTraces:
+    '''
+    稀疏的资格迹，只记录值不为0的(状态编号, 动作编号)对，衰减到threshold以下的资格迹被丢弃，
+    每一步的更新只对这些活跃的对进行一次向量化的计算，与状态与动作的总数无关
+    '''
+    def __init__(self, n_actions, threshold=1e-5):
+        self.n_actions = int(n_actions)
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.position = {}  # 状态编号 * n_actions + 动作编号 -> 在数组中的位置
+        self.rows = np.zeros([0], dtype=int)
+        self.actions = np.zeros([0], dtype=int)
+        self.values = np.zeros([0])
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def visit(self, row, a, replacing=False):
+        '''
+        访问(row, a)时增加其资格迹，replacing为True时将其置为1
+        '''
+        a = int(a)
+        key = row * self.n_actions + a
+        pos = self.position.get(key)
+        if pos is None:
+            self.position[key] = len(self)
+            self.rows = np.append(self.rows, row)
+            self.actions = np.append(self.actions, a)
+            self.values = np.append(self.values, 1.0)
+        elif replacing:
+            self.values[pos] = 1.0
+        else:
+            self.values[pos] += 1.0
+
+    def apply(self, table, step):
+        '''
+        table[s, a] += step * e(s, a)，只更新活跃的对
+        '''
+        table[self.rows, self.actions] += step * self.values
+
+    def decay(self, factor):
+        self.values *= factor
+        keep = np.abs(self.values) >= self.threshold
+        if not keep.all():
+            self.rows, self.actions, self.values = self.rows[keep], self.actions[keep], self.values[keep]
+            self.position = {key: pos for pos, key in enumerate((self.rows * self.n_actions + self.actions).tolist())}
+
+
+class TabularQ:
+    '''
+    表格型行为价值函数，Q(s,a)存储在以(状态编号, 动作编号)索引的稠密数组中，
+    观测空间为Discrete时状态本身就是编号，否则通过哈希表为每个新出现的状态分配编号，数组按需扩大；
+    traces为True时同时记录稀疏的资格迹
+    '''
+    def __init__(self, n_actions, n_states=None, traces=False, init_capacity=1024, trace_threshold=1e-5):
+        '''
+        :param n_actions: 动作数
+        :param n_states: 状态数，为None时使用哈希表为状态分配编号
+        :param traces: 是否同时记录资格迹
+        :param init_capacity: 使用哈希表时数组的初始行数
+        :param trace_threshold: 资格迹衰减到该值以下时被丢弃
+        '''
+        self.n_actions = int(n_actions)
+        self.n_states = n_states
+        self.index = None if n_states is not None else {}
+        rows = int(n_states) if n_states is not None else int(init_capacity)
+        self.values = np.zeros([rows, self.n_actions])
+        self.traces = EligibilityTraces(self.n_actions, trace_threshold) if traces else None
+
+    @classmethod
+    def from_spaces(cls, obs_space, action_space, traces=False):
+        if type(action_space) is not Discrete:
+            raise Exception("表格型价值函数只能处理动作空间为Discrete的智能体!")
+        n_states = obs_space.n if type(obs_space) is Discrete else None
+        return cls(action_space.n, n_states, traces)
+
+    def __len__(self):
+        return self.values.shape[0] if self.index is None else len(self.index)
+
+    def _grow(self, rows):
+        size = max(rows, self.values.shape[0] * 2)
+        self.values = np.concatenate([self.values, np.zeros([size - self.values.shape[0], self.n_actions])])
+
+    def state_index(self, s, create=True):
+        '''
+        状态对应的行号，使用哈希表且状态未出现过时，create为False则返回None
+        '''
+        if self.index is None:
+            return int(s)
+        key = _hash_key(s)
+        idx = self.index.get(key)
+        if idx is None and create:
+            idx = len(self.index)
+            if idx >= self.values.shape[0]:
+                self._grow(idx + 1)
+            self.index[key] = idx
+        return idx
+
+    def get(self, s, a):
+        idx = self.state_index(s, False)
+        return 0.0 if idx is None else self.values[idx, int(a)]
+
+    def set(self, s, a, value):
+        idx = self.state_index(s) #可能扩大数组，需要在取出self.values之前计算
+        self.values[idx, int(a)] = value
+
+    def row(self, s):
+        idx = self.state_index(s, False)
+        return np.zeros([self.n_actions]) if idx is None else self.values[idx]
+
+    def greedy(self, s):
+        '''
+        价值最大的动作，多个动作价值相同时随机选择其中一个
+        '''
+        q = self.row(s)
+        return int(random.choice(np.flatnonzero(q == q.max())))
+
+    def epsilon_greedy(self, s, epsilon=0.05):
+        if random.random() < epsilon:
+            return random.randrange(self.n_actions)
+        return self.greedy(s)
+
+    def greedy_batch(self, states):
+        '''
+        一批状态下的贪婪动作 [N]，价值相同的动作之间随机选择
+        '''
+        if self.index is None:
+            q = self.values[np.asarray(states, dtype=int)]
+        else:
+            q = np.stack([self.row(s) for s in states])
+        best = q == q.max(axis=1, keepdims=True)
+        return np.argmax(best * np.random.rand(*q.shape), axis=1)
+
+    def epsilon_greedy_batch(self, states, epsilon=0.05):
+        actions = self.greedy_batch(states)
+        explore = np.random.rand(actions.shape[0]) < epsilon
+        actions[explore] = np.random.randint(0, self.n_actions, size=int(explore.sum()))
+        return actions
+
+    def reset_traces(self):
+        self.traces.reset()
+
+    def update_traces(self, s, a, step, decay):
+        '''
+        SARSA(λ)的一步更新：增加(s, a)的资格迹，对所有活跃的对进行Q += step * e，再将资格迹乘以decay
+        '''
+        self.traces.visit(self.state_index(s), a)
+        self.traces.apply(self.values, step)
+        self.traces.decay(decay)
+
+    def save(self, file):
+        '''
+        以.npy格式保存价值数组，使用哈希表时状态的键保存在同名的_keys.npy文件中
+        '''
+        np.save(file, self.values[:len(self)])
+        if self.index is not None:
+            keys = np.empty([len(self.index)], dtype=object)
+            for key, idx in self.index.items():
+                keys[idx] = key
+            np.save(os.path.splitext(file)[0] + "_keys.npy", keys, allow_pickle=True)
+        return file
+
+    @classmethod
+    def load(cls, file):
+        values = np.load(file)
+        keys_file = os.path.splitext(file)[0] + "_keys.npy"
+        if not os.path.exists(keys_file):
+            table = cls(values.shape[1], values.shape[0])
+        else:
+            keys = np.load(keys_file, allow_pickle=True)
+            table = cls(values.shape[1], None, init_capacity=max(len(keys), 1))
+            table.index = {key: idx for idx, key in enumerate(keys.tolist())}
+        table.values[:values.shape[0]] = values
+        return table
@@ -1,3 +1,34 @@
+import torch
+
+# 较新版本的torch提供一次处理一组张量的_foreach_*运算，整组参数的更新只需要少数几次kernel调用
+FOREACH_AVAILABLE = hasattr(torch, "_foreach_mul_") and hasattr(torch, "_foreach_add_")
+
+
+def _lerp_(targets, sources, tau):
+    '''
+    targets = tau * sources + (1 - tau) * targets，targets与sources为两组一一对应的张量
+    '''
+    if len(targets) == 0:
+        return
+    if hasattr(torch, "_foreach_lerp_"):
+        torch._foreach_lerp_(targets, sources, tau)
+    elif FOREACH_AVAILABLE:
+        torch._foreach_mul_(targets, 1.0 - tau)
+        torch._foreach_add_(targets, sources, alpha=tau)
+    else:
+        for target, source in zip(targets, sources):
+            target.mul_(1.0 - tau).add_(source, alpha=tau)
+
+
+def _parameter_lists(pairs):
+    targets, sources = [], []
+    for target, source in pairs:
+        target_params, source_params = list(target.parameters()), list(source.parameters())
+        if len(target_params) != len(source_params):
+            raise Exception("目标网络与源网络的参数数量不一致!")
+        targets += target_params
+        sources += source_params
+    return targets, sources
 
 
 def soft_update(target, source, tau):
@@ -9,10 +40,19 @@ def soft_update(target, source, tau):
     :param tau: 更新比率
     :return: None
     '''
-    for target_param, param in zip(target.parameters(), source.parameters()):
-        target_param.data.copy_(
-            target_param.data * (1.0 - tau) + param.data * tau
-        )
+    soft_update_all([(target, source)], tau)
+
+def soft_update_all(pairs, tau):
+    '''
+    将多组(目标网络, 源网络)的参数一起软更新，所有智能体所有层的参数合并为一次multi-tensor运算，
+    kernel调用次数与智能体数量和层数无关
+    :param pairs: [(target, source)]
+    :param tau: 更新比率
+    :return: None
+    '''
+    targets, sources = _parameter_lists(pairs)
+    with torch.no_grad():
+        _lerp_(targets, sources, tau)
 
 def hard_update(target, source):
     '''
@@ -22,5 +62,17 @@ def hard_update(target, source):
     :param source:
     :return:
     '''
-    for target_param, param in zip(target.parameters(),source.parameters()):
-        target_param.data.copy_(param.data)
\ No newline at end of file
+    targets, sources = _parameter_lists([(target, source)])
+    with torch.no_grad():
+        if hasattr(torch, "_foreach_copy_"):
+            torch._foreach_copy_(targets, sources)
+        else:
+            for target_param, param in zip(targets, sources):
+                target_param.copy_(param)
+
+def target_pairs(agents):
+    '''
+    一组DDPGAgent的(目标网络, 网络)对，用于soft_update_all
+    '''
+    return [pair for agent in agents
+            for pair in ((agent.target_actor, agent.actor), (agent.target_critic, agent.critic))]
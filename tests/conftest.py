@@ -0,0 +1,10 @@
+import numpy as np
+import pyglet
+
+# 测试在无显示器的环境中运行，不创建pyglet的隐藏窗口
+pyglet.options["shadow_window"] = False
+
+# requirements.txt固定numpy==1.19.5，在更新的numpy上运行测试时补上已被移除的类型别名
+for name, alias in (("object", object), ("float", float), ("int", int)):
+    if name not in np.__dict__:
+        setattr(np, name, alias)
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from rl.env.batched import BatchedFindGoalsEnv, BatchedFindTreasureEnv, BatchedMoveBoxEnv
+from rl.env.findGoal import EnvFindGoals
+from rl.env.findTreasure import FindTreasureWrapper
+from rl.env.moveBox import MoveBoxWrapper
+
+
+class FindGoalsReference:
+    '''
+    原EnvFindGoals的观察与BatchedFindGoalsEnv.get_observation的格式相同
+    '''
+    resets_itself = False
+
+    def __init__(self):
+        self.env = EnvFindGoals()
+
+    def reset(self):
+        self.env.reset()
+
+    def step(self, actions):
+        return self.env.step(actions)
+
+    def observation(self):
+        return np.array([self.env.get_agt1_obs(), self.env.get_agt2_obs()])
+
+
+class WrapperReference:
+    '''
+    FindTreasureWrapper与MoveBoxWrapper中的原环境，奖励对两个智能体相同
+    '''
+    def __init__(self, wrapper, resets_itself):
+        self.wrapper = wrapper
+        self.resets_itself = resets_itself
+
+    def reset(self):
+        self.wrapper.reset()
+
+    def step(self, actions):
+        reward, done = self.wrapper.wrappedEnv.step(actions)
+        return [reward, reward], done
+
+    def observation(self):
+        return np.array(self.wrapper.get_observation())
+
+
+def run_lockstep(batched, reference, steps, seed=0):
+    '''
+    以相同的随机动作同时推进单个实例的批量环境与原环境，逐步比较观察、奖励与结束标记，
+    批量环境自动重置时原环境也随之重置
+    :return: 环境本身结束的次数与达到最大步数而重置的次数
+    '''
+    rng = np.random.RandomState(seed)
+    obs = batched.reset()
+    reference.reset()
+    assert np.array_equal(obs[0], reference.observation())
+    dones, truncations = 0, 0
+    for step in range(steps):
+        actions = rng.randint(5, size=2)
+        obs, reward, done, info = batched.step(actions[None])
+        ref_reward, ref_done = reference.step(actions.tolist())
+        assert reward[0].tolist() == ref_reward, "第{}步奖励不一致!".format(step)
+        assert done[0].tolist() == [ref_done, ref_done], "第{}步结束标记不一致!".format(step)
+        if info["finished"][0]:
+            if not (ref_done and reference.resets_itself):
+                assert np.array_equal(info["terminal_obs"][0], reference.observation())
+            if ref_done:
+                dones += 1
+            else:
+                truncations += 1
+            reference.reset()
+        else:
+            assert np.array_equal(info["terminal_obs"][0], obs[0])
+        assert np.array_equal(obs[0], reference.observation()), "第{}步观察不一致!".format(step)
+    return dones, truncations
+
+
+def test_batched_find_goals_matches_original():
+    batched = BatchedFindGoalsEnv(1)
+    reference = FindGoalsReference()
+    dones, _ = run_lockstep(batched, reference, 3000)
+    assert dones > 0
+    assert np.array_equal(batched.get_full_obs()[0], reference.env.get_full_obs())
+
+
+def test_batched_find_goals_max_episode_steps():
+    _, truncations = run_lockstep(BatchedFindGoalsEnv(1, max_episode_steps=25), FindGoalsReference(), 300)
+    assert truncations > 0
+
+
+@pytest.mark.parametrize("map_size", [7, 9])
+def test_batched_find_treasure_matches_original(map_size):
+    batched = BatchedFindTreasureEnv(1, map_size, max_episode_steps=50)
+    _, truncations = run_lockstep(batched, WrapperReference(FindTreasureWrapper(map_size), False), 1000)
+    assert truncations > 0
+
+
+def test_batched_move_box_matches_original():
+    batched = BatchedMoveBoxEnv(1, max_episode_steps=100)
+    _, truncations = run_lockstep(batched, WrapperReference(MoveBoxWrapper(), True), 2000)
+    assert truncations > 0
@@ -0,0 +1,78 @@
+import json
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from torch import nn
+
+from rl.utils.checkpoint import CheckpointManager, INDEX_FILE, REPLAY_DIR
+from rl.utils.classes import Experience, Transition
+from rl.utils.metrics import LossHistory
+
+
+def make_agent(seed):
+    torch.manual_seed(seed)
+    agents = []
+    for _ in range(2):
+        actor = nn.Linear(4, 3)
+        agents.append(SimpleNamespace(actor=actor, actor_optimizer=torch.optim.Adam(actor.parameters(), 0.01)))
+    return SimpleNamespace(agents=agents, experience=Experience(12), loss_recoder=LossHistory(),
+                           total_steps_in_train=0, info_handler=None, model=None)
+
+
+def train_episode(agent, episode):
+    for i in range(5):
+        idx = (episode - 1) * 5 + i
+        agent.experience.push(Transition([np.full([4], idx, dtype=np.float32)], [np.eye(3)[i % 3]],
+                                         float(idx), False, [np.full([4], idx + 1, dtype=np.float32)]))
+    for ag in agent.agents:
+        loss = ag.actor(torch.randn([8, 4])).pow(2).mean()
+        ag.actor_optimizer.zero_grad()
+        loss.backward()
+        ag.actor_optimizer.step()
+        agent.loss_recoder.append([loss.item()])
+    agent.total_steps_in_train += 5
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpoint_dir = str(tmp_path)
+    agent = make_agent(0)
+    manager = CheckpointManager(checkpoint_dir, keep_last=2)
+    for episode in range(1, 5):
+        train_episode(agent, episode)
+        if episode == 4:
+            np.random.seed(episode)
+            expected_random = np.random.random()
+            np.random.seed(episode)
+        manager.save(agent, episode)
+    manager.close()
+
+    # 只保留最近两个检查点，经验池中的片段也只保留它们需要的部分
+    with open(os.path.join(checkpoint_dir, INDEX_FILE)) as f:
+        index = json.load(f)
+    assert [ckpt["episode"] for ckpt in index["checkpoints"]] == [3, 4]
+    assert sorted(f for f in os.listdir(checkpoint_dir) if f.endswith(".pt")) == ["ckpt_0000003.pt", "ckpt_0000004.pt"]
+    used = set(file for ckpt in index["checkpoints"] for meta in ckpt["replay"].values()
+               for file, _ in meta["segments"])
+    assert set(os.listdir(os.path.join(checkpoint_dir, REPLAY_DIR))) == used
+    # 第4个检查点的经验池由增量写入的多个片段组成
+    assert len(index["checkpoints"][-1]["replay"]["experience"]["segments"]) > 1
+
+    restored = make_agent(1)
+    manager = CheckpointManager(checkpoint_dir, keep_last=2)
+    assert manager.restore(restored) == 4
+    manager.close()
+    for ag, restored_ag in zip(agent.agents, restored.agents):
+        for p1, p2 in zip(ag.actor.parameters(), restored_ag.actor.parameters()):
+            assert torch.equal(p1, p2)
+        s1, s2 = ag.actor_optimizer.state_dict(), restored_ag.actor_optimizer.state_dict()
+        assert s1["param_groups"] == s2["param_groups"]
+        for key, value in s1["state"].items():
+            for name, tensor in value.items():
+                assert torch.equal(tensor, s2["state"][key][name])
+    assert restored.total_steps_in_train == agent.total_steps_in_train
+    assert list(restored.loss_recoder.data) == list(agent.loss_recoder.data)
+    assert restored.experience.push_count == agent.experience.push_count == 20
+    assert [t.reward for t in restored.experience.recent(12)] == [float(i) for i in range(8, 20)]
+    assert np.random.random() == expected_random
@@ -0,0 +1,44 @@
+import random
+
+import numpy as np
+import pytest
+
+from ped_env.envs import PedsMoveEnv
+from ped_env.pathfinder import AStarPolicy
+from ped_env.utils.maps import get_map
+
+
+def run_episode(map_name, use_contact_listener, steps, use_a_star):
+    random.seed(0)
+    np.random.seed(0)
+    env = PedsMoveEnv(terrain=get_map(map_name), person_num=32, group_size=(4, 4), frame_skipping=8,
+                      maxStep=3000, use_contact_listener=use_contact_listener)
+    obs = env.reset()
+    policy = AStarPolicy(env.terrain) if use_a_star else None
+    rng = np.random.RandomState(1)
+    records = []
+    for _ in range(steps):
+        if use_a_star:
+            actions = policy.step(obs)
+        else:
+            actions = [np.eye(9)[rng.randint(9)] for _ in range(env.agent_count)]
+        obs, rewards, is_done, info = env.step(actions)
+        records.append((env.col_with_wall, env.col_with_agent, [ped.is_done for ped in env.peds],
+                        [(sorted(ped.collide_agents), sorted(ped.collide_obstacles),
+                          sorted(ped.detected_agents), sorted(ped.detected_obstacles)) for ped in env.peds]))
+        if all(is_done):
+            break
+    return records
+
+
+@pytest.mark.parametrize("map_name, steps, use_a_star", [("map_05", 150, False), ("map_12", 100, True)])
+def test_overlap_detector_matches_contact_listener(map_name, steps, use_a_star):
+    listener = run_episode(map_name, True, steps, use_a_star)
+    overlap = run_episode(map_name, False, steps, use_a_star)
+    assert len(listener) == len(overlap)
+    assert listener[-1][0] > 0, "测试的回合中需要发生与墙体的碰撞!"
+    for step, (a, b) in enumerate(zip(listener, overlap)):
+        assert a[0] == b[0], "第{}步col_with_wall不一致!".format(step)
+        assert a[1] == b[1], "第{}步col_with_agent不一致!".format(step)
+        assert a[2] == b[2], "第{}步到达出口的行人不一致!".format(step)
+        assert a[3] == b[3], "第{}步碰撞与探测集合不一致!".format(step)
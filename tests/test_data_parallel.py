@@ -0,0 +1,41 @@
+import copy
+
+import pytest
+import torch
+import torch.distributed as dist
+
+from rl.utils.data_parallel import DataParallelCritics, critic_loss, double_q_critic_loss, sharded_update_step
+from rl.utils.networks.maddpg_network import DoubleQNetworkCritic, MLPNetworkCritic
+
+pytestmark = pytest.mark.skipif(not dist.is_available() or not dist.is_gloo_available(),
+                                reason="需要支持gloo后端的torch.distributed")
+
+
+@pytest.mark.parametrize("critic_cls, loss_fn", [(DoubleQNetworkCritic, double_q_critic_loss),
+                                                  (MLPNetworkCritic, critic_loss)])
+def test_data_parallel_matches_single_process(critic_cls, loss_fn):
+    # 主进程与工作进程都只使用一个线程，保证矩阵运算的累加顺序相同
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    world_size, batch, steps = 2, 64, 20
+    state_dims, action_dims = [8, 8, 8], [3, 3, 3]
+    torch.manual_seed(0)
+    local = critic_cls(state_dims, action_dims, 64)
+    parallel = copy.deepcopy(local)
+    local_opt = torch.optim.Adam(local.parameters(), 0.01)
+    parallel_opt = torch.optim.Adam(parallel.parameters(), 0.01)
+    generator = torch.Generator().manual_seed(1)
+    batches = [(torch.randn([batch, sum(state_dims)], generator=generator),
+                torch.randn([batch, sum(action_dims)], generator=generator),
+                torch.randn([batch], generator=generator)) for _ in range(steps)]
+    dp = DataParallelCritics([parallel], [parallel_opt], loss_fn, world_size, num_threads=1)
+    try:
+        for step, (s, a, target) in enumerate(batches):
+            local_loss = sharded_update_step(local, local_opt, loss_fn, s, a, target, 0.5, world_size)
+            parallel_loss = dp.update_critic(0, s, a, target)
+            assert local_loss == parallel_loss, "第{}步的损失不一致!".format(step)
+    finally:
+        dp.close()
+        torch.set_num_threads(num_threads)
+    for (name, p1), p2 in zip(local.named_parameters(), parallel.parameters()):
+        assert torch.equal(p1, p2), "数据并行更新后{}的参数与单进程更新不一致!".format(name)
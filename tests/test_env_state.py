@@ -0,0 +1,84 @@
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from ped_env.envs import PedsMoveEnv
+from ped_env.utils.maps import get_map
+
+
+def make_env(use_contact_listener):
+    random.seed(0)
+    np.random.seed(0)
+    env = PedsMoveEnv(terrain=get_map("map_05"), person_num=40, group_size=(4, 4), frame_skipping=8,
+                      maxStep=3000, use_contact_listener=use_contact_listener)
+    env.reset()
+    return env
+
+
+def run_branch(env, actions, snapshot_every_step=False):
+    results = []
+    for action in actions:
+        obs, reward, is_done, info = env.step(action)
+        results.append((np.array(obs), np.array(reward), info[1], info[2]))
+        if snapshot_every_step:
+            env.get_state()
+    return results
+
+
+def assert_branches_equal(a, b):
+    assert len(a) == len(b)
+    for step, (x, y) in enumerate(zip(a, b)):
+        assert np.array_equal(x[0], y[0]) and np.array_equal(x[1], y[1]) and x[2:] == y[2:], \
+            "第{}步两个分支不一致，碰撞次数分别为{}与{}!".format(step, x[2:], y[2:])
+
+
+@pytest.mark.parametrize("use_contact_listener", [True, False])
+def test_get_state_has_no_side_effects(use_contact_listener):
+    env = make_env(use_contact_listener)
+    rng = np.random.RandomState(1)
+    actions = [rng.random_sample([env.agent_count, 9]) for _ in range(30)]
+    plain = run_branch(env, actions)
+    snapshotted = run_branch(make_env(use_contact_listener), actions, snapshot_every_step=True)
+    assert_branches_equal(plain, snapshotted)
+
+
+@pytest.mark.parametrize("use_contact_listener", [True, False])
+def test_set_state_restores_into_existing_world(use_contact_listener):
+    env = make_env(use_contact_listener)
+    leader_num = env.agent_count
+    for _ in range(10):
+        env.step(np.random.random([leader_num, 9]))
+    snapshot = env.get_state()
+    for _ in range(20):
+        env.step(np.random.random([leader_num, 9]))
+    world = env.world
+    bodies = {ped.id: ped.body for ped in env.peds if not ped.has_removed}
+    obs = env.set_state(snapshot)
+    assert env.world is world
+    assert all(ped.body is bodies[ped.id] for ped in env.peds if not ped.has_removed and ped.id in bodies)
+    assert len(obs) == leader_num
+    # 恢复后立即保存的快照与原快照相同
+    restored, original = pickle.loads(env.get_state()), pickle.loads(snapshot)
+    for key in ("body_state", "ped_flags", "counters", "distance_to_exit"):
+        assert np.array_equal(restored[key], original[key]), "恢复后的{}与快照不一致!".format(key)
+    assert restored["groups"] == original["groups"]
+    assert restored["collisions"] == original["collisions"]
+    run_branch(env, [np.random.random([leader_num, 9]) for _ in range(5)])
+
+
+@pytest.mark.parametrize("use_contact_listener", [True, False])
+def test_set_state_rebuild_replays_exactly(use_contact_listener):
+    env = make_env(use_contact_listener)
+    leader_num = env.agent_count
+    for _ in range(10):
+        env.step(np.random.random([leader_num, 9]))
+    snapshot = env.get_state()
+    actions = [np.random.random([leader_num, 9]) for _ in range(20)]
+    # 两个分支都从按快照重建的物理世界开始，因此逐步完全一致
+    env.set_state(snapshot, rebuild=True)
+    advanced = run_branch(env, actions)
+    env.set_state(snapshot, rebuild=True)
+    replayed = run_branch(env, actions)
+    assert_branches_equal(advanced, replayed)
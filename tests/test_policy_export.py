@@ -0,0 +1,48 @@
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from ped_env.envs import PedsMoveEnv
+from ped_env.utils.maps import get_map
+from rl.agents.Matd3Agent import MATD3Agent
+from rl.utils.export import export_policy
+from rl.utils.policy_runner import PolicyRunner, make_env
+
+
+def make_agent(discrete=True, share_parameters=False, maxStep=3000):
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    env = PedsMoveEnv(terrain=get_map("map_05"), person_num=16, group_size=(4, 4), discrete=discrete,
+                      frame_skipping=8, maxStep=maxStep)
+    return MATD3Agent(env, capacity=1000, log_dir=None, share_parameters=share_parameters)
+
+
+@pytest.mark.parametrize("discrete, share_parameters", [(True, False), (True, True), (False, False)])
+def test_exported_policy_matches_exploitation_action(tmp_path, discrete, share_parameters):
+    agent = make_agent(discrete, share_parameters)
+    runner = PolicyRunner(export_policy(agent, str(tmp_path / "policy.pt")))
+    assert runner.meta["agent_count"] == agent.env.agent_count
+    assert runner.meta["state_dims"] == list(agent.state_dims)
+    # 离散动作为one-hot，应完全相同；连续动作的矩阵运算在不同批大小下可能有舍入误差
+    same = np.array_equal if discrete else lambda a, b: np.allclose(a, b, atol=1e-6)
+    obs = agent.env.reset()
+    for _ in range(5):
+        expected = agent.get_exploitation_action(obs)
+        actions = runner.act(obs)
+        assert same(actions, expected)
+        # 一批观测合并为一次前向运算的结果与逐个计算相同
+        assert same(runner.act_batch([obs, obs])[1], actions)
+        obs, reward, is_done, info = agent.env.step(expected)
+
+
+def test_policy_runner_evaluates_recreated_envs(tmp_path):
+    agent = make_agent(maxStep=80)
+    runner = PolicyRunner(export_policy(agent, str(tmp_path / "policy.pt")))
+    envs = [make_env(runner.meta["env"]) for _ in range(2)]
+    assert all(env.agent_count == agent.env.agent_count and env.terrain.name == "map_05" for env in envs)
+    results = runner.evaluate(envs, episodes=3)
+    assert len(results) == 3
+    assert all(result["steps"] > 0 and "collision_wall_agent" in result for result in results)
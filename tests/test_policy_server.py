@@ -0,0 +1,136 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pytest
+import torch
+
+from ped_env.envs import PedsMoveEnv
+from ped_env.utils.maps import get_map
+from rl.agents.Matd3Agent import MATD3Agent
+from rl.utils.export import export_policy
+from rl.utils.policy_runner import PolicyRunner
+from rl.utils.policy_server import PolicyClient, PolicyServer
+
+
+@pytest.fixture
+def bundle():
+    # Unix socket的路径长度有限，不使用pytest较长的tmp_path
+    directory = tempfile.mkdtemp(prefix="ps")
+    random.seed(0)
+    np.random.seed(0)
+    torch.manual_seed(0)
+    env = PedsMoveEnv(terrain=get_map("map_05"), person_num=16, group_size=(4, 4), discrete=True,
+                      frame_skipping=8, maxStep=3000)
+    agent = MATD3Agent(env, capacity=1000, log_dir=None)
+    file = export_policy(agent, os.path.join(directory, "policy.pt"))
+    yield file, os.path.join(directory, "policy.sock"), env.reset()
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "等待超时!"
+        time.sleep(0.01)
+
+
+def test_clients_match_policy_runner(bundle):
+    file, socket_path, obs = bundle
+    runner = PolicyRunner(file)
+    obs_dim = sum(runner.state_dims)
+    rng = np.random.RandomState(0)
+    inputs = [rng.randn(rows, obs_dim).astype(np.float32) for rows in (1, 3, 5, 7, 2, 4)]
+    results, errors = [None] * len(inputs), []
+
+    def run(i):
+        try:
+            client = PolicyClient(socket_path, timeout=10.0)
+            try:
+                results[i] = [client.forward(inputs[i]) for _ in range(5)]
+            finally:
+                client.close()
+        except Exception as e:
+            errors.append(e)
+
+    server = PolicyServer(file, socket_path, max_delay=0.01).start()
+    try:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+        for x, result in zip(inputs, results):
+            for actions in result:
+                np.testing.assert_array_equal(actions, runner.forward(x))
+
+        client = PolicyClient(socket_path, timeout=10.0)
+        assert client.meta == runner.meta
+        np.testing.assert_array_equal(client.act(obs), runner.act(obs))
+        np.testing.assert_array_equal(client.act_batch([obs, obs]), runner.act_batch([obs, obs]))
+        with pytest.raises(Exception, match="维数"):
+            client.forward(np.zeros([1, obs_dim + 1], dtype=np.float32))
+        # 维数错误后连接仍然可用
+        np.testing.assert_array_equal(client.act(obs), runner.act(obs))
+        stats = client.stats()
+        assert stats["requests"] == len(inputs) * 5 + 3
+        assert stats["queue_depth"] == 0
+        client.close()
+    finally:
+        server.close()
+    assert not os.path.exists(socket_path)
+
+
+def test_close_fails_pending_requests_and_closes_connections(bundle):
+    file, socket_path, obs = bundle
+    server = PolicyServer(file, socket_path, max_delay=0.0).start()
+    obs_dim = sum(server.runner.state_dims)
+    # 让第一批的前向运算阻塞，使第二个请求留在队列中
+    forward, entered, release = server.runner.forward, threading.Event(), threading.Event()
+
+    def blocking_forward(x):
+        entered.set()
+        release.wait()
+        return forward(x)
+
+    server.runner.forward = blocking_forward
+    idle = PolicyClient(socket_path, timeout=10.0)
+    outcomes = {}
+
+    def run(name):
+        client = PolicyClient(socket_path, timeout=10.0)
+        try:
+            outcomes[name] = client.forward(np.zeros([1, obs_dim], dtype=np.float32))
+        except Exception as e:
+            outcomes[name] = e
+        finally:
+            client.close()
+
+    first = threading.Thread(target=run, args=("first",))
+    first.start()
+    assert entered.wait(5.0)
+    second = threading.Thread(target=run, args=("second",))
+    second.start()
+    wait_until(lambda: server.requests.qsize() == 1)
+
+    closing = threading.Thread(target=server.close)
+    closing.start()
+    wait_until(lambda: not server.running)
+    release.set()
+    closing.join(5.0)
+    assert not closing.is_alive()
+    first.join(5.0)
+    second.join(5.0)
+    assert isinstance(outcomes["first"], np.ndarray)
+    assert isinstance(outcomes["second"], Exception) and "已关闭" in str(outcomes["second"])
+    # 所有连接线程已结束，空闲的客户端连接被关闭
+    assert server.connections == {}
+    with pytest.raises((ConnectionError, OSError)):
+        idle.forward(np.zeros([1, obs_dim], dtype=np.float32))
+    idle.close()
+    assert server.submit(np.zeros([1, obs_dim], dtype=np.float32)).error == "推理服务已关闭!"
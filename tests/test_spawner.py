@@ -0,0 +1,28 @@
+import random
+
+import numpy as np
+import pytest
+
+from ped_env.envs import PedsMoveEnv
+from ped_env.objects import Person
+from ped_env.utils.maps import get_map
+
+
+@pytest.mark.parametrize("map_name, person_num", [("map_05", 120), ("map_12", 200)])
+def test_spawned_crowd_does_not_overlap(map_name, person_num):
+    random.seed(0)
+    np.random.seed(0)
+    terrain = get_map(map_name)
+    env = PedsMoveEnv(terrain=terrain, person_num=person_num, group_size=(4, 4), frame_skipping=8,
+                      maxStep=3000, overlap_free_spawn=True)
+    env.reset()
+    pos = np.array([(ped.getX, ped.getY) for ped in env.peds])
+    assert len(pos) == person_num
+    # 行人之间不重叠
+    dis = np.sqrt(np.sum(np.square(pos[:, None, :] - pos[None, :, :]), axis=-1))
+    np.fill_diagonal(dis, np.inf)
+    assert dis.min() >= 2 * Person.radius
+    # 行人与墙体、障碍物以及出口所在的格子都不重叠
+    blocked = np.argwhere(terrain.map != 0)
+    gap = np.maximum(np.abs(pos[:, None, :] - (blocked[None, :, :] + 0.5)) - 0.5, 0.0)
+    assert np.sqrt(np.sum(np.square(gap), axis=-1)).min() >= Person.radius
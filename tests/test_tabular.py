@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+
+from rl.env.gridworld import WindyGridWorld
+from rl.utils.tabular import TabularQ
+
+
+def run_sarsa_lambda(q_values, reset_traces, update, episodes=30, max_steps=200,
+                     alpha=0.1, gamma=0.9, lambda_=0.8, epsilon=0.1):
+    '''
+    在有风格子世界中运行SARSA(λ)，q_values()返回当前的Q表，update(s, a, step, decay)完成一步资格迹更新
+    '''
+    env = WindyGridWorld()
+    rng = random.Random(0)
+
+    def policy(s):
+        if rng.random() < epsilon:
+            return rng.randrange(env.action_space.n)
+        return int(np.argmax(q_values()[s]))
+
+    for _ in range(episodes):
+        s0 = env.reset()
+        a0 = policy(s0)
+        reset_traces()
+        for _ in range(max_steps):
+            s1, r1, is_done, _ = env.step(a0)
+            a1 = policy(s1)
+            delta = r1 + gamma * q_values()[s1, a1] - q_values()[s0, a0]
+            update(s0, a0, alpha * delta, gamma * lambda_)
+            s0, a0 = s1, a1
+            if is_done:
+                break
+
+
+def test_sparse_traces_match_dense_loop_with_zero_threshold():
+    env = WindyGridWorld()
+    n_states, n_actions = env.observation_space.n, env.action_space.n
+    # 原先的稠密实现：每一步对整个Q表与资格迹数组进行更新
+    dense_q, dense_e = np.zeros([n_states, n_actions]), np.zeros([n_states, n_actions])
+
+    def dense_reset():
+        dense_e[:] = 0.0
+
+    def dense_update(s, a, step, decay):
+        dense_e[s, a] += 1
+        dense_q[:] += step * dense_e
+        dense_e[:] *= decay
+
+    run_sarsa_lambda(lambda: dense_q, dense_reset, dense_update)
+    table = TabularQ(n_actions, n_states, traces=True, trace_threshold=0)
+    run_sarsa_lambda(lambda: table.values, table.reset_traces, table.update_traces)
+
+    assert np.count_nonzero(dense_q) > 0
+    assert np.array_equal(table.values, dense_q)
+
+
+def test_save_load_discrete_states(tmp_path):
+    table = TabularQ(4, 10)
+    table.values[:] = np.random.RandomState(0).randn(10, 4)
+    file = table.save(str(tmp_path / "q.npy"))
+    loaded = TabularQ.load(file)
+    assert loaded.index is None and len(loaded) == 10
+    assert np.array_equal(loaded.values, table.values)
+    assert loaded.greedy(3) == table.greedy(3)
+
+
+def test_save_load_hashed_states(tmp_path):
+    table = TabularQ(3, init_capacity=2)
+    rng = np.random.RandomState(0)
+    states = [np.array([i, i + 1], dtype=np.float32) for i in range(5)] + [(1, 2), "terminal", ((0, 1), 2)]
+    for s in states:
+        for a in range(3):
+            table.set(s, a, rng.randn())
+    file = table.save(str(tmp_path / "q.npy"))
+    loaded = TabularQ.load(file)
+    assert len(loaded) == len(table) == len(states)
+    for s in states:
+        assert loaded.state_index(s, False) == table.state_index(s, False)
+        assert np.array_equal(loaded.row(s), table.row(s))
+    # 加载后新出现的状态仍然按顺序分配编号
+    assert loaded.state_index(np.array([9, 9], dtype=np.float32)) == len(states)
+    assert loaded.get(np.array([0, 1], dtype=np.float64), 0) == 0.0